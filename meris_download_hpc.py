@@ -9,6 +9,8 @@
 #
 # Queries and downloads MERIS Level 2 Full Resolution Full Swath Geophysical Product for Ocean, Land and Atmosphere from NASA EarthData Search
 # Recommend batching downloads by year to avoid hitting data download limit errors if working with multi-year datasets
+# Granules are stored once in base_download_dir/_store; each batch folder holds links to them, so
+#   granules repeated across file lists are only downloaded (and stored) once
 # 
 # -------------
 # BEFORE USING
@@ -24,9 +26,9 @@
 # -----------------
 # USERS MUST EDIT 
 # -----------------
-# file_lists starting ~line 54
-# base_download_dir ~line 69
-# base_log_dir ~line 70
+# file_lists starting ~line 56
+# base_download_dir ~line 62
+# base_log_dir ~line 63
 #
 # -----------------------------------------------------
 # BATCH OPTIONS (specify in corresponding shell script) 
@@ -39,12 +41,12 @@
 """
 
 # Packages
-import os
 from pathlib import Path
 import csv
 from datetime import datetime
+
+from meris_granule_store import fetch_granule, open_store, plan_downloads
 import argparse
-import earthaccess
 
 # -------------------
 # USER SETTINGS
@@ -60,20 +62,23 @@ file_lists = {
 base_download_dir = Path("/nobackup/amulcan/data/meris/downloads")
 base_log_dir = Path("/nobackup/amulcan/data/meris/logs")
 
-# Ensure directories exist
-base_download_dir.mkdir(parents=True, exist_ok=True)
-base_log_dir.mkdir(parents=True, exist_ok=True)
-
 # Master summary log
 master_log_csv = base_log_dir / "master_download_log.csv"
 
 # -------------------
-# Authenticate using .netrc
+# Shared granule store (see meris_granule_store.py)
 # -------------------
-earthaccess.login(strategy="netrc")
+# Importing this module has no side effects: directories are created at run time
+# and earthaccess is logged into on the first actual download.
+
+
+def ensure_directories():
+    """Create the download and log directories."""
+    base_download_dir.mkdir(parents=True, exist_ok=True)
+    base_log_dir.mkdir(parents=True, exist_ok=True)
 
 
-def process_urls(batch_name, urls, download_dir, log_csv_path, mode="normal"):
+def process_urls(batch_name, urls, download_dir, log_csv_path, store_dir, index, mode="normal"):
     """Process a list of URLs for a batch (normal run or resume)."""
     log_exists = log_csv_path.exists()
     with open(log_csv_path, "a", newline="") as log_file, \
@@ -93,50 +98,18 @@ def process_urls(batch_name, urls, download_dir, log_csv_path, mode="normal"):
                 continue
 
             filename = Path(url).name
-            local_file = download_dir / filename
-
-            # Skip already downloaded
-            if local_file.exists() and local_file.stat().st_size > 0:
-                print(f" Skipping already downloaded file: {filename}")
-                status = "skipped (already exists)"
-                entry = [datetime.now().isoformat(), batch_name, url, filename, status]
-                writer.writerow(entry)
-                master_writer.writerow(entry)
-                continue
-
-            print(f"\n Starting download: {filename}")
-
-            try:
-                downloaded_paths = earthaccess.download(
-                    url,
-                    local_path=str(download_dir)
-                )
 
-                if downloaded_paths and Path(downloaded_paths[0]).exists():
-                    print(f"✅ Download complete: {filename}")
-                    status = "success"
-                else:
-                    print(f"❌ Download failed: {filename}")
-                    status = "failed"
-
-            except Exception as e:
-                print(f"❌ Error: {e}")
-                status = f"error: {str(e)}"
+            # Skips (and links) granules already in the shared store
+            status = fetch_granule(url, download_dir, store_dir, index)
 
             entry = [datetime.now().isoformat(), batch_name, url, filename, status]
             writer.writerow(entry)
             master_writer.writerow(entry)
 
 
-def process_batch(batch_name: str, file_list: Path, resume=False):
-    """Run a full batch download, or resume failed ones."""
-    download_dir = base_download_dir / batch_name
+def read_batch_urls(batch_name: str, file_list: Path, resume=False):
+    """URLs to process for a batch: the full file list, or only failed ones on resume."""
     log_csv_path = base_log_dir / f"{batch_name}_download_log.csv"
-    download_dir.mkdir(parents=True, exist_ok=True)
-
-    print(f"\n Starting batch: {batch_name}")
-    print(f"  Download dir: {download_dir}")
-    print(f"  Log file: {log_csv_path}")
 
     urls = []
     if resume and log_csv_path.exists():
@@ -148,14 +121,26 @@ def process_batch(batch_name: str, file_list: Path, resume=False):
                     urls.append(row["url"])
         if not urls:
             print(f"✅ No failed downloads to retry for {batch_name}.")
-            return
-        print(f"🔄 Resuming {len(urls)} failed downloads...")
+        else:
+            print(f"🔄 Resuming {len(urls)} failed downloads for {batch_name}...")
     else:
         # Normal mode: read full file list
         with open(file_list, "r") as f:
             urls = [line.strip() for line in f if line.strip()]
+    return urls
+
+
+def process_batch(batch_name: str, urls, store_dir: Path, index: dict):
+    """Run a full batch download, or resume failed ones."""
+    download_dir = base_download_dir / batch_name
+    log_csv_path = base_log_dir / f"{batch_name}_download_log.csv"
+    download_dir.mkdir(parents=True, exist_ok=True)
 
-    process_urls(batch_name, urls, download_dir, log_csv_path)
+    print(f"\n Starting batch: {batch_name}")
+    print(f"  Download dir: {download_dir}")
+    print(f"  Log file: {log_csv_path}")
+
+    process_urls(batch_name, urls, download_dir, log_csv_path, store_dir, index)
 
 
 if __name__ == "__main__":
@@ -172,9 +157,22 @@ if __name__ == "__main__":
     else:
         parser.error("You must specify --all or --file_list with one or more batch numbers.")
 
+    ensure_directories()
+
+    # Read every selected list first so duplicates across lists are known
+    # before any transfer starts
+    batches, granule_names = {}, set()
     for batch in batches_to_run:
         if batch in file_lists and file_lists[batch].exists():
-            process_batch(f"file_list{batch}", file_lists[batch], resume=args.resume)
+            granule_names |= {Path(url).name for url in read_batch_urls(f"file_list{batch}", file_lists[batch])}
+            urls = read_batch_urls(f"file_list{batch}", file_lists[batch], resume=args.resume)
+            if urls:
+                batches[f"file_list{batch}"] = urls
         else:
             print(f" Skipping: file_list{batch} (file not found)")
 
+    store_dir, index = open_store(base_download_dir, granule_names)
+    plan_downloads(batches, index)
+
+    for batch_name, urls in batches.items():
+        process_batch(batch_name, urls, store_dir, index)
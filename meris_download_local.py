@@ -9,6 +9,8 @@
 #
 # Queries and downloads MERIS Level 2 Full Resolution Full Swath Geophysical Product for Ocean, Land and Atmosphere from NASA EarthData Search
 # Recommend batching downloads by year to avoid hitting data download limit errors if working with multi-year datasets
+# Granules are stored once in base_download_dir/_store; each batch folder holds links to them, so
+#   granules repeated across file lists are only downloaded (and stored) once
 # 
 # -------------
 # BEFORE USING
@@ -24,18 +26,18 @@
 # -----------------
 # USERS MUST EDIT 
 # -----------------
-# file_lists starting ~line 43
-# base_download_dir ~line 49
-# base_log_dir ~line 50
+# file_lists starting ~line 45
+# base_download_dir ~line 51
+# base_log_dir ~line 52
 # 
 """
 
 # Packages
-import os
 from pathlib import Path
 import csv
 from datetime import datetime
-import earthaccess
+
+from meris_granule_store import fetch_granule, open_store, plan_downloads
 
 # -------------------
 # USER SETTINGS
@@ -49,23 +51,26 @@ file_lists = [
 base_download_dir = Path("/Users/lopezama/Documents/Blackwood/MERIS/scripts/workflow_tests/pleiades3/data")
 base_log_dir = Path("/Users/lopezama/Documents/Blackwood/MERIS/scripts/workflow_tests/pleiades3/logs")
 
-# Ensure directories exist
-base_download_dir.mkdir(parents=True, exist_ok=True)
-base_log_dir.mkdir(parents=True, exist_ok=True)
-
 # Master summary log
 master_log_csv = base_log_dir / "master_download_log.csv"
 
 # -------------------
-# Authenticate using .netrc
+# Shared granule store (see meris_granule_store.py)
 # -------------------
-earthaccess.login(strategy="netrc")
+# Importing this module has no side effects: directories are created at run time
+# and earthaccess is logged into on the first actual download.
+
+
+def ensure_directories():
+    """Create the download and log directories."""
+    base_download_dir.mkdir(parents=True, exist_ok=True)
+    base_log_dir.mkdir(parents=True, exist_ok=True)
 
 
 # -------------------
 # Helper: process one batch
 # -------------------
-def process_batch(file_list: Path):
+def process_batch(file_list: Path, store_dir: Path, index: dict):
     batch_name = file_list.stem  # e.g., "test_list1"
     download_dir = base_download_dir / batch_name
     log_csv_path = base_log_dir / f"{batch_name}_download_log.csv"
@@ -97,35 +102,9 @@ def process_batch(file_list: Path):
                     continue
 
                 filename = Path(url).name
-                local_file = download_dir / filename
-
-                # Skip if already downloaded
-                if local_file.exists() and local_file.stat().st_size > 0:
-                    print(f"⏩ Skipping already downloaded file: {filename}")
-                    status = "skipped (already exists)"
-                    entry = [datetime.now().isoformat(), batch_name, url, filename, status]
-                    writer.writerow(entry)
-                    master_writer.writerow(entry)
-                    continue
-
-                print(f"\n Starting download: {filename}")
-
-                try:
-                    downloaded_paths = earthaccess.download(
-                        url,
-                        local_path=str(download_dir)
-                    )
 
-                    if downloaded_paths and Path(downloaded_paths[0]).exists():
-                        print(f"✅ Download complete: {filename}")
-                        status = "success"
-                    else:
-                        print(f"❌ Download failed: {filename}")
-                        status = "failed"
-
-                except Exception as e:
-                    print(f"❌ Error: {e}")
-                    status = f"error: {str(e)}"
+                # Skips (and links) granules already in the shared store
+                status = fetch_granule(url, download_dir, store_dir, index)
 
                 # Build log entry
                 entry = [datetime.now().isoformat(), batch_name, url, filename, status]
@@ -140,11 +119,27 @@ def process_batch(file_list: Path):
 # -------------------
 # Run all batches
 # -------------------
-for fl in file_lists:
-    if fl.exists():
-        process_batch(fl)
-    else:
-        print(f"⚠️ Skipping missing file list: {fl}")
+def main():
+    ensure_directories()
+
+    batches = {}
+    for fl in file_lists:
+        if fl.exists():
+            with open(fl, "r") as f:
+                batches[fl] = [line.strip() for line in f if line.strip()]
+        else:
+            print(f"⚠️ Skipping missing file list: {fl}")
+
+    granule_names = {Path(url).name for urls in batches.values() for url in urls}
+    store_dir, index = open_store(base_download_dir, granule_names)
+    plan_downloads(batches, index)
+
+    for fl in batches:
+        process_batch(fl, store_dir, index)
+
+    print("\n All batches processed!")
+
 
-print("\n All batches processed!")
+if __name__ == "__main__":
+    main()
 
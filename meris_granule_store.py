@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+# MERIS Level 2 Data Downloader - shared granule store
+# Contact: Mandy M. Lopez amanda.m.lopez@jpl.nasa.gov
+#
+# Helpers shared by meris_download_local.py and meris_download_hpc.py (keep
+# this file next to them).
+#
+# Every granule is stored once, by file name (the granule ID), in
+# base_download_dir / "_store". Batch directories only hold hard links (or
+# symlinks where hard links are not possible) into the store, so a granule
+# listed in several file lists is downloaded and stored once. The store is
+# listed once per run into an in-memory index instead of a stat per URL.
+"""
+
+# Packages
+import os
+from pathlib import Path
+
+STORE_DIR_NAME = "_store"
+
+# -------------------
+# Authenticate using .netrc
+# -------------------
+# Importing this module has no side effects: earthaccess is imported and
+# logged into on the first actual download, so runs where every file is
+# already on disk never touch the network.
+_earthaccess = None
+
+
+def get_earthaccess():
+    """Import earthaccess and log in with .netrc on first use."""
+    global _earthaccess
+    if _earthaccess is None:
+        import earthaccess
+        earthaccess.login(strategy="netrc")
+        _earthaccess = earthaccess
+    return _earthaccess
+
+
+def is_granule_file(name, granule_names):
+    """True for granule archives: names from the file lists, or any .zip/.ZIP."""
+    return name in granule_names or name.lower().endswith(".zip")
+
+
+def build_store_index(store_dir):
+    """Lists the store once: returns {filename: size} of complete (non-empty) files."""
+    index = {}
+    if store_dir.exists():
+        with os.scandir(store_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.stat().st_size > 0:
+                    index[entry.name] = entry.stat().st_size
+    return index
+
+
+def link_into_batch(store_path, batch_path):
+    """Exposes a stored granule in a batch directory as a hard link, or a symlink as fallback."""
+    if batch_path.exists() or batch_path.is_symlink():
+        return
+    try:
+        os.link(store_path, batch_path)
+    except OSError:
+        os.symlink(store_path, batch_path)
+
+
+def adopt_batch_files(base_download_dir, store_dir, index, granule_names=()):
+    """
+    Moves granules downloaded into batch directories before the shared store
+    existed into the store (linking them back), so they count as present.
+    Only granule archives are touched (see is_granule_file()); a batch copy
+    of an already stored granule is only replaced by a link when both have
+    the same size. Returns how many files were adopted.
+    """
+    adopted = 0
+    for batch_dir in base_download_dir.iterdir():
+        if not batch_dir.is_dir() or batch_dir == store_dir:
+            continue
+        with os.scandir(batch_dir) as entries:
+            for entry in entries:
+                if entry.is_symlink() or not entry.is_file() or entry.stat().st_size == 0:
+                    continue
+                if not is_granule_file(entry.name, granule_names):
+                    continue
+                store_path = store_dir / entry.name
+                if entry.name in index:
+                    if os.path.samefile(entry.path, store_path):
+                        continue  # already a link into the store
+                    if entry.stat().st_size != index[entry.name]:
+                        print(f"⚠️ Keeping {entry.path}: size differs from the stored copy")
+                        continue
+                    os.unlink(entry.path)  # duplicate copy of a stored granule
+                else:
+                    os.replace(entry.path, store_path)
+                    index[entry.name] = store_path.stat().st_size
+                    adopted += 1
+                link_into_batch(store_path, Path(entry.path))
+    return adopted
+
+
+def open_store(base_download_dir, granule_names=()):
+    """Creates the store, adopts legacy batch downloads and returns (store_dir, index)."""
+    store_dir = base_download_dir / STORE_DIR_NAME
+    store_dir.mkdir(parents=True, exist_ok=True)
+    index   = build_store_index(store_dir)
+    adopted = adopt_batch_files(base_download_dir, store_dir, index, set(granule_names))
+    if adopted:
+        print(f" Moved {adopted} previously downloaded file(s) into the shared store")
+    return store_dir, index
+
+
+def plan_downloads(batches, index):
+    """
+    Cross-batch deduplication before any transfer: batches maps batch names
+    to URL lists. Prints how many unique granules are requested, how many
+    are already stored and how many duplicates across lists are avoided.
+    """
+    requested = [Path(url).name for urls in batches.values() for url in urls]
+    unique    = set(requested)
+    missing   = unique - set(index)
+    print(f"\n Requested: {len(requested)} file(s) in {len(batches)} batch(es), {len(unique)} unique granule(s)")
+    print(f"  Already in store: {len(unique) - len(missing)} | to download: {len(missing)}"
+          f" | cross-list duplicates avoided: {len(requested) - len(unique)}")
+    return missing
+
+
+def fetch_granule(url, download_dir, store_dir, index):
+    """
+    Makes one granule available in a batch directory, downloading it into
+    the store only if the index does not already have it. Returns the log status.
+    """
+    filename = Path(url).name
+    if filename in index:
+        link_into_batch(store_dir / filename, download_dir / filename)
+        print(f"⏩ Skipping already downloaded file: {filename}")
+        return "skipped (already exists)"
+
+    print(f"\n Starting download: {filename}")
+    try:
+        downloaded_paths = get_earthaccess().download(
+            url,
+            local_path=str(store_dir)
+        )
+
+        if downloaded_paths and Path(downloaded_paths[0]).exists():
+            index[filename] = Path(downloaded_paths[0]).stat().st_size
+            link_into_batch(store_dir / filename, download_dir / filename)
+            print(f"✅ Download complete: {filename}")
+            return "success"
+        print(f"❌ Download failed: {filename}")
+        return "failed"
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return f"error: {str(e)}"
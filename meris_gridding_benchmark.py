@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+MERIS STEP 4 GRIDDING BENCHMARK: KD-TREE VS FORWARD BINNING
+==============================================================================
+
+Times the two Step 4 gridding backends of meris_process_local.py on real
+product folders and reports how closely their grids agree:
+
+    python meris_gridding_benchmark.py /path/to/data/ENV_ME_2_FRG____2003*.SEN3
+    python meris_gridding_benchmark.py /path/to/granule.SEN3 --roi-shape roi.shp --repeats 5
+
+For each granule, the product (TSM_NN by default) is decoded and masked once
+with the chosen masking strategy. Each backend is then timed end to end,
+from geolocation read through index build and sampling, with the granule
+cache disabled:
+  kdtree  : SwathDefinition + kd_tree.get_neighbour_info (radius 5 km) + 'nn' sample
+  binning : per-pixel target cell index + np.bincount mean/count
+The best of --repeats runs is reported. Agreement is measured on cells
+valid in both grids:
+  coverage     : valid cells of each backend
+  median |rel| : median relative difference
+  r            : Pearson correlation of log10 values
+==============================================================================
+"""
+
+import io
+import time
+import argparse
+import contextlib
+import warnings
+from pathlib import Path
+import numpy as np
+
+import meris_process_local as mp
+
+
+# ==============================================================================
+# BENCHMARK
+# ==============================================================================
+
+def best_time(func, repeats):
+    """Returns (best wall time in seconds, result of the last call)."""
+    best, result = None, None
+    for _ in range(repeats):
+        start  = time.perf_counter()
+        result = func()
+        took   = time.perf_counter() - start
+        best   = took if best is None else min(best, took)
+    return best, result
+
+
+def compare_grids(reference, candidate):
+    """Agreement statistics between two gridded arrays (NaN = no data)."""
+    both = np.isfinite(reference) & np.isfinite(candidate) & (reference > 0) & (candidate > 0)
+    stats = {
+        'kdtree_cells':  int(np.isfinite(reference).sum()),
+        'binning_cells': int(np.isfinite(candidate).sum()),
+        'common_cells':  int(both.sum()),
+        'median_rel':    np.nan,
+        'r_log10':       np.nan,
+    }
+    if both.sum() > 1:
+        ref, cand = reference[both], candidate[both]
+        stats['median_rel'] = float(np.median(np.abs(cand - ref) / ref))
+        stats['r_log10']    = float(np.corrcoef(np.log10(ref), np.log10(cand))[0, 1])
+    return stats
+
+
+def benchmark_granule(product_dir, product, flag_list, roi_bounds, res_deg, gap_fill, repeats):
+    product_dir = Path(product_dir)
+    window = None
+    if roi_bounds is not None:
+        window = mp.find_roi_window(product_dir, roi_bounds)
+        if window is None:
+            print(f"⏩ {product_dir.name}: no overlap with ROI bounding box — skipping")
+            return None
+
+    with contextlib.redirect_stdout(io.StringIO()):   # per-flag pixel counts are not of interest here
+        masked_ds, _ = mp.mask_products({product: product_dir / mp.PRODUCTS[product]['file']},
+                                        product_dir / "common_flags.nc", product_dir / "wqsf.nc",
+                                        flag_list, window=window)
+    values   = masked_ds[product].values.squeeze().astype(np.float32)
+    masked_ds.close()
+    geo_path = product_dir / "geo_coordinates.nc"
+
+    def run_kdtree():
+        from pyresample import kd_tree as kdt
+
+        grid, index, outdex, index_array = mp.get_neighbour_indices(geo_path, window, res_deg)
+        return kdt.get_sample_from_neighbour_info(
+            'nn', (grid['rows'], grid['cols']), values, index, outdex, index_array, fill_value=np.nan
+        ).astype(np.float32)
+
+    def run_binning():
+        grid, cell_index = mp.get_bin_indices(geo_path, window, res_deg)
+        mean, _ = mp.bin_swath(values, cell_index, grid)
+        return mp.fill_gaps(mean, gap_fill) if gap_fill > 0 else mean
+
+    t_kdtree,  kdtree_grid  = best_time(run_kdtree,  repeats)
+    t_binning, binning_grid = best_time(run_binning, repeats)
+    stats = compare_grids(kdtree_grid, binning_grid)
+    stats.update(granule=product_dir.name, pixels=values.size,
+                 t_kdtree=t_kdtree, t_binning=t_binning)
+
+    print(f"📂 {product_dir.name}  ({values.size:,} swath px → {kdtree_grid.size:,} cells)")
+    print(f"   kdtree : {t_kdtree:8.3f} s   valid cells {stats['kdtree_cells']:,}")
+    print(f"   binning: {t_binning:8.3f} s   valid cells {stats['binning_cells']:,}"
+          f"   speed-up ×{t_kdtree / t_binning:.1f}")
+    print(f"   agreement on {stats['common_cells']:,} common cells: "
+          f"median |rel| = {stats['median_rel']:.4f}, r(log10) = {stats['r_log10']:.4f}")
+    return stats
+
+
+# ==============================================================================
+# MAIN
+# ==============================================================================
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark Step 4 gridding backends (kdtree vs binning).")
+    parser.add_argument("product_dirs", nargs="+", help="Extracted MERIS product folders (.SEN3).")
+    parser.add_argument("--product", default="TSM_NN", choices=sorted(mp.PRODUCTS),
+                         help="Product variable to grid (default: TSM_NN).")
+    parser.add_argument("--masking-strategy", default="recommended",
+                         choices=["recommended", "cloud_only", "custom"],
+                         help="Quality-flag masking strategy applied before gridding (default: recommended).")
+    parser.add_argument("--roi-shape", default=None,
+                         help="Optional ROI shapefile; only the swath window overlapping its bounding box is gridded.")
+    parser.add_argument("--res-deg", type=float, default=0.0027,
+                         help="Target grid resolution in degrees (default: 0.0027).")
+    parser.add_argument("--gap-fill", type=int, default=0,
+                         help="Gap-fill passes applied to the binned grid (default: 0).")
+    parser.add_argument("--repeats", type=int, default=3,
+                         help="Timed runs per backend; the best is reported (default: 3).")
+    return parser.parse_args()
+
+
+def main():
+    warnings.filterwarnings('ignore')
+    args = parse_args()
+
+    flag_list  = mp.get_flag_list(args.masking_strategy)
+    roi_bounds = mp.get_roi_bounds(args.roi_shape) if args.roi_shape else None
+
+    print("\n" + "="*60)
+    print("STEP 4 GRIDDING BENCHMARK: KD-TREE VS FORWARD BINNING")
+    print("="*60)
+    print(f"Product: {args.product} | resolution: {args.res_deg}° | gap fill: {args.gap_fill} | "
+          f"repeats: {args.repeats}\n")
+
+    results = []
+    for product_dir in args.product_dirs:
+        stats = benchmark_granule(product_dir, args.product, flag_list, roi_bounds,
+                                  args.res_deg, args.gap_fill, args.repeats)
+        if stats is not None:
+            results.append(stats)
+
+    if results:
+        t_kdtree  = sum(r['t_kdtree']  for r in results)
+        t_binning = sum(r['t_binning'] for r in results)
+        print(f"\n{'='*60}")
+        print(f"TOTAL ({len(results)} granules): kdtree {t_kdtree:.2f} s | binning {t_binning:.2f} s"
+              f" | speed-up ×{t_kdtree / t_binning:.1f}")
+        print(f"Median |rel| across granules: {np.nanmedian([r['median_rel'] for r in results]):.4f}")
+        print(f"{'='*60}\n")
+
+
+if __name__ == "__main__":
+    main()
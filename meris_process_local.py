@@ -10,6 +10,19 @@ directly with:
 
     python meris_tsm_workflow.py
     python meris_tsm_workflow.py --base-directory /path/to/data --masking-strategy cloud_only
+    python meris_tsm_workflow.py --mode rolling --disk-budget-gb 200
+    python meris_tsm_workflow.py --mode worker    # on each node, after --mode enqueue
+    python meris_tsm_workflow.py --mode daemon --watch-dir /path/to/downloads
+    python meris_tsm_workflow.py --mode daily --gridding binning
+    python meris_tsm_workflow.py --mode tiled --tile-size-deg 0.5 --workers 8
+    python meris_tsm_workflow.py --steps 6        # only rebuild the daily mosaics
+
+It can also be imported as a library: process_granule() and mosaic() run
+Steps 3–4 and 6 on in-memory xarray objects (see IN-MEMORY LIBRARY API).
+
+Heavy dependencies (xarray, pyresample, geopandas, rioxarray, rasterio) are
+imported inside the functions that use them, so a run only pays for the
+libraries its steps need.
 
 Differences from the Sentinel-3 version this was adapted from:
   1. Raw archives are delivered as ".ZIP" (uppercase) instead of ".zip".
@@ -26,10 +39,32 @@ Differences from the Sentinel-3 version this was adapted from:
 WORKFLOW OVERVIEW:
   Step 1: Unzip raw .ZIP/.zip files and delete originals
   Step 2: Clean up netCDF files (keep only needed variables)
+          (then: update the granule footprint catalog, see --catalog)
   Step 3: Build MERIS quality mask (ES/CC/CO + WP_QS/WP_PC) and apply to TSM_NN
+          (and any other --products from the PRODUCTS registry, in one pass)
+          (per-granule QA statistics go to a Parquet table with --qa-table)
+          (only the row/column window of each swath that intersects the ROI
+          bounding box is read; granules with no ROI overlap are skipped)
   Step 4: Convert masked netCDF swath data to georeferenced GeoTIFF rasters
+          (KD-tree nearest neighbour, or forward binning with --gridding binning)
   Step 5: Clip rasters to Region of Interest (ROI) using shapefile
   Step 6: Create daily mosaic rasters (merge multiple passes per day if they exist)
+          (one mosaic per product and date; passes are grouped by catalog
+          acquisition date when available; optional coarser levels with
+          --pyramid-factors)
+  Steps 3–4 overlap reads, compute and writes across granules (--prefetch).
+  --workers N runs Steps 3–5 per granule in N processes, admitted within
+  --ram-budget-gb from per-granule memory estimates (see MEMORY-AWARE SCHEDULING).
+  --mode daemon watches for new archives and runs them through Steps 1–5 as
+  they land, refreshing only the affected mosaics (see DAEMON MODE).
+  --mode daily runs Steps 3–6 as one resampling of all passes of each day
+  onto the ROI grid, writing mean and count mosaics (see JOINT DAILY MODE).
+  --mode tiled runs Steps 3–6 per fixed-size ROI tile instead (in parallel,
+  see TILED MODE), for coastline-scale or multi-region ROIs.
+  --output-encoding log10_uint16 stores TSM (and other log10 products) as
+  packed log10 uint16 from Step 3 to Step 6; readers decode it transparently.
+  All GeoTIFFs are written with one --output-profile (Cloud-Optimized GeoTIFF
+  with DEFLATE + predictor and internal overviews by default).
 
 ASSUMPTIONS CARRIED OVER FROM THE S3 SCRIPT (please verify against your data):
   - TSM_NN is assumed to be stored as packed integer DNs with
@@ -47,26 +82,31 @@ ASSUMPTIONS CARRIED OVER FROM THE S3 SCRIPT (please verify against your data):
 ==============================================================================
 """
 
+import io
 import os
 import re
+import sys
 import glob
+import json
+import time
+import shutil
+import socket
+import threading
+import traceback
+import sqlite3
+import hashlib
+import importlib.util
+import itertools
 import zipfile
 import argparse
+import contextlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 import numpy as np
-import xarray as xr
-from pyresample import geometry as geom
-from pyresample import kd_tree as kdt
-from osgeo import gdal, osr
 from datetime import datetime
 import warnings
-import geopandas as gpd
-import rioxarray
-import rasterio
-from rasterio.merge import merge
-from rasterio.warp import reproject, Resampling
 
-warnings.filterwarnings('ignore')
 
 # ==============================================================================
 # DEFAULT CONFIGURATION — overridable via command-line arguments (see main())
@@ -88,6 +128,21 @@ CUSTOM_FLAGS = [
 
 NODATA_VALUE = -9999.0   # numeric sentinel used throughout for GeoTIFF nodata
 
+# Canonical flag order. Bit i of the packed flag words stored in the granule
+# cache corresponds to MERIS_FLAG_NAMES[i].
+MERIS_FLAG_NAMES = [
+    'LAND_MAP', 'LAND_RADIOMETRIC', 'CLOUD', 'CLOUD_AMBIGUOUS', 'INVALID',
+    'COSMETIC', 'SUSPECT', 'HISOLZEN', 'SATURATED', 'HIGHGLINT', 'SEA_ICE',
+    'TSM_NN_FAIL',
+]
+
+RADIUS_OF_INFLUENCE_M = 5000   # KD-tree nearest-neighbour search radius (Step 4)
+
+# Step 4 gridding backends: 'kdtree' = pyresample nearest neighbour (reference),
+# 'binning' = per-cell mean of the swath pixels whose centres fall in the cell
+GRIDDING_BACKENDS = ['kdtree', 'binning']
+DEFAULT_GRIDDING  = 'kdtree'
+
 # Reference TSM_NN packing values from S3IPF PDS 004_3 ("Product Data Format
 # Specification - OLCI Level 2 Marine"), Table 7-6. Used only as a sanity
 # check in Step 3 — the actual decode always uses each file's own attrs.
@@ -95,7 +150,39 @@ REFERENCE_TSM_SCALE_FACTOR = 0.01811835
 REFERENCE_TSM_ADD_OFFSET   = -2.0
 REFERENCE_TOLERANCE        = 1e-4  # abs difference allowed before warning
 
+# ROI windowing (Step 3/4): only the swath rows/columns whose tie-point cells
+# intersect the ROI bounding box (padded by this margin) are read.
+ROI_WINDOW_MARGIN_DEG = 0.05   # padding around the ROI bbox, in degrees
+COARSE_GEO_STEP       = 16     # subsampling step used when tie_geo_coordinates.nc is missing or short
+
+# Granule footprint catalog (SQLite), written next to the data by default
+DEFAULT_CATALOG_NAME = "granule_catalog.sqlite"
+
+# Decode-once granule cache (decoded TSM, packed flag words, resampling indices)
+DEFAULT_CACHE_DIR_NAME = "granule_cache"
+
+# Output encodings for log10-stored products (Steps 3–6):
+#   'float32'      -> physical units, NODATA_VALUE fill (default)
+#   'log10_uint16' -> log10(physical) packed as uint16:
+#                     log10_val = DN * LOG10_UINT16_SCALE + LOG10_UINT16_OFFSET,
+#                     DN = LOG10_UINT16_NODATA for no data. Covers 0.001 to
+#                     ~3.6e3 g/m³ at 1e-4 log10 steps (native TSM_NN step ≈ 0.018);
+#                     values outside that range are written as no data, with a warning.
+OUTPUT_ENCODINGS     = ['float32', 'log10_uint16']
+LOG10_UINT16_SCALE   = 1e-4
+LOG10_UINT16_OFFSET  = -3.0
+LOG10_UINT16_NODATA  = 65535
+
+# Step 3 QA table (--qa-table): percentiles of each masked product per granule
+QA_PERCENTILES = [5, 25, 50, 75, 95]
+DEFAULT_QA_TABLE_NAME = "granule_qa.parquet"
+
+# Steps 3 and 4: granules prepared ahead in background threads, and outputs
+# waiting to be written behind, each bounded by this depth (0 = sequential)
+DEFAULT_PREFETCH_DEPTH = 2
+
 FILES_TO_KEEP = [
+    "chl_nn.nc", "chl_oc4me.nc",
     "cloud.nc", "common_flags.nc", "cqsf.nc", "geo_coordinates.nc",
     "iop_nn.nc", "par.nc", "tie_geo_coordinates.nc", "tie_geometries.nc",
     "time_coordinates.nc", "tsm_nn.nc", "trsp.nc", "wqsf.nc",
@@ -107,6 +194,67 @@ FILES_TO_KEEP = [
     "Oa019_reflectance.nc", "Oa021_reflectance.nc"
 ]
 
+# ------------------------------------------------------------------------------
+# PRODUCT REGISTRY — every variable Steps 3–6 can process in one granule pass.
+#   file:          netCDF inside the product folder holding the variable
+#   variable:      variable name inside that file
+#   decode:        'log10'  -> physical = 10 ^ (DN * scale_factor + add_offset)
+#                  'linear' -> physical = DN * scale_factor + add_offset
+#   units:         physical units after decoding
+#   prefix:        output filename prefix (<prefix>_<granule>.tif, <prefix>_daily_<date>.tif)
+#   product_flags: algorithm-specific flags that only apply to this product;
+#                  such flags are dropped from the flag list of other products
+# ------------------------------------------------------------------------------
+PRODUCTS = {
+    'TSM_NN':    {'file': 'tsm_nn.nc',    'variable': 'TSM_NN',    'decode': 'log10',
+                  'units': 'g m-3',        'prefix': 'TSM',      'product_flags': ['TSM_NN_FAIL']},
+    'CHL_NN':    {'file': 'chl_nn.nc',    'variable': 'CHL_NN',    'decode': 'log10',
+                  'units': 'mg m-3',       'prefix': 'CHLNN',    'product_flags': []},
+    'CHL_OC4ME': {'file': 'chl_oc4me.nc', 'variable': 'CHL_OC4ME', 'decode': 'log10',
+                  'units': 'mg m-3',       'prefix': 'CHLOC4ME', 'product_flags': []},
+    'ADG443_NN': {'file': 'iop_nn.nc',    'variable': 'ADG443_NN', 'decode': 'log10',
+                  'units': 'm-1',          'prefix': 'ADG443',   'product_flags': []},
+    'KD490_M07': {'file': 'trsp.nc',      'variable': 'KD490_M07', 'decode': 'log10',
+                  'units': 'm-1',          'prefix': 'KD490',    'product_flags': []},
+    'PAR':       {'file': 'par.nc',       'variable': 'PAR',       'decode': 'linear',
+                  'units': 'umol m-2 s-1', 'prefix': 'PAR',      'product_flags': []},
+}
+# Water-leaving reflectance bands, one per *_reflectance.nc kept in Step 2
+for _file in FILES_TO_KEEP:
+    if _file.endswith("_reflectance.nc"):
+        _name = _file[:-len(".nc")]
+        PRODUCTS[_name] = {'file': _file, 'variable': _name, 'decode': 'linear',
+                           'units': 'dl', 'prefix': _name.split("_")[0], 'product_flags': []}
+
+DEFAULT_PRODUCTS = ['TSM_NN']
+
+# ------------------------------------------------------------------------------
+# RASTER OUTPUT PROFILES — applied to every GeoTIFF written in Steps 4, 5 and 6.
+#   driver:    GDAL driver ('COG' needs GDAL >= 3.1)
+#   options:   creation options; predictor 'auto' picks 3 (floating point) for
+#              float rasters and 2 (horizontal) for integer rasters
+#   overviews: internal overview factors built after writing (GTiff only;
+#              the COG driver builds its own overviews)
+# ------------------------------------------------------------------------------
+OUTPUT_PROFILES = {
+    'plain':    {'driver': 'GTiff', 'options': {}, 'overviews': []},
+    'tiled':    {'driver': 'GTiff',
+                 'options': {'tiled': True, 'blockxsize': 512, 'blockysize': 512,
+                             'compress': 'deflate', 'zlevel': 6, 'predictor': 'auto'},
+                 'overviews': [2, 4, 8, 16]},
+    'cog':      {'driver': 'COG',
+                 'options': {'blocksize': 512, 'compress': 'deflate', 'level': 6,
+                             'predictor': 'YES', 'overviews': 'AUTO',
+                             'overview_resampling': 'average'},
+                 'overviews': []},
+    'cog-zstd': {'driver': 'COG',
+                 'options': {'blocksize': 512, 'compress': 'zstd', 'level': 9,
+                             'predictor': 'YES', 'overviews': 'AUTO',
+                             'overview_resampling': 'average'},
+                 'overviews': []},
+}
+DEFAULT_OUTPUT_PROFILE = 'cog'
+
 
 # ==============================================================================
 # STEP 1: UNZIP RAW DATA FILES
@@ -172,6 +320,478 @@ def run_step2(base_directory, safe_folder_suffix):
     print(f"{'='*60}\n")
 
 
+# ==============================================================================
+# GRANULE FOOTPRINT CATALOG
+# ==============================================================================
+#
+# One row per product folder, built once from time_coordinates.nc and the
+# tie-point geolocation (no full-resolution data is read):
+#   start/end time, acquisition date (UTC, YYYYMMDD), bbox, footprint polygon
+#   (WKT, traced around the tie-point grid edge) and valid-pixel fraction
+#   (from a coarse TSM_NN subsample).
+# Updates are incremental: a folder is only re-read if its mtime changed.
+# Rows are kept after a product folder is removed so Step 6 can still group
+# outputs by acquisition date.
+# ==============================================================================
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS granules (
+    granule          TEXT PRIMARY KEY,
+    product_dir      TEXT,
+    dir_mtime        REAL,
+    start_time       TEXT,
+    end_time         TEXT,
+    acquisition_date TEXT,
+    lon_min          REAL,
+    lat_min          REAL,
+    lon_max          REAL,
+    lat_max          REAL,
+    footprint_wkt    TEXT,
+    valid_fraction   REAL,
+    cataloged_at     TEXT
+)
+"""
+
+CATALOG_COLUMNS = ['granule', 'product_dir', 'dir_mtime', 'start_time', 'end_time',
+                   'acquisition_date', 'lon_min', 'lat_min', 'lon_max', 'lat_max',
+                   'footprint_wkt', 'valid_fraction', 'cataloged_at']
+
+
+def open_catalog(catalog_path):
+    """Opens (creating if needed) the SQLite granule catalog."""
+    conn = sqlite3.connect(str(catalog_path))
+    conn.row_factory = sqlite3.Row
+    conn.execute(CATALOG_SCHEMA)
+    conn.execute("CREATE INDEX IF NOT EXISTS granules_date ON granules (acquisition_date)")
+    return conn
+
+
+def read_granule_times(time_nc_path):
+    """Returns (start, end) acquisition times as numpy datetime64 from time_coordinates.nc."""
+    import xarray as xr
+
+    time_ds = xr.open_dataset(time_nc_path)
+    times   = None
+    for name in ["time_stamp"] + list(time_ds.data_vars):
+        if name in time_ds and np.issubdtype(time_ds[name].dtype, np.datetime64):
+            times = time_ds[name].values
+            break
+    time_ds.close()
+    if times is None:
+        raise ValueError(f"No datetime variable found in {time_nc_path}")
+    times = times[~np.isnat(times)]
+    return times.min(), times.max()
+
+
+def footprint_wkt(lat, lon):
+    """Traces the edge of a coarse lat/lon grid into a closed WKT polygon."""
+    ring_lat = np.concatenate([lat[0, :], lat[1:, -1], lat[-1, -2::-1], lat[-2:0:-1, 0]])
+    ring_lon = np.concatenate([lon[0, :], lon[1:, -1], lon[-1, -2::-1], lon[-2:0:-1, 0]])
+    ok = np.isfinite(ring_lat) & np.isfinite(ring_lon)
+    ring_lat, ring_lon = ring_lat[ok], ring_lon[ok]
+    if ring_lat.size < 3:
+        return None
+    coords = [f"{x:.5f} {y:.5f}" for x, y in zip(ring_lon, ring_lat)]
+    coords.append(coords[0])
+    return f"POLYGON(({', '.join(coords)}))"
+
+
+def describe_granule(product_dir):
+    """
+    Builds one catalog record for a product folder from its time and
+    tie-point geolocation files. Fields that cannot be read are left as None.
+    """
+    import xarray as xr
+
+    product_dir = Path(product_dir)
+    record = {name: None for name in CATALOG_COLUMNS}
+    record.update({
+        'granule':      product_dir.name,
+        'product_dir':  str(product_dir),
+        'dir_mtime':    product_dir.stat().st_mtime,
+        'cataloged_at': datetime.now().isoformat(),
+    })
+
+    time_path = product_dir / "time_coordinates.nc"
+    if time_path.exists():
+        start, end = read_granule_times(time_path)
+        record['start_time'] = str(start.astype('datetime64[s]'))
+        record['end_time']   = str(end.astype('datetime64[s]'))
+        record['acquisition_date'] = str(start.astype('datetime64[D]')).replace('-', '')
+    else:
+        match = re.search(r"(\d{8})", product_dir.name)
+        if match:
+            record['acquisition_date'] = match.group(1)
+
+    if (product_dir / "geo_coordinates.nc").exists():
+        lat, lon, _, _, _ = read_coarse_geolocation(product_dir)
+        if np.isfinite(lat).any():
+            record.update({
+                'lon_min': float(np.nanmin(lon)), 'lat_min': float(np.nanmin(lat)),
+                'lon_max': float(np.nanmax(lon)), 'lat_max': float(np.nanmax(lat)),
+                'footprint_wkt': footprint_wkt(lat, lon),
+            })
+
+    tsm_path = product_dir / "tsm_nn.nc"
+    if tsm_path.exists():
+        tsm_ds = xr.open_dataset(tsm_path)
+        tsm    = tsm_ds["TSM_NN"]
+        sample = tsm.isel({tsm.dims[0]: coarse_indices(tsm.shape[0], COARSE_GEO_STEP),
+                           tsm.dims[1]: coarse_indices(tsm.shape[1], COARSE_GEO_STEP)}).values
+        tsm_ds.close()
+        record['valid_fraction'] = float(np.isfinite(sample).mean()) if sample.size else 0.0
+
+    return record
+
+
+def catalog_granule(conn, subfolder):
+    """Describes one product folder and upserts its row; returns the record."""
+    try:
+        record = describe_granule(subfolder)
+    except Exception as e:
+        print(f"  ✗ Could not catalog {subfolder.name}: {e}")
+        record = {name: None for name in CATALOG_COLUMNS}
+        record.update({'granule': subfolder.name, 'product_dir': str(subfolder),
+                       'cataloged_at': datetime.now().isoformat()})
+    conn.execute(
+        f"INSERT OR REPLACE INTO granules ({', '.join(CATALOG_COLUMNS)}) "
+        f"VALUES ({', '.join('?' * len(CATALOG_COLUMNS))})",
+        [record[name] for name in CATALOG_COLUMNS]
+    )
+    print(f"  + Cataloged: {subfolder.name} ({record['acquisition_date']})")
+    return record
+
+
+def update_granule_catalog(catalog_path, base_dir, safe_folder_suffix, folders=None):
+    """
+    Adds new (or modified) product folders under base_dir to the catalog.
+    If folders is given, only those product folders are considered.
+    Returns (n_added, n_unchanged).
+    """
+    conn = open_catalog(catalog_path)
+    known = {row['granule']: row['dir_mtime']
+             for row in conn.execute("SELECT granule, dir_mtime FROM granules")}
+
+    if folders is None:
+        folders = sorted(Path(base_dir).iterdir())
+
+    n_added = n_unchanged = 0
+    for subfolder in folders:
+        subfolder = Path(subfolder)
+        if not (subfolder.is_dir() and subfolder.name.endswith(safe_folder_suffix)):
+            continue
+        if known.get(subfolder.name) == subfolder.stat().st_mtime:
+            n_unchanged += 1
+            continue
+        catalog_granule(conn, subfolder)
+        n_added += 1
+
+    conn.commit()
+    conn.close()
+    return n_added, n_unchanged
+
+
+def query_granule_catalog(catalog_path, roi_bounds=None, start_date=None, end_date=None,
+                          granule=None, margin_deg=ROI_WINDOW_MARGIN_DEG):
+    """
+    Returns catalog rows (as dicts) whose bbox intersects roi_bounds
+    (lon_min, lat_min, lon_max, lat_max) padded by margin_deg, as the ROI
+    window is (see find_roi_window()), and whose acquisition date lies in
+    [start_date, end_date] (YYYYMMDD strings), optionally restricted to one
+    granule name. Granules with unknown bbox or date are always returned,
+    so they are never silently dropped.
+    """
+    clauses, params = [], []
+    if granule is not None:
+        clauses.append("granule = ?")
+        params.append(granule)
+    if roi_bounds is not None:
+        lon_min, lat_min, lon_max, lat_max = roi_bounds
+        lon_min, lat_min = lon_min - margin_deg, lat_min - margin_deg
+        lon_max, lat_max = lon_max + margin_deg, lat_max + margin_deg
+        clauses.append("(lon_min IS NULL OR (lon_max >= ? AND lon_min <= ? "
+                       "AND lat_max >= ? AND lat_min <= ?))")
+        params += [lon_min, lon_max, lat_min, lat_max]
+    if start_date is not None:
+        clauses.append("(acquisition_date IS NULL OR acquisition_date >= ?)")
+        params.append(start_date)
+    if end_date is not None:
+        clauses.append("(acquisition_date IS NULL OR acquisition_date <= ?)")
+        params.append(end_date)
+
+    sql = "SELECT * FROM granules"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    conn = open_catalog(catalog_path)
+    rows = [dict(row) for row in conn.execute(sql + " ORDER BY start_time", params)]
+    conn.close()
+    return rows
+
+
+def get_acquisition_dates(catalog_path):
+    """Returns {granule: acquisition_date} for every cataloged granule with a known date."""
+    conn = open_catalog(catalog_path)
+    dates = {row['granule']: row['acquisition_date'] for row in conn.execute(
+        "SELECT granule, acquisition_date FROM granules WHERE acquisition_date IS NOT NULL")}
+    conn.close()
+    return dates
+
+
+def run_catalog_update(base_dir, safe_folder_suffix, catalog_path):
+    print("\n" + "="*60)
+    print("UPDATING GRANULE FOOTPRINT CATALOG")
+    print("="*60)
+    print(f"Catalog: {catalog_path}\n")
+
+    n_added, n_unchanged = update_granule_catalog(catalog_path, base_dir, safe_folder_suffix)
+
+    print(f"\n{'='*60}")
+    print(f"CATALOG UPDATED: {n_added} added/refreshed, {n_unchanged} unchanged")
+    print(f"{'='*60}\n")
+
+
+# ==============================================================================
+# DECODE-ONCE GRANULE CACHE
+# ==============================================================================
+#
+# Per-granule .npz files under <base-directory>/granule_cache:
+#   <granule>_flags.npz     -> packed flag words (uint16, bit i =
+#                              MERIS_FLAG_NAMES[i]), Step 3
+#   <granule>_<product>.npz -> decoded product values (float32, physical
+#                              units), Step 3, one per PRODUCTS entry
+#   <granule>_nn.npz        -> target grid + swath-to-grid neighbour indices
+#                              from kd_tree.get_neighbour_info(), Step 4
+#   <granule>_bins.npz      -> target grid + per-pixel target cell index
+#                              for --gridding binning, Step 4
+# Each entry stores a key hashed from its input files (name, size, mtime),
+# the ROI window and the relevant settings; a mismatch means a cache miss.
+# Changing the masking strategy therefore only re-applies a bitmask to the
+# cached flag words and re-samples with the cached indices.
+# ==============================================================================
+
+def cache_key(input_paths, *settings):
+    """Hashes input file identities (name, size, mtime) plus settings into a cache key."""
+    h = hashlib.sha1()
+    for path in input_paths:
+        st = os.stat(path)
+        h.update(f"{Path(path).name}:{st.st_size}:{st.st_mtime_ns};".encode())
+    h.update(repr(settings).encode())
+    return h.hexdigest()
+
+
+def load_cache_entry(cache_path, key):
+    """Returns the arrays of a cache entry as a dict, or None on a miss/stale key."""
+    cache_path = Path(cache_path)
+    if not cache_path.exists():
+        return None
+    try:
+        with np.load(cache_path, allow_pickle=False) as npz:
+            if str(npz['key']) != key:
+                return None
+            return {name: npz[name] for name in npz.files if name != 'key'}
+    except Exception as e:
+        print(f"   WARNING: unreadable cache entry {cache_path.name} ({e}) — recomputing")
+        return None
+
+
+def save_cache_entry(cache_path, key, **arrays):
+    """Writes a cache entry atomically (temp file + rename)."""
+    cache_path = Path(cache_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(".tmp.npz")
+    np.savez(tmp_path, key=np.array(key), **arrays)
+    os.replace(tmp_path, cache_path)
+
+
+# ==============================================================================
+# PIPELINED GRANULE I/O
+# ==============================================================================
+#
+# Steps 3 and 4 overlap reading, computing and writing across granules:
+#   - prefetch_map() prepares the next `depth` granules (netCDF reads, decode,
+#     resampling) in background threads while the current one is consumed;
+#   - write_behind() hands finished outputs to one writer thread, blocking
+#     the loop once `depth` writes are pending.
+# Both queues are bounded, so at most ~2*depth+1 granules are held in memory.
+# Console output from background threads is buffered per granule and
+# printed in input order, so logs read the same as a sequential run.
+# ==============================================================================
+
+class _ThreadOutput(io.TextIOBase):
+    """sys.stdout proxy sending writes from registered threads to their own buffer."""
+
+    def __init__(self, stream):
+        self.stream  = stream
+        self.buffers = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.buffers, 'current', None)
+        return (buffer or self.stream).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+@contextlib.contextmanager
+def _captured_stdout():
+    """Installs a _ThreadOutput proxy on sys.stdout for the duration of the block."""
+    proxy      = _ThreadOutput(sys.stdout)
+    sys.stdout = proxy
+    try:
+        yield proxy
+    finally:
+        sys.stdout = proxy.stream
+
+
+def prefetch_map(func, items, depth=DEFAULT_PREFETCH_DEPTH):
+    """
+    Yields (item, result, error, log) for func(item) over items, in input
+    order, while up to `depth` upcoming items run in background threads.
+    log holds what func printed; error is the exception it raised, if any.
+    With depth <= 0 everything runs inline and log is empty.
+    """
+    if depth <= 0:
+        for item in items:
+            try:
+                yield item, func(item), None, ""
+            except Exception as e:
+                yield item, None, e, ""
+        return
+
+    with _captured_stdout() as proxy:
+        def run(item):
+            proxy.buffers.current = io.StringIO()
+            try:
+                return func(item), None, proxy.buffers.current.getvalue()
+            except Exception as e:
+                return None, e, proxy.buffers.current.getvalue()
+            finally:
+                proxy.buffers.current = None
+
+        items   = iter(items)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=depth) as executor:
+            for item in itertools.islice(items, depth):
+                pending.append((item, executor.submit(run, item)))
+            while pending:
+                item, future = pending.popleft()
+                result, error, log = future.result()
+                for next_item in itertools.islice(items, 1):
+                    pending.append((next_item, executor.submit(run, next_item)))
+                yield item, result, error, log
+
+
+@contextlib.contextmanager
+def write_behind(depth=DEFAULT_PREFETCH_DEPTH):
+    """
+    Yields submit(func, *args, **kwargs), which runs func on a single writer
+    thread and blocks while `depth` writes are already pending (backpressure).
+    submit() returns a Future holding the write's result or exception; with
+    depth <= 0 the write runs inline and the Future is already done. All
+    writes have finished on exit, so callers check their Futures afterwards.
+    """
+    if depth <= 0:
+        def submit_inline(func, *args, **kwargs):
+            future = Future()
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        yield submit_inline
+        return
+    slots = threading.BoundedSemaphore(depth)
+    def guarded(func, args, kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            slots.release()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        def submit(func, *args, **kwargs):
+            slots.acquire()
+            return executor.submit(guarded, func, args, kwargs)
+        yield submit
+
+
+# ==============================================================================
+# OUTPUT ENCODING (--output-encoding)
+# ==============================================================================
+#
+# With 'log10_uint16', log10-stored products (PRODUCTS[...]['decode'] ==
+# 'log10', e.g. TSM_NN) are written as packed uint16 in the Step 3 netCDF
+# (CF scale_factor/add_offset/_FillValue giving log10 values) and in every
+# GeoTIFF (GDAL band scale/offset + OUTPUT_ENCODING tag). Readers in Steps
+# 4–6 decode back to physical units before any resampling or averaging, and
+# Steps 5–6 write the same encoding they read. Other products stay float32.
+# ==============================================================================
+
+def encode_log10_uint16(values):
+    """
+    Packs physical values (NaN = no data, <= 0 treated as no data) as log10
+    uint16 DNs. Values outside the representable range are written as no
+    data rather than clipped, and counted in a warning.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid  = np.isfinite(values) & (values > 0)
+    dn     = np.full(values.shape, LOG10_UINT16_NODATA, dtype=np.uint16)
+    scaled = np.round((np.log10(values[valid]) - LOG10_UINT16_OFFSET) / LOG10_UINT16_SCALE)
+    in_range = (scaled >= 0) & (scaled <= LOG10_UINT16_NODATA - 1)
+    if not in_range.all():
+        lo, hi = decode_log10_uint16(np.array([0, LOG10_UINT16_NODATA - 1]))
+        print(f"  ⚠️ log10_uint16: {np.count_nonzero(~in_range):,} value(s) outside "
+              f"{lo:.4g}–{hi:.4g} written as no data")
+    dn[valid] = np.where(in_range, scaled, LOG10_UINT16_NODATA).astype(np.uint16)
+    return dn
+
+
+def decode_log10_uint16(dn):
+    """Inverse of encode_log10_uint16(): physical float32 values, NaN for no data."""
+    dn     = np.asarray(dn)
+    values = 10.0 ** (dn.astype(np.float64) * LOG10_UINT16_SCALE + LOG10_UINT16_OFFSET)
+    return np.where(dn == LOG10_UINT16_NODATA, np.nan, values).astype(np.float32)
+
+
+def uses_log10_encoding(product_name, output_encoding):
+    """True if this product is written log10-packed under the given output encoding."""
+    return (output_encoding == 'log10_uint16' and product_name in PRODUCTS
+            and PRODUCTS[product_name]['decode'] == 'log10')
+
+
+def read_physical(da, nodata=NODATA_VALUE):
+    """Physical float32 values (NaN = no data) of a Step 3 variable opened with mask_and_scale=False."""
+    values = da.values.squeeze()
+    if da.attrs.get('output_encoding') == 'log10_uint16':
+        return decode_log10_uint16(values)
+    values = values.astype(np.float32)
+    return np.where(values == nodata, np.nan, values)
+
+
+def read_physical_band(src, nodata=NODATA_VALUE):
+    """Physical float32 band 1 (NaN = no data) of an open rasterio dataset in either encoding."""
+    data = src.read(1)
+    if src.tags(1).get('OUTPUT_ENCODING') == 'log10_uint16':
+        return decode_log10_uint16(data)
+    data = data.astype(np.float32)
+    return np.where(data == (src.nodata if src.nodata is not None else nodata), np.nan, data)
+
+
+def encoded_raster(values, output_encoding, tags=None, nodata=NODATA_VALUE):
+    """
+    Returns (array, nodata, tags, scale_offset) ready for write_raster() from
+    physical values (NaN = no data) in the given output encoding.
+    """
+    tags = dict(tags or {})
+    if output_encoding == 'log10_uint16':
+        tags.update(OUTPUT_ENCODING='log10_uint16',
+                    ENCODING_APPLIED=f'log10_val = DN * {LOG10_UINT16_SCALE} + {LOG10_UINT16_OFFSET}; '
+                                     f'physical = 10^log10_val')
+        return (encode_log10_uint16(values), LOG10_UINT16_NODATA, tags,
+                (LOG10_UINT16_SCALE, LOG10_UINT16_OFFSET))
+    tags.pop('OUTPUT_ENCODING', None)
+    tags.pop('ENCODING_APPLIED', None)
+    return np.where(np.isnan(values), nodata, values).astype(np.float32), nodata, tags, None
+
+
 # ==============================================================================
 # STEP 3: BUILD MERIS QUALITY MASK AND APPLY TO TSM DATA
 # ==============================================================================
@@ -189,11 +809,147 @@ def run_step2(base_directory, safe_folder_suffix):
 #   - Step A: log10_val  = DN * scale_factor + add_offset   -> log10(g/m³)
 #   - Step B: physical   = 10 ^ log10_val                   -> g/m³
 #   Negative log10 values are physically valid (e.g. -2.0 = 0.01 g/m³).
-#   The intermediate masked netCDF is saved as float32 in physical g/m³
-#   units directly (mirrors the S3 script's Step 3/4 split, collapsed here
-#   since the decode itself doesn't depend on the flag source).
+#   The intermediate masked netCDF (<granule>_tsm_masked.nc, which also holds
+#   any other requested --products) is saved decoded (mirrors the S3 script's
+#   Step 3/4 split, collapsed here since the decode itself doesn't depend on
+#   the flag source): float32 in physical g/m³ by default, or with
+#   --output-encoding log10_uint16 as uint16 log10 DNs with CF
+#   scale_factor/add_offset and _FillValue 65535 (see OUTPUT ENCODING).
 # ==============================================================================
 
+def get_roi_bounds(shapefile_path):
+    """Returns the ROI bounding box (lon_min, lat_min, lon_max, lat_max) in EPSG:4326."""
+    import geopandas as gpd
+
+    roi = gpd.read_file(shapefile_path)
+    if roi.crs is not None and roi.crs.to_epsg() != 4326:
+        roi = roi.to_crs(epsg=4326)
+    lon_min, lat_min, lon_max, lat_max = roi.total_bounds
+    return float(lon_min), float(lat_min), float(lon_max), float(lat_max)
+
+
+def coarse_indices(size, step):
+    """Indices 0, step, 2*step, ... of an axis of `size`, always ending with its last index."""
+    indices = np.arange(0, size, step)
+    if indices[-1] != size - 1:
+        indices = np.append(indices, size - 1)
+    return indices
+
+
+def read_coarse_geolocation(product_dir):
+    """
+    Reads a coarse lat/lon grid for a product folder without loading the
+    full-resolution geolocation. Uses tie_geo_coordinates.nc when it spans
+    the whole swath, otherwise a strided subsample of geo_coordinates.nc
+    that always includes the last swath row and column.
+
+    Returns (lat, lon, rows, cols, full_shape), where rows / cols are the
+    full-resolution swath indices of the coarse rows / columns.
+    """
+    import xarray as xr
+
+    product_dir = Path(product_dir)
+    geo_ds      = xr.open_dataset(product_dir / "geo_coordinates.nc")
+    full_shape  = geo_ds["latitude"].shape
+    tie_path    = product_dir / "tie_geo_coordinates.nc"
+
+    lat = None
+    row_step = col_step = COARSE_GEO_STEP
+    if tie_path.exists():
+        tie_ds = xr.open_dataset(tie_path)
+        tie_lat = tie_ds["latitude"].values
+        tie_lon = tie_ds["longitude"].values
+        # Subsampling factors are global attributes of the tie-point file;
+        # fall back to the ratio of the grid sizes if they are missing.
+        row_step = int(tie_ds.attrs.get(
+            'al_subsampling_factor', max(1, round((full_shape[0] - 1) / max(1, tie_lat.shape[0] - 1)))))
+        col_step = int(tie_ds.attrs.get(
+            'ac_subsampling_factor', max(1, round((full_shape[1] - 1) / max(1, tie_lat.shape[1] - 1)))))
+        tie_ds.close()
+        rows = np.minimum(np.arange(tie_lat.shape[0]) * row_step, full_shape[0] - 1)
+        cols = np.minimum(np.arange(tie_lat.shape[1]) * col_step, full_shape[1] - 1)
+        # Tie points that stop short of the trailing swath edge would hide it
+        if rows[-1] == full_shape[0] - 1 and cols[-1] == full_shape[1] - 1:
+            lat, lon = tie_lat, tie_lon
+
+    if lat is None:
+        rows = coarse_indices(full_shape[0], row_step)
+        cols = coarse_indices(full_shape[1], col_step)
+        dims = geo_ds["latitude"].dims
+        lat  = geo_ds["latitude"].isel({dims[0]: rows, dims[1]: cols}).values
+        lon  = geo_ds["longitude"].isel({dims[0]: rows, dims[1]: cols}).values
+
+    geo_ds.close()
+    return lat, lon, rows, cols, full_shape
+
+
+def find_roi_window(product_dir, roi_bounds, margin_deg=ROI_WINDOW_MARGIN_DEG):
+    """
+    Determines the (row_slice, col_slice) window of a swath that intersects
+    the ROI bounding box, using coarse (tie-point) geolocation only.
+
+    Each cell of the coarse grid is tested for bbox overlap using its four
+    corners, so ROIs smaller than the tie-point spacing are still found.
+    Returns None when the granule does not overlap the ROI at all.
+    """
+    lat, lon, rows, cols, full_shape = read_coarse_geolocation(product_dir)
+    lon_min, lat_min, lon_max, lat_max = roi_bounds
+    lon_min, lat_min = lon_min - margin_deg, lat_min - margin_deg
+    lon_max, lat_max = lon_max + margin_deg, lat_max + margin_deg
+
+    if lat.shape[0] < 2 or lat.shape[1] < 2:
+        return None
+
+    corners_lat = np.stack([lat[:-1, :-1], lat[:-1, 1:], lat[1:, :-1], lat[1:, 1:]])
+    corners_lon = np.stack([lon[:-1, :-1], lon[:-1, 1:], lon[1:, :-1], lon[1:, 1:]])
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        cell_lat_min = np.nanmin(corners_lat, axis=0)
+        cell_lat_max = np.nanmax(corners_lat, axis=0)
+        cell_lon_min = np.nanmin(corners_lon, axis=0)
+        cell_lon_max = np.nanmax(corners_lon, axis=0)
+
+    overlaps = ((cell_lat_max >= lat_min) & (cell_lat_min <= lat_max) &
+                (cell_lon_max >= lon_min) & (cell_lon_min <= lon_max))
+    if not overlaps.any():
+        return None
+
+    cell_rows = np.nonzero(overlaps.any(axis=1))[0]
+    cell_cols = np.nonzero(overlaps.any(axis=0))[0]
+
+    # Cell i spans coarse samples i and i + 1, both included in the window
+    row_start = int(rows[cell_rows[0]])
+    row_stop  = min(full_shape[0], int(rows[cell_rows[-1] + 1]) + 1)
+    col_start = int(cols[cell_cols[0]])
+    col_stop  = min(full_shape[1], int(cols[cell_cols[-1] + 1]) + 1)
+    return slice(row_start, row_stop), slice(col_start, col_stop)
+
+
+def read_window(da, window):
+    """Returns the (row_slice, col_slice) window of a 2-D swath DataArray (no-op for None)."""
+    if window is None:
+        return da
+    return da.isel({da.dims[-2]: window[0], da.dims[-1]: window[1]})
+
+
+def window_to_attrs(window):
+    """Encodes a swath window as netCDF global attributes (empty for None)."""
+    if window is None:
+        return {}
+    return {
+        'roi_window_row_start': window[0].start, 'roi_window_row_stop': window[0].stop,
+        'roi_window_col_start': window[1].start, 'roi_window_col_stop': window[1].stop,
+    }
+
+
+def window_from_attrs(attrs):
+    """Decodes a swath window written by window_to_attrs() (None if absent)."""
+    if 'roi_window_row_start' not in attrs:
+        return None
+    return (slice(int(attrs['roi_window_row_start']), int(attrs['roi_window_row_stop'])),
+            slice(int(attrs['roi_window_col_start']), int(attrs['roi_window_col_stop'])))
+
+
 def extract_bit(arr: np.ndarray, bit: int) -> np.ndarray:
     """Extracts a single bit from an integer flag array as a boolean mask."""
     return (arr.astype(np.uint64) & (np.uint64(1) << np.uint64(bit))) != 0
@@ -207,19 +963,22 @@ def extract_saturated(CO: np.ndarray) -> np.ndarray:
     return (CO.astype(np.uint32) & sat_mask) != 0
 
 
-def get_meris_flag_components(common_flags_path, wqsf_path):
+def get_meris_flag_components(common_flags_path, wqsf_path, window=None):
     """
     Reads common_flags.nc (ES, CC, CO) and wqsf.nc (WP_QS, WP_PC) and returns
     a dict of {flag_name: boolean_mask_array}, one entry per quality flag.
+    If window is given, only that (row_slice, col_slice) window is read.
     """
+    import xarray as xr
+
     cf_ds   = xr.open_dataset(common_flags_path)
     wqsf_ds = xr.open_dataset(wqsf_path)
 
-    ES    = cf_ds["ES"].values.astype(np.uint32)
-    CC    = cf_ds["CC"].values.astype(np.uint32)
-    CO    = cf_ds["CO"].values.astype(np.uint32)
-    WP_QS = wqsf_ds["WP_QS"].values.astype(np.uint64)
-    WP_PC = wqsf_ds["WP_PC"].values.astype(np.uint32)
+    ES    = read_window(cf_ds["ES"], window).values.astype(np.uint32)
+    CC    = read_window(cf_ds["CC"], window).values.astype(np.uint32)
+    CO    = read_window(cf_ds["CO"], window).values.astype(np.uint32)
+    WP_QS = read_window(wqsf_ds["WP_QS"], window).values.astype(np.uint64)
+    WP_PC = read_window(wqsf_ds["WP_PC"], window).values.astype(np.uint32)
 
     cf_ds.close()
     wqsf_ds.close()
@@ -241,12 +1000,31 @@ def get_meris_flag_components(common_flags_path, wqsf_path):
     return flag_components
 
 
+def pack_flag_words(flag_components):
+    """Packs the per-flag boolean masks into one uint16 word per pixel (bit i = MERIS_FLAG_NAMES[i])."""
+    words = None
+    for bit, name in enumerate(MERIS_FLAG_NAMES):
+        layer = flag_components[name].astype(np.uint16) << np.uint16(bit)
+        words = layer if words is None else (words | layer)
+    return words
+
+
+def flag_list_bitmask(flag_list):
+    """Returns the packed-flag-word bitmask selecting the named flags."""
+    bitmask = 0
+    for name in flag_list:
+        if name not in MERIS_FLAG_NAMES:
+            print(f"   WARNING: unknown flag name '{name}' — skipping")
+            continue
+        bitmask |= 1 << MERIS_FLAG_NAMES.index(name)
+    if bitmask == 0:
+        raise ValueError("No valid flags selected — quality mask would be empty.")
+    return np.uint16(bitmask)
+
+
 def get_flag_list(strategy):
-    all_flags = ['LAND_MAP', 'LAND_RADIOMETRIC', 'CLOUD', 'CLOUD_AMBIGUOUS',
-                 'INVALID', 'COSMETIC', 'SUSPECT', 'HISOLZEN', 'SATURATED',
-                 'HIGHGLINT', 'SEA_ICE', 'TSM_NN_FAIL']
     strategies = {
-        'recommended': all_flags,
+        'recommended': list(MERIS_FLAG_NAMES),
         'cloud_only':  ['CLOUD', 'CLOUD_AMBIGUOUS'],
         'custom':      CUSTOM_FLAGS
     }
@@ -266,30 +1044,37 @@ def build_quality_mask(flag_components, flag_list):
     return mask
 
 
-def apply_tsm_mask(tsm_nc_path, common_flags_path, wqsf_path, output_path, flag_list):
+def product_flag_list(product_name, flag_list):
+    """Drops flags that are specific to another product (e.g. TSM_NN_FAIL for PAR)."""
+    own = set(PRODUCTS[product_name]['product_flags'])
+    others = {f for name, prod in PRODUCTS.items() if name != product_name
+              for f in prod['product_flags']} - own
+    return [f for f in flag_list if f not in others]
+
+
+def decode_product(raw, product_name):
     """
-    Reads raw packed TSM_NN DNs, applies scale/offset to get log10(g/m³) then
-    10^x to get physical g/m³, builds the combined MERIS quality mask from
-    common_flags.nc + wqsf.nc, applies it, and saves a clean float32 netCDF
-    in physical g/m³ units (no scale_factor/add_offset attrs).
+    Decodes a raw packed product variable (DataArray opened with
+    mask_and_scale=False) to physical units following its registry rule:
+      log10:  log10_val = DN * scale_factor + add_offset, physical = 10^log10_val
+      linear: physical  = DN * scale_factor + add_offset
+    Returns (physical, scale_factor, add_offset).
     """
-    try:
-        # Open raw — no auto-decode so we control every step
-        tsm_ds_raw = xr.open_dataset(tsm_nc_path, mask_and_scale=False)
-        tsm_raw    = tsm_ds_raw["TSM_NN"]
-
-        print(f"   Raw TSM_NN attributes:")
-        for k, v in tsm_raw.attrs.items():
-            print(f"     {k}: {v}")
-        print(f"   Raw dtype: {tsm_raw.dtype}")
-        print(f"   Raw DN range: {tsm_raw.values.min()} – {tsm_raw.values.max()}")
-
-        # Extract packing parameters
-        scale_factor = float(tsm_raw.attrs.get('scale_factor', 1.0))
-        add_offset   = float(tsm_raw.attrs.get('add_offset',   0.0))
-
-        # Sanity check against the documented reference values
-        # (S3IPF PDS 004_3, Table 7-6: scale_factor=0.01811835, add_offset=-2)
+    product = PRODUCTS[product_name]
+
+    print(f"   Raw {product_name} attributes:")
+    for k, v in raw.attrs.items():
+        print(f"     {k}: {v}")
+    print(f"   Raw dtype: {raw.dtype}")
+    print(f"   Raw DN range: {raw.values.min()} – {raw.values.max()}")
+
+    # Extract packing parameters
+    scale_factor = float(raw.attrs.get('scale_factor', 1.0))
+    add_offset   = float(raw.attrs.get('add_offset',   0.0))
+
+    # Sanity check against the documented reference values
+    # (S3IPF PDS 004_3, Table 7-6: scale_factor=0.01811835, add_offset=-2)
+    if product_name == 'TSM_NN':
         if abs(scale_factor - REFERENCE_TSM_SCALE_FACTOR) > REFERENCE_TOLERANCE:
             print(f"   WARNING: scale_factor {scale_factor} differs from "
                   f"documented reference {REFERENCE_TSM_SCALE_FACTOR} — "
@@ -299,146 +1084,467 @@ def apply_tsm_mask(tsm_nc_path, common_flags_path, wqsf_path, output_path, flag_
                   f"documented reference {REFERENCE_TSM_ADD_OFFSET} — "
                   f"double-check this file's packing.")
 
-        fill_value   = tsm_raw.attrs.get('_FillValue', None)
-        valid_min    = tsm_raw.attrs.get('valid_min',  None)
-        valid_max    = tsm_raw.attrs.get('valid_max',  None)
-
-        dn = tsm_raw.values.astype(np.float64)
-
-        if fill_value is not None:
-            dn = np.where(dn == float(fill_value), np.nan, dn)
-        if valid_min is not None:
-            dn = np.where(dn < float(valid_min), np.nan, dn)
-        if valid_max is not None:
-            dn = np.where(dn > float(valid_max), np.nan, dn)
-
-        # Step A: linear decode -> log10(g/m³)
-        tsm_log10 = dn * scale_factor + add_offset
-        # Step B: exponentiate -> physical g/m³
-        tsm_physical = np.power(10.0, tsm_log10)
-
-        valid_log  = tsm_log10[np.isfinite(tsm_log10)]
-        valid_phys = tsm_physical[np.isfinite(tsm_physical)]
-        if valid_phys.size > 0:
-            print(f"   log10 TSM range:    {valid_log.min():.4f} – {valid_log.max():.4f} lg(g/m³)")
-            print(f"   Physical TSM range: {valid_phys.min():.4f} – {valid_phys.max():.4f} g/m³")
-        else:
-            print(f"   WARNING: No finite physical values after decode")
+    fill_value   = raw.attrs.get('_FillValue', None)
+    valid_min    = raw.attrs.get('valid_min',  None)
+    valid_max    = raw.attrs.get('valid_max',  None)
+
+    dn = raw.values.astype(np.float64)
+
+    if fill_value is not None:
+        dn = np.where(dn == float(fill_value), np.nan, dn)
+    if valid_min is not None:
+        dn = np.where(dn < float(valid_min), np.nan, dn)
+    if valid_max is not None:
+        dn = np.where(dn > float(valid_max), np.nan, dn)
+
+    # Step A: linear decode
+    decoded = dn * scale_factor + add_offset
+    if product['decode'] == 'log10':
+        valid_log = decoded[np.isfinite(decoded)]
+        if valid_log.size > 0:
+            print(f"   log10 {product_name} range: {valid_log.min():.4f} – {valid_log.max():.4f} "
+                  f"lg({product['units']})")
+        # Step B: exponentiate -> physical units
+        physical = np.power(10.0, decoded)
+    else:
+        physical = decoded
+
+    valid_phys = physical[np.isfinite(physical)]
+    if valid_phys.size > 0:
+        print(f"   Physical {product_name} range: {valid_phys.min():.4f} – {valid_phys.max():.4f} "
+              f"{product['units']}")
+    else:
+        print(f"   WARNING: No finite physical values after decode")
+
+    return physical, scale_factor, add_offset
+
+
+def decode_flag_words(common_flags_path, wqsf_path, window=None, cache_dir=None):
+    """Returns the packed uint16 flag words for a granule, via the granule cache when enabled."""
+    cache_path, key = None, None
+    if cache_dir is not None:
+        cache_path = Path(cache_dir) / f"{Path(common_flags_path).parent.name}_flags.npz"
+        key        = cache_key([common_flags_path, wqsf_path], window)
+        cached     = load_cache_entry(cache_path, key)
+        if cached is not None:
+            print(f"   Using cached flag words: {cache_path.name}")
+            return cached['flag_words']
+
+    flag_components = get_meris_flag_components(common_flags_path, wqsf_path, window)
+    flag_words      = pack_flag_words(flag_components)
+    if cache_path is not None:
+        save_cache_entry(cache_path, key, flag_words=flag_words)
+    return flag_words
 
-        # Build the MERIS quality mask from the two flag files
-        flag_components = get_meris_flag_components(common_flags_path, wqsf_path)
-        quality_mask     = build_quality_mask(flag_components, flag_list)
 
-        if quality_mask.shape != tsm_physical.shape:
+def decode_product_file(product_nc_path, product_name, window=None, cache_dir=None):
+    """
+    Returns (physical, scale_factor, add_offset) for one product variable,
+    via the granule cache when enabled.
+    """
+    import xarray as xr
+
+    cache_path, key = None, None
+    if cache_dir is not None:
+        cache_path = Path(cache_dir) / f"{Path(product_nc_path).parent.name}_{product_name}.npz"
+        key        = cache_key([product_nc_path], window, PRODUCTS[product_name]['decode'])
+        cached     = load_cache_entry(cache_path, key)
+        if cached is not None:
+            print(f"   Using cached decode: {cache_path.name}")
+            return (cached['values'].astype(np.float64),
+                    float(cached['scale_factor']), float(cached['add_offset']))
+
+    # Open raw — no auto-decode so we control every step
+    ds_raw = xr.open_dataset(product_nc_path, mask_and_scale=False)
+    raw    = read_window(ds_raw[PRODUCTS[product_name]['variable']], window)
+    physical, scale_factor, add_offset = decode_product(raw, product_name)
+    ds_raw.close()
+
+    if cache_path is not None:
+        save_cache_entry(cache_path, key, values=physical.astype(np.float32),
+                         scale_factor=scale_factor, add_offset=add_offset)
+    return physical, scale_factor, add_offset
+
+
+def flag_bit_counts(flag_words):
+    """
+    Pixel count of every MERIS_FLAG_NAMES bit in one pass: a histogram of
+    the packed flag words (np.bincount) times a word-to-bits table.
+    """
+    n_bits = len(MERIS_FLAG_NAMES)
+    words  = np.bincount(flag_words.ravel(), minlength=1 << n_bits)
+    bits   = (np.arange(words.size)[:, None] >> np.arange(n_bits)) & 1
+    return dict(zip(MERIS_FLAG_NAMES, (words @ bits).tolist()))
+
+
+def granule_qa_record(flag_words, masked_values, window=None):
+    """
+    Per-granule QA statistics for the QA table: per-flag pixel fractions
+    from the flag words, and valid-pixel count, mean and percentiles of
+    each masked product (physical units). <product>_window_valid_fraction
+    is the valid share of the swath pixels that were read (the ROI window,
+    or the whole swath without one). It is not the share of the ROI that
+    the granule covers.
+    """
+    total  = flag_words.size
+    record = {'total_pixels': total, 'roi_window': window is not None}
+    for name, count in flag_bit_counts(flag_words).items():
+        record[f'flag_{name}_fraction'] = count / total if total else 0.0
+
+    for product_name, values in masked_values.items():
+        valid = values[np.isfinite(values)]
+        record[f'{product_name}_valid_pixels'] = int(valid.size)
+        record[f'{product_name}_window_valid_fraction'] = valid.size / total if total else 0.0
+        record[f'{product_name}_mean'] = float(valid.mean()) if valid.size else np.nan
+        percentiles = np.percentile(valid, QA_PERCENTILES) if valid.size else [np.nan] * len(QA_PERCENTILES)
+        for q, value in zip(QA_PERCENTILES, percentiles):
+            record[f'{product_name}_p{q:02d}'] = float(value)
+    return record
+
+
+def mask_products(product_paths, common_flags_path, wqsf_path, flag_list,
+                  window=None, cache_dir=None, qa=False):
+    """
+    Decodes every requested product variable of one granule, builds the
+    MERIS flag words once from common_flags.nc + wqsf.nc and masks each
+    product with its applicable flags (see product_flag_list()).
+
+    product_paths maps product names (keys of PRODUCTS) to their netCDF
+    paths. Returns (masked_ds, stats): an in-memory xarray.Dataset of
+    float32 physical-unit variables (NaN where masked) and the masking
+    statistics of the first product. With qa=True, stats also carries the
+    granule_qa_record() columns and per-flag counts are printed; otherwise
+    those reductions are skipped. Nothing is written to disk.
+    """
+    import xarray as xr
+
+    flag_words = decode_flag_words(common_flags_path, wqsf_path, window, cache_dir)
+
+    data_vars     = {}
+    masked_values = {}
+    stats         = None
+    template      = None
+    for product_name, product_path in product_paths.items():
+        product = PRODUCTS[product_name]
+        values, scale_factor, add_offset = decode_product_file(
+            product_path, product_name, window, cache_dir
+        )
+
+        if flag_words.shape != values.shape:
             raise ValueError(
-                f"Flag mask shape {quality_mask.shape} does not match "
-                f"TSM_NN shape {tsm_physical.shape} — check that common_flags.nc, "
-                f"wqsf.nc, and tsm_nn.nc are on the same grid."
+                f"Flag mask shape {flag_words.shape} does not match "
+                f"{product_name} shape {values.shape} — check that common_flags.nc, "
+                f"wqsf.nc, and {product['file']} are on the same grid."
             )
 
-        tsm_physical[quality_mask] = np.nan
+        product_flags = product_flag_list(product_name, flag_list)
+        bitmask       = flag_list_bitmask(product_flags) if product_flags else np.uint16(0)
+        quality_mask  = (flag_words & bitmask) != 0
+        values[quality_mask] = np.nan
 
-        # Statistics
-        valid_before  = int(np.sum(np.isfinite(tsm_physical) | quality_mask))
-        valid_after   = int(np.sum(np.isfinite(tsm_physical)))
+        valid_before  = int(np.sum(np.isfinite(values) | quality_mask))
+        valid_after   = int(np.sum(np.isfinite(values)))
         masked_pixels = valid_before - valid_after
 
-        stats = {
-            'total_pixels':   tsm_physical.size,
-            'valid_before':   valid_before,
-            'valid_after':    valid_after,
-            'masked_pixels':  masked_pixels,
-            'masked_percent': (masked_pixels / valid_before * 100) if valid_before > 0 else 0
-        }
+        if stats is None:
+            stats = {
+                'total_pixels':   values.size,
+                'valid_before':   valid_before,
+                'valid_after':    valid_after,
+                'masked_pixels':  masked_pixels,
+                'masked_percent': (masked_pixels / valid_before * 100) if valid_before > 0 else 0
+            }
+        else:
+            print(f"   {product_name} valid pixels: {valid_before:,} → {valid_after:,}")
+
+        # Dims/coords and global attributes come from the product file itself
+        product_ds = xr.open_dataset(product_path, mask_and_scale=False)
+        raw_da     = read_window(product_ds[product['variable']], window)
+        # Lazy lat/lon coords must be read before product_ds is closed below
+        coords     = raw_da.coords.to_dataset().load().coords
+        if template is None:
+            template = dict(product_ds.attrs)
+
+        if product['decode'] == 'log10':
+            scale_applied = f'log10_val = DN * {scale_factor} + {add_offset}; physical = 10^log10_val'
+            long_name     = f'{product_name} — linear {product["units"]} (decoded from log10 storage)'
+        else:
+            scale_applied = f'physical = DN * {scale_factor} + {add_offset}'
+            long_name     = f'{product_name} — {product["units"]} (decoded from packed storage)'
 
-        # Per-flag pixel counts (helpful diagnostic)
-        total_px = quality_mask.size
-        print(f"   Flag pixel counts (n_total = {total_px:,}):")
-        for name in flag_list:
-            if name in flag_components:
-                n = int(np.sum(flag_components[name]))
-                print(f"     {name:<18}: {n:>8,}  ({n / total_px * 100:.1f} %)")
-
-        # Build clean output dataset in physical g/m³, no packing attributes
-        tsm_ds_raw.close()
-        tsm_ds_template = xr.open_dataset(tsm_nc_path, mask_and_scale=False)
-
-        masked_da = xr.DataArray(
-            tsm_physical.astype(np.float32),
-            dims=tsm_ds_template["TSM_NN"].dims,
-            coords=tsm_ds_template["TSM_NN"].coords,
+        data_vars[product_name] = xr.DataArray(
+            values.astype(np.float32),
+            dims=raw_da.dims,
+            coords=coords,
             attrs={
-                'units':                 'g m-3',
-                'long_name':             'Total Suspended Matter — linear g/m³ (decoded from log10 storage)',
-                'quality_flags_applied': ', '.join(flag_list),
+                'units':                 product['units'],
+                'long_name':             long_name,
+                'quality_flags_applied': ', '.join(product_flags),
                 'masking_date':          datetime.now().isoformat(),
-                'scale_applied':         f'log10_val = DN * {scale_factor} + {add_offset}; physical = 10^log10_val',
+                'scale_applied':         scale_applied,
             }
         )
+        product_ds.close()
+        if qa:
+            masked_values[product_name] = values
+
+    if qa:
+        # Per-flag pixel counts (helpful diagnostic), from the QA record
+        record   = granule_qa_record(flag_words, masked_values, window)
+        total_px = flag_words.size
+        print(f"   Flag pixel counts (n_total = {total_px:,}):")
+        for name in flag_list:
+            if name in MERIS_FLAG_NAMES:
+                fraction = record[f'flag_{name}_fraction']
+                print(f"     {name:<18}: {round(fraction * total_px):>8,}  ({fraction * 100:.1f} %)")
+        stats.update(record)
+
+    # Build clean output dataset in physical units, no packing attributes
+    masked_ds = xr.Dataset(data_vars, attrs={**template, **window_to_attrs(window)})
+    return masked_ds, stats
 
-        masked_ds = xr.Dataset({'TSM_NN': masked_da}, attrs=tsm_ds_template.attrs)
 
-        encoding = {'TSM_NN': {'dtype': 'float32', '_FillValue': NODATA_VALUE}}
-        masked_ds.to_netcdf(output_path, encoding=encoding)
+def write_masked_dataset(masked_ds, output_path, output_encoding='float32'):
+    """
+    Saves a mask_products() dataset as netCDF: float32 with the NODATA_VALUE
+    fill, or log10-packed uint16 for log10 products with 'log10_uint16'.
+    """
+    encoding = {}
+    for name in list(masked_ds.data_vars):
+        if uses_log10_encoding(name, output_encoding):
+            da = masked_ds[name]
+            masked_ds[name] = da.copy(data=encode_log10_uint16(da.values))
+            masked_ds[name].attrs.update(
+                units=f"log10({da.attrs.get('units', '')})",
+                physical_units=da.attrs.get('units', ''),
+                output_encoding='log10_uint16',
+                scale_factor=LOG10_UINT16_SCALE, add_offset=LOG10_UINT16_OFFSET,
+                _FillValue=np.uint16(LOG10_UINT16_NODATA),
+            )
+            encoding[name] = {'dtype': 'uint16'}
+        else:
+            encoding[name] = {'dtype': 'float32', '_FillValue': NODATA_VALUE}
+    masked_ds.to_netcdf(output_path, encoding=encoding)
+    masked_ds.close()
 
-        masked_ds.close()
-        tsm_ds_template.close()
 
+def apply_product_masks(product_paths, common_flags_path, wqsf_path, output_path, flag_list,
+                        window=None, cache_dir=None, qa=False, output_encoding='float32'):
+    """
+    Runs mask_products() and saves all masked products in one netCDF, as
+    float32 physical-unit variables or log10-packed uint16 (see
+    write_masked_dataset()). Returns the masking statistics of the first
+    product, or None on error.
+    """
+    try:
+        masked_ds, stats = mask_products(product_paths, common_flags_path, wqsf_path,
+                                         flag_list, window=window, cache_dir=cache_dir, qa=qa)
+        write_masked_dataset(masked_ds, output_path, output_encoding=output_encoding)
         return stats
 
     except Exception as e:
-        import traceback
         print(f"  ✗ Error applying mask: {e}")
         traceback.print_exc()
         return None
 
 
-def run_step3(base_dir, safe_folder_suffix, masking_strategy):
+def apply_tsm_mask(tsm_nc_path, common_flags_path, wqsf_path, output_path, flag_list,
+                   window=None, cache_dir=None, output_encoding='float32'):
+    """
+    Reads raw packed TSM_NN DNs, applies scale/offset to get log10(g/m³) then
+    10^x to get physical g/m³, builds the combined MERIS quality mask from
+    common_flags.nc + wqsf.nc, applies it, and saves a clean netCDF: float32
+    in physical g/m³ (no scale_factor/add_offset attrs), or uint16 log10 DNs
+    with scale_factor/add_offset and _FillValue 65535 for 'log10_uint16'.
+    TSM-only shortcut for apply_product_masks().
+    """
+    return apply_product_masks({'TSM_NN': tsm_nc_path}, common_flags_path, wqsf_path,
+                               output_path, flag_list, window=window, cache_dir=cache_dir,
+                               output_encoding=output_encoding)
+
+
+def prepare_masked_granule(subfolder, flag_list, products=DEFAULT_PRODUCTS,
+                           roi_bounds=None, cache_dir=None, qa=False):
+    """
+    Step 3 for one product folder, up to (not including) the write: finds
+    its ROI window (if roi_bounds is given) and masks its products in memory.
+
+    Returns (status, masked_ds, stats) with status one of 'ok',
+    'no_overlap', 'missing' (required netCDFs absent) or 'error'.
+    """
+    product_paths      = {name: subfolder / PRODUCTS[name]['file'] for name in products}
+    common_flags_path  = subfolder / "common_flags.nc"
+    wqsf_path          = subfolder / "wqsf.nc"
+    required           = [common_flags_path, wqsf_path] + list(product_paths.values())
+
+    missing = [path.name for path in required if not path.exists()]
+    if missing:
+        print(f" Skipping {subfolder.name}: missing {', '.join(missing)}")
+        return 'missing', None, None
+
+    print(f" Processing: {subfolder.name}")
+
+    window = None
+    if roi_bounds is not None:
+        window = find_roi_window(subfolder, roi_bounds)
+        if window is None:
+            print(f"   ⏩ No overlap with ROI bounding box — skipping")
+            return 'no_overlap', None, None
+        print(f"   ROI window: rows {window[0].start}–{window[0].stop}, "
+              f"cols {window[1].start}–{window[1].stop}")
+
+    try:
+        masked_ds, stats = mask_products(product_paths, common_flags_path, wqsf_path,
+                                         flag_list, window=window, cache_dir=cache_dir, qa=qa)
+    except Exception as e:
+        print(f"  ✗ Error applying mask: {e}")
+        traceback.print_exc(file=sys.stdout)
+        return 'error', None, None
+    return 'ok', masked_ds, stats
+
+
+def mask_granule(subfolder, masked_dir, flag_list, products=DEFAULT_PRODUCTS,
+                 roi_bounds=None, cache_dir=None, output_encoding='float32'):
+    """
+    Step 3 for one product folder: prepare_masked_granule() followed by
+    writing <granule>_tsm_masked.nc to masked_dir.
+
+    Returns (status, output_path, stats), status as in prepare_masked_granule().
+    """
+    status, masked_ds, stats = prepare_masked_granule(subfolder, flag_list, products=products,
+                                                      roi_bounds=roi_bounds, cache_dir=cache_dir)
+    if status != 'ok':
+        return status, None, None
+
+    output_path = masked_dir / f"{subfolder.name}_tsm_masked.nc"
+    try:
+        write_masked_dataset(masked_ds, output_path, output_encoding=output_encoding)
+    except Exception as e:
+        print(f"  ✗ Error writing {output_path.name}: {e}")
+        return 'error', None, None
+    return 'ok', output_path, stats
+
+
+def write_qa_table(records, table_path):
+    """
+    Writes per-granule QA records (one row per granule) to a Parquet table,
+    replacing the rows of granules already in it. Falls back to CSV next to
+    it when no Parquet engine (pyarrow) is installed. Returns the path written.
+    """
+    import pandas as pd
+
+    table_path = Path(table_path)
+    frame      = pd.DataFrame.from_records(records)
+    if importlib.util.find_spec("pyarrow") is None:
+        table_path = table_path.with_suffix(".csv")
+        print(f"   WARNING: pyarrow not installed — writing QA table as CSV: {table_path.name}")
+
+    if table_path.exists():
+        existing = (pd.read_parquet(table_path) if table_path.suffix == ".parquet"
+                    else pd.read_csv(table_path))
+        # Tables written before the column was renamed from <product>_roi_coverage
+        existing = existing.rename(columns=lambda c: re.sub(r"_roi_coverage$", "_window_valid_fraction", c))
+        existing = existing[~existing['granule'].isin(frame['granule'])]
+        frame    = pd.concat([existing, frame], ignore_index=True)
+    frame = frame.sort_values('granule', ignore_index=True)
+
+    if table_path.suffix == ".parquet":
+        frame.to_parquet(table_path, index=False)
+    else:
+        frame.to_csv(table_path, index=False)
+    return table_path
+
+
+def run_step3(base_dir, safe_folder_suffix, masking_strategy, roi_bounds=None,
+              catalog_path=None, start_date=None, end_date=None, cache_dir=None,
+              products=DEFAULT_PRODUCTS, prefetch=DEFAULT_PREFETCH_DEPTH, qa_table=None,
+              output_encoding='float32'):
     masked_dir = base_dir / "tsm_masked"
     masked_dir.mkdir(exist_ok=True)
 
     print("\n" + "="*60)
-    print("STEP 3: APPLYING MERIS QUALITY FLAG MASKS TO TSM DATA")
+    print("STEP 3: APPLYING MERIS QUALITY FLAG MASKS TO PRODUCT DATA")
     print("="*60)
 
     flag_list = get_flag_list(masking_strategy)
     print(f"Masking strategy: {masking_strategy}")
     print(f"Flags applied:    {', '.join(flag_list)}")
+    print(f"Products:         {', '.join(products)}")
+    if roi_bounds is not None:
+        print(f"ROI window bbox:  {', '.join(f'{v:.4f}' for v in roi_bounds)}")
+    if qa_table is not None:
+        print(f"QA table:         {qa_table}")
     print(f"Output directory: {masked_dir}\n")
 
+    # Catalog pre-filter: only granules whose footprint bbox / date can matter
+    selected = None
+    if catalog_path is not None and Path(catalog_path).exists():
+        selected = {row['granule'] for row in query_granule_catalog(
+            catalog_path, roi_bounds=roi_bounds, start_date=start_date, end_date=end_date)}
+        print(f"Catalog selection: {len(selected)} granule(s) match ROI/date range\n")
+
     total_processed  = 0
+    total_no_overlap = 0
     total_masked_pix = 0
     total_valid_bef  = 0
     total_valid_aft  = 0
+    qa_records       = []
 
+    subfolders = []
     for subfolder in base_dir.iterdir():
         if subfolder.is_dir() and subfolder.name.endswith(safe_folder_suffix):
-            tsm_path           = subfolder / "tsm_nn.nc"
-            common_flags_path  = subfolder / "common_flags.nc"
-            wqsf_path          = subfolder / "wqsf.nc"
-
-            if tsm_path.exists() and common_flags_path.exists() and wqsf_path.exists():
-                output_path = masked_dir / f"{subfolder.name}_tsm_masked.nc"
-                print(f" Processing: {subfolder.name}")
-                stats = apply_tsm_mask(tsm_path, common_flags_path, wqsf_path, output_path, flag_list)
-
-                if stats:
-                    total_processed  += 1
-                    total_masked_pix += stats['masked_pixels']
-                    total_valid_bef  += stats['valid_before']
-                    total_valid_aft  += stats['valid_after']
-                    print(f"   Valid pixels: {stats['valid_before']:,} → {stats['valid_after']:,}")
-                    print(f"   Masked: {stats['masked_pixels']:,} px ({stats['masked_percent']:.1f}%)")
-            else:
-                missing = []
-                if not tsm_path.exists():          missing.append("tsm_nn.nc")
-                if not common_flags_path.exists(): missing.append("common_flags.nc")
-                if not wqsf_path.exists():          missing.append("wqsf.nc")
-                print(f" Skipping {subfolder.name}: missing {', '.join(missing)}")
+            if selected is not None and subfolder.name not in selected:
+                total_no_overlap += 1
+                continue
+            subfolders.append(subfolder)
+
+    # Next granules are read and masked in the background while the current
+    # one is written behind (see PIPELINED GRANULE I/O)
+    def prepare(subfolder):
+        return prepare_masked_granule(subfolder, flag_list, products=products,
+                                      roi_bounds=roi_bounds, cache_dir=cache_dir,
+                                      qa=qa_table is not None)
+
+    writes = []
+    with write_behind(prefetch) as submit:
+        for subfolder, result, error, log in prefetch_map(prepare, subfolders, prefetch):
+            print(log, end="")
+            if error is not None:
+                print(f"  ✗ Error processing {subfolder.name}: {error}")
+                continue
+
+            status, masked_ds, stats = result
+            if status == 'no_overlap':
+                total_no_overlap += 1
+
+            if status == 'ok':
+                writes.append((subfolder, stats, submit(
+                    write_masked_dataset, masked_ds, masked_dir / f"{subfolder.name}_tsm_masked.nc",
+                    output_encoding=output_encoding)))
+                print(f"   Valid pixels: {stats['valid_before']:,} → {stats['valid_after']:,}")
+                print(f"   Masked: {stats['masked_pixels']:,} px ({stats['masked_percent']:.1f}%)")
+
+    # Only granules whose masked file was actually written count
+    for subfolder, stats, future in writes:
+        if future.exception() is not None:
+            print(f"  ✗ Write failed for {subfolder.name}: {future.exception()}")
+            continue
+        total_processed  += 1
+        total_masked_pix += stats['masked_pixels']
+        total_valid_bef  += stats['valid_before']
+        total_valid_aft  += stats['valid_after']
+        if qa_table is not None:
+            qa_records.append({'granule': subfolder.name, 'masking_strategy': masking_strategy,
+                               **stats})
+
+    if qa_records:
+        written = write_qa_table(qa_records, qa_table)
+        print(f"QA table: {len(qa_records)} granule(s) written to {written}")
 
     overall_pct = (total_masked_pix / total_valid_bef * 100) if total_valid_bef > 0 else 0
     print(f"\n{'='*60}")
-    print(f"STEP 3 COMPLETE: Processed {total_processed} files")
+    print(f"STEP 3 COMPLETE: Processed {total_processed} files"
+          f" ({total_no_overlap} skipped, outside ROI/date range)")
     print(f"Total valid before: {total_valid_bef:,} | after: {total_valid_aft:,}")
     print(f"Total masked: {total_masked_pix:,} ({overall_pct:.1f}%)")
     print(f"{'='*60}\n")
@@ -450,121 +1556,459 @@ def run_step3(base_dir, safe_folder_suffix, masking_strategy):
 # STEP 4: CREATE GEOTIFFS FROM MASKED SWATH DATA
 # ==============================================================================
 #
-# Reads the clean float32 g/m³ netCDF from Step 3.
-# Opens with mask_and_scale=False since the file is already in physical units
-# with no packing attributes — values are ready to write directly to GeoTIFF.
+# Reads the masked netCDF from Step 3 with mask_and_scale=False and decodes
+# it with read_physical(): float32 g/m³ files are used as is, log10_uint16
+# files are unpacked to physical units before resampling. GeoTIFFs are then
+# written in the chosen --output-encoding: float32 g/m³ with NODATA_VALUE, or
+# uint16 log10 DNs with band scale/offset and nodata 65535.
 # ==============================================================================
 
-def create_geotiff_from_masked_swath(masked_tsm_path, geo_nc_path, output_path,
-                                     res_deg=0.0027, nodata=NODATA_VALUE):
+def compute_target_grid(lat, lon, res_deg):
     """
-    Resamples masked TSM swath (g/m³) onto a regular lat/lon grid and
-    writes a float32 GeoTIFF (EPSG:4326).
+    Defines the regular lat/lon target grid covering a swath:
+    {'lon_min', 'lat_min', 'lon_max', 'lat_max', 'cols', 'rows'}.
     """
-    tsm_ds = xr.open_dataset(masked_tsm_path, mask_and_scale=False)
-    geo_ds = xr.open_dataset(geo_nc_path,     mask_and_scale=True)
+    lat_min, lat_max = float(np.nanmin(lat)), float(np.nanmax(lat))
+    lon_min, lon_max = float(np.nanmin(lon)), float(np.nanmax(lon))
 
-    tsm = tsm_ds["TSM_NN"].values.squeeze().astype(np.float32)
-    lat = geo_ds["latitude"].values
-    lon = geo_ds["longitude"].values
-
-    tsm = np.where(tsm == nodata, np.nan, tsm)
+    ref_lats = np.arange(lat_min, lat_max, res_deg)
+    ref_lons = np.arange(lon_min, lon_max, res_deg)
 
-    valid_in = tsm[np.isfinite(tsm)]
-    if valid_in.size == 0:
-        print(f"   No valid TSM pixels — skipping")
-        tsm_ds.close()
-        geo_ds.close()
-        return False
-    print(f"   Input TSM range:     {valid_in.min():.4f} – {valid_in.max():.4f} g/m³")
+    return {'lon_min': lon_min, 'lat_min': lat_min, 'lon_max': lon_max, 'lat_max': lat_max,
+            'cols': len(ref_lons), 'rows': len(ref_lats)}
 
-    swath_def = geom.SwathDefinition(lons=lon, lats=lat)
-    lat_min, lat_max = np.nanmin(lat), np.nanmax(lat)
-    lon_min, lon_max = np.nanmin(lon), np.nanmax(lon)
 
-    ref_lats = np.arange(lat_min, lat_max, res_deg)
-    ref_lons = np.arange(lon_min, lon_max, res_deg)
-    cols, rows = len(ref_lons), len(ref_lats)
+def grid_area_definition(grid):
+    """Builds the pyresample AreaDefinition for a target grid dict."""
+    from pyresample import geometry as geom
 
-    area_def = geom.AreaDefinition(
+    return geom.AreaDefinition(
         "area_id", "MERIS Grid", "latlon",
         {'proj': 'longlat', 'datum': 'WGS84'},
-        cols, rows,
-        (lon_min, lat_min, lon_max, lat_max)
+        grid['cols'], grid['rows'],
+        (grid['lon_min'], grid['lat_min'], grid['lon_max'], grid['lat_max'])
     )
 
+
+def get_neighbour_indices(geo_nc_path, window=None, res_deg=0.0027, cache_dir=None, grid=None):
+    """
+    Returns (grid, valid_input_index, valid_output_index, index_array) for
+    nearest-neighbour resampling of a swath onto its target grid (the
+    swath's own bounding grid at res_deg, or the given grid dict). The
+    indices depend only on geolocation, so they are cached per granule and
+    reused regardless of which quality flags were applied.
+    """
+    from pyresample import geometry as geom, kd_tree as kdt
+
+    cache_path, key = None, None
+    if cache_dir is not None:
+        cache_path = Path(cache_dir) / f"{Path(geo_nc_path).parent.name}_nn.npz"
+        grid_id    = None if grid is None else sorted(grid.items())
+        key        = cache_key([geo_nc_path], window, res_deg, RADIUS_OF_INFLUENCE_M, grid_id)
+        cached     = load_cache_entry(cache_path, key)
+        if cached is not None:
+            print(f"   Using cached neighbour indices: {cache_path.name}")
+            lon_min, lat_min, lon_max, lat_max = (float(v) for v in cached['grid_bounds'])
+            rows, cols = (int(v) for v in cached['grid_shape'])
+            grid = {'lon_min': lon_min, 'lat_min': lat_min, 'lon_max': lon_max,
+                    'lat_max': lat_max, 'cols': cols, 'rows': rows}
+            return grid, cached['valid_input_index'], cached['valid_output_index'], cached['index_array']
+
+    lat, lon  = read_geolocation(geo_nc_path, window)
+    swath_def = geom.SwathDefinition(lons=lon, lats=lat)
+    if grid is None:
+        grid = compute_target_grid(lat, lon, res_deg)
+    area_def  = grid_area_definition(grid)
+
     index, outdex, index_array, dist_array = kdt.get_neighbour_info(
-        swath_def, area_def, radius_of_influence=5000, neighbours=1
+        swath_def, area_def, radius_of_influence=RADIUS_OF_INFLUENCE_M, neighbours=1
     )
-    grid = kdt.get_sample_from_neighbour_info(
-        'nn', area_def.shape, tsm, index, outdex, index_array, fill_value=np.nan
-    ).astype(np.float32)
-
-    valid_out = grid[np.isfinite(grid)]
-    if valid_out.size > 0:
-        print(f"   Resampled TSM range: {valid_out.min():.4f} – {valid_out.max():.4f} g/m³")
 
-    grid_out = np.where(np.isnan(grid), nodata, grid).astype(np.float32)
+    if cache_path is not None:
+        save_cache_entry(
+            cache_path, key,
+            grid_bounds=np.array([grid['lon_min'], grid['lat_min'], grid['lon_max'], grid['lat_max']]),
+            grid_shape=np.array([grid['rows'], grid['cols']]),
+            valid_input_index=index, valid_output_index=outdex, index_array=index_array
+        )
+    return grid, index, outdex, index_array
 
-    driver  = gdal.GetDriverByName("GTiff")
-    dataset = driver.Create(str(output_path), cols, rows, 1, gdal.GDT_Float32)
 
-    pixel_size_x = (lon_max - lon_min) / cols
-    pixel_size_y = (lat_max - lat_min) / rows
-    dataset.SetGeoTransform([lon_min, pixel_size_x, 0, lat_max, 0, -pixel_size_y])
+def read_geolocation(geo_nc_path, window=None):
+    """Reads (lat, lon) of a swath, or of its ROI window, from geo_coordinates.nc."""
+    import xarray as xr
 
-    srs = osr.SpatialReference()
-    srs.ImportFromEPSG(4326)
-    dataset.SetProjection(srs.ExportToWkt())
+    geo_ds = xr.open_dataset(geo_nc_path, mask_and_scale=True)
+    lat = read_window(geo_ds["latitude"],  window).values
+    lon = read_window(geo_ds["longitude"], window).values
+    geo_ds.close()
+    return lat, lon
 
-    band = dataset.GetRasterBand(1)
-    band.WriteArray(grid_out)
-    band.SetNoDataValue(nodata)
-    band.SetMetadataItem('UNITS', 'g m-3')
 
-    if 'quality_flags_applied' in tsm_ds["TSM_NN"].attrs:
-        band.SetMetadataItem('QUALITY_FLAGS', tsm_ds["TSM_NN"].attrs['quality_flags_applied'])
-    if 'scale_applied' in tsm_ds["TSM_NN"].attrs:
-        band.SetMetadataItem('SCALE_APPLIED', tsm_ds["TSM_NN"].attrs['scale_applied'])
+def compute_bin_index(lat, lon, grid):
+    """
+    Flat target-cell index (row * cols + col) of every swath pixel centre,
+    -1 where the pixel falls outside the grid or has no geolocation.
+    """
+    pixel_size_x = (grid['lon_max'] - grid['lon_min']) / grid['cols']
+    pixel_size_y = (grid['lat_max'] - grid['lat_min']) / grid['rows']
+    fx = (lon - grid['lon_min']) / pixel_size_x
+    fy = (grid['lat_max'] - lat) / pixel_size_y
 
-    band.FlushCache()
-    dataset = None
-    tsm_ds.close()
-    geo_ds.close()
+    inside = (fx >= 0) & (fx <= grid['cols']) & (fy >= 0) & (fy <= grid['rows'])
+    col = np.minimum(np.floor(np.where(inside, fx, 0)), grid['cols'] - 1).astype(np.int64)
+    row = np.minimum(np.floor(np.where(inside, fy, 0)), grid['rows'] - 1).astype(np.int64)
+    return np.where(inside, row * grid['cols'] + col, -1)
 
-    print(f"   Saved GeoTIFF: {output_path.name}")
-    return True
 
+def get_bin_indices(geo_nc_path, window=None, res_deg=0.0027, cache_dir=None, grid=None):
+    """
+    Returns (grid, cell_index) for forward binning of a swath onto its
+    target grid (see compute_bin_index()). Like the KD-tree neighbour
+    indices, these depend only on geolocation and are cached per granule.
+    """
+    cache_path, key = None, None
+    if cache_dir is not None:
+        cache_path = Path(cache_dir) / f"{Path(geo_nc_path).parent.name}_bins.npz"
+        grid_id    = None if grid is None else sorted(grid.items())
+        key        = cache_key([geo_nc_path], window, res_deg, grid_id)
+        cached     = load_cache_entry(cache_path, key)
+        if cached is not None:
+            print(f"   Using cached bin indices: {cache_path.name}")
+            lon_min, lat_min, lon_max, lat_max = (float(v) for v in cached['grid_bounds'])
+            rows, cols = (int(v) for v in cached['grid_shape'])
+            grid = {'lon_min': lon_min, 'lat_min': lat_min, 'lon_max': lon_max,
+                    'lat_max': lat_max, 'cols': cols, 'rows': rows}
+            return grid, cached['cell_index']
+
+    lat, lon = read_geolocation(geo_nc_path, window)
+    if grid is None:
+        grid = compute_target_grid(lat, lon, res_deg)
+    cell_index = compute_bin_index(lat, lon, grid)
+    cell_index = cell_index.astype(np.int32 if grid['rows'] * grid['cols'] < 2**31 else np.int64)
+
+    if cache_path is not None:
+        save_cache_entry(
+            cache_path, key,
+            grid_bounds=np.array([grid['lon_min'], grid['lat_min'], grid['lon_max'], grid['lat_max']]),
+            grid_shape=np.array([grid['rows'], grid['cols']]),
+            cell_index=cell_index
+        )
+    return grid, cell_index
 
-def run_step4(base_dir, masked_dir):
-    output_dir = base_dir / "geotiff"
-    output_dir.mkdir(exist_ok=True)
 
-    print("\n" + "="*60)
-    print("STEP 4: CREATING GEOTIFFS FROM MASKED NETCDF FILES")
-    print("="*60)
-    print(f"Input directory:  {masked_dir}")
-    print(f"Output directory: {output_dir}\n")
+def bin_swath(values, cell_index, grid):
+    """
+    Forward-bins swath values into target cells with np.bincount.
+    Returns (mean, count) grids; mean is NaN where no valid pixel landed.
+    """
+    valid  = (cell_index.ravel() >= 0) & np.isfinite(values.ravel())
+    cells  = cell_index.ravel()[valid]
+    n      = grid['rows'] * grid['cols']
+    sums   = np.bincount(cells, weights=values.ravel()[valid].astype(np.float64), minlength=n)
+    count  = np.bincount(cells, minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count > 0, sums / count, np.nan)
+    shape = (grid['rows'], grid['cols'])
+    return mean.reshape(shape).astype(np.float32), count.reshape(shape).astype(np.int32)
+
+
+def fill_gaps(grid_values, iterations=1):
+    """
+    Fills empty (NaN) cells with the mean of their valid 3×3 neighbours,
+    repeated `iterations` times, so each pass closes gaps one cell wider.
+    """
+    filled = grid_values.copy()
+    for _ in range(iterations):
+        empty = np.isnan(filled)
+        if not empty.any():
+            break
+        padded = np.pad(filled, 1, constant_values=np.nan)
+        valid  = np.isfinite(padded)
+        data   = np.where(valid, padded, 0.0)
+        sums   = np.zeros(filled.shape)
+        counts = np.zeros(filled.shape)
+        rows, cols = filled.shape
+        for dy in range(3):
+            for dx in range(3):
+                sums   += data[dy:dy + rows, dx:dx + cols]
+                counts += valid[dy:dy + rows, dx:dx + cols]
+        fillable = empty & (counts > 0)
+        filled[fillable] = (sums[fillable] / counts[fillable]).astype(filled.dtype)
+    return filled
+
+
+def product_output_name(product_name, granule):
+    """GeoTIFF filename for one product of one granule, e.g. TSM_<granule>.tif."""
+    return f"{PRODUCTS[product_name]['prefix']}_{granule}.tif"
+
+
+def split_output_name(filename):
+    """Inverse of product_output_name(): returns (prefix, granule) from a .tif name."""
+    prefix, _, granule = Path(filename).stem.partition("_")
+    return prefix, granule
+
+
+def write_raster(output_path, array, transform, crs, nodata,
+                 output_profile=DEFAULT_OUTPUT_PROFILE, tags=None, scale_offset=None):
+    """
+    Writes a single-band raster with one of the OUTPUT_PROFILES. Tiled GTiff
+    profiles are written block by block along the internal tile grid and
+    get internal overviews; COG output is assembled by GDAL on close.
+    scale_offset, if given, is stored as the GDAL band scale/offset.
+    """
+    import rasterio
+    from rasterio.enums import Resampling
+
+    profile = OUTPUT_PROFILES[output_profile]
+    options = dict(profile['options'])
+    if options.get('predictor') == 'auto':
+        options['predictor'] = 3 if np.issubdtype(array.dtype, np.floating) else 2
+
+    with rasterio.open(
+        output_path, "w", driver=profile['driver'],
+        height=array.shape[0], width=array.shape[1], count=1, dtype=array.dtype,
+        crs=crs, transform=transform, nodata=nodata, **options
+    ) as dst:
+        if options.get('tiled'):
+            for _, window in dst.block_windows(1):
+                dst.write(array[window.toslices()], 1, window=window)
+        else:
+            dst.write(array, 1)
+        if tags:
+            dst.update_tags(1, **tags)
+        if scale_offset is not None:
+            dst.scales, dst.offsets = (scale_offset[0],), (scale_offset[1],)
+        if profile['overviews']:
+            dst.build_overviews(profile['overviews'], Resampling.average)
+            dst.update_tags(ns='rio_overview', resampling='average')
 
-    processed_count = 0
-    skipped_count   = 0
 
-    for masked_file in masked_dir.glob("*.nc"):
+def grid_dataarray(values, grid, attrs=None):
+    """
+    Wraps a 2-D array on a target grid dict as an xarray.DataArray with
+    pixel-centre 'y' (latitude, north-up) and 'x' (longitude) coordinates.
+    """
+    import xarray as xr
+
+    pixel_size_x = (grid['lon_max'] - grid['lon_min']) / grid['cols']
+    pixel_size_y = (grid['lat_max'] - grid['lat_min']) / grid['rows']
+    x = grid['lon_min'] + (np.arange(grid['cols']) + 0.5) * pixel_size_x
+    y = grid['lat_max'] - (np.arange(grid['rows']) + 0.5) * pixel_size_y
+    return xr.DataArray(values, dims=('y', 'x'), coords={'y': y, 'x': x},
+                        attrs={'crs': 'EPSG:4326', 'res': (pixel_size_x, pixel_size_y),
+                               **(attrs or {})})
+
+
+def dataarray_transform(da):
+    """Affine transform (north-up) of a DataArray built by grid_dataarray()."""
+    from rasterio.transform import from_origin
+
+    pixel_size_x, pixel_size_y = (float(v) for v in da.attrs['res'])
+    x, y = da['x'].values, da['y'].values
+    return from_origin(float(x[0]) - pixel_size_x / 2, float(y[0]) + pixel_size_y / 2,
+                       pixel_size_x, pixel_size_y)
+
+
+def raster_tags(da):
+    """GeoTIFF band tags for a gridded product DataArray."""
+    tags = {'UNITS': da.attrs.get('units', ''), 'PRODUCT': da.attrs.get('product', da.name)}
+    if 'quality_flags_applied' in da.attrs:
+        tags['QUALITY_FLAGS'] = da.attrs['quality_flags_applied']
+    if 'scale_applied' in da.attrs:
+        tags['SCALE_APPLIED'] = da.attrs['scale_applied']
+    if 'gridding' in da.attrs:
+        tags['GRIDDING'] = da.attrs['gridding']
+    if 'n_passes' in da.attrs:
+        tags['N_PASSES'] = str(da.attrs['n_passes'])
+    return tags
+
+
+def save_dataarray(da, output_path, nodata=NODATA_VALUE, output_profile=DEFAULT_OUTPUT_PROFILE,
+                   output_encoding='float32'):
+    """
+    Writes a gridded DataArray (NaN = no data) as a GeoTIFF: float32, or
+    log10-packed uint16 for log10 products with 'log10_uint16'.
+    """
+    if not uses_log10_encoding(da.attrs.get('product', da.name), output_encoding):
+        output_encoding = 'float32'
+    values, nodata, tags, scale_offset = encoded_raster(da.values, output_encoding,
+                                                        raster_tags(da), nodata=nodata)
+    write_raster(output_path, values, dataarray_transform(da), da.attrs.get('crs', 'EPSG:4326'),
+                 nodata, output_profile=output_profile, tags=tags, scale_offset=scale_offset)
+
+
+def grid_masked_products(masked_ds, geo_nc_path, res_deg=0.0027, nodata=NODATA_VALUE,
+                         cache_dir=None, grid=None, gridding=DEFAULT_GRIDDING, gap_fill=0):
+    """
+    Resamples every masked product swath in a Step 3 dataset (in memory or
+    opened from disk) onto a regular lat/lon grid with one of the
+    GRIDDING_BACKENDS. The neighbour search (or bin index) runs once per
+    granule and is shared by all products (and cached when cache_dir is
+    given). If Step 3 read only an ROI window of the swath, the same window
+    of the geolocation is read here. With gap_fill > 0, empty cells are
+    filled from their neighbours (see fill_gaps()).
+
+    Returns {product_name: DataArray} (see grid_dataarray(), NaN = no data);
+    binned products carry the per-cell pixel count as an 'n_obs' coordinate.
+    Products with no valid pixels are left out.
+    """
+    window = window_from_attrs(masked_ds.attrs)
+
+    neighbours = None
+    gridded    = {}
+    for product_name in masked_ds.data_vars:
+        if product_name not in PRODUCTS:
+            continue
+        product = PRODUCTS[product_name]
+        da      = masked_ds[product_name]
+
+        values = read_physical(da, nodata)
+
+        valid_in = values[np.isfinite(values)]
+        if valid_in.size == 0:
+            print(f"   No valid {product_name} pixels — skipping")
+            continue
+        print(f"   Input {product_name} range:     {valid_in.min():.4f} – {valid_in.max():.4f} {product['units']}")
+
+        count = None
+        if gridding == 'binning':
+            if neighbours is None:
+                neighbours = get_bin_indices(
+                    geo_nc_path, window=window, res_deg=res_deg, cache_dir=cache_dir, grid=grid
+                )
+            target, cell_index = neighbours
+            resampled, count   = bin_swath(values, cell_index, target)
+        else:
+            from pyresample import kd_tree as kdt
+
+            if neighbours is None:
+                neighbours = get_neighbour_indices(
+                    geo_nc_path, window=window, res_deg=res_deg, cache_dir=cache_dir, grid=grid
+                )
+            target, index, outdex, index_array = neighbours
+
+            resampled = kdt.get_sample_from_neighbour_info(
+                'nn', (target['rows'], target['cols']), values, index, outdex, index_array, fill_value=np.nan
+            ).astype(np.float32)
+        if gap_fill > 0:
+            resampled = fill_gaps(resampled, gap_fill)
+
+        valid_out = resampled[np.isfinite(resampled)]
+        if valid_out.size > 0:
+            print(f"   Resampled {product_name} range: {valid_out.min():.4f} – {valid_out.max():.4f} {product['units']}")
+
+        attrs = {key: da.attrs[key] for key in ('units', 'long_name', 'quality_flags_applied', 'scale_applied')
+                 if key in da.attrs}
+        attrs['units'] = da.attrs.get('physical_units', attrs.get('units', product['units']))
+        attrs['product']  = product_name
+        attrs['gridding'] = gridding
+        da_out = grid_dataarray(resampled, target, attrs).rename(product_name)
+        if count is not None:
+            da_out = da_out.assign_coords(n_obs=(('y', 'x'), count))
+        gridded[product_name] = da_out
+
+    return gridded
+
+
+def grid_masked_file(masked_path, geo_nc_path, res_deg=0.0027, nodata=NODATA_VALUE, cache_dir=None,
+                     gridding=DEFAULT_GRIDDING, gap_fill=0):
+    """grid_masked_products() for a Step 3 netCDF on disk; the file is closed on return."""
+    import xarray as xr
+
+    with xr.open_dataset(masked_path, mask_and_scale=False) as masked_ds:
+        return grid_masked_products(masked_ds, geo_nc_path, res_deg=res_deg, nodata=nodata,
+                                    cache_dir=cache_dir, gridding=gridding, gap_fill=gap_fill)
+
+
+def create_geotiff_from_masked_swath(masked_path, geo_nc_path, output_dir,
+                                     res_deg=0.0027, nodata=NODATA_VALUE, cache_dir=None,
+                                     output_profile=DEFAULT_OUTPUT_PROFILE,
+                                     gridding=DEFAULT_GRIDDING, gap_fill=0, output_encoding='float32'):
+    """
+    Resamples every masked product swath in a Step 3 netCDF onto a regular
+    lat/lon grid (see grid_masked_products()) and writes one GeoTIFF
+    (EPSG:4326) per product, named by product_output_name(), using the given
+    output profile and encoding (float32, or log10_uint16 for log10
+    products, see OUTPUT ENCODING). Returns the list of GeoTIFFs written.
+    """
+    granule = Path(geo_nc_path).parent.name
+    gridded = grid_masked_file(masked_path, geo_nc_path, res_deg=res_deg, nodata=nodata,
+                               cache_dir=cache_dir, gridding=gridding, gap_fill=gap_fill)
+    written = []
+    for product_name, da in gridded.items():
+        output_path = Path(output_dir) / product_output_name(product_name, granule)
+        save_dataarray(da, output_path, nodata=nodata, output_profile=output_profile,
+                       output_encoding=output_encoding)
+        written.append(output_path)
+        print(f"   Saved GeoTIFF: {output_path.name}")
+
+    return written
+
+
+def run_step4(base_dir, masked_dir, cache_dir=None, output_profile=DEFAULT_OUTPUT_PROFILE,
+              prefetch=DEFAULT_PREFETCH_DEPTH, gridding=DEFAULT_GRIDDING, gap_fill=0,
+              output_encoding='float32'):
+    output_dir = base_dir / "geotiff"
+    output_dir.mkdir(exist_ok=True)
+
+    print("\n" + "="*60)
+    print("STEP 4: CREATING GEOTIFFS FROM MASKED NETCDF FILES")
+    print("="*60)
+    print(f"Input directory:  {masked_dir}")
+    print(f"Output directory: {output_dir}")
+    print(f"Gridding:         {gridding}" + (f" (gap fill: {gap_fill})" if gap_fill else ""))
+    print(f"Output encoding:  {output_encoding}\n")
+
+    processed_count = 0
+    skipped_count   = 0
+
+    granules = []
+    for masked_file in masked_dir.glob("*.nc"):
         original_folder_name = masked_file.name.replace("_tsm_masked.nc", "")
-        original_folder      = base_dir / original_folder_name
-        geo_path             = original_folder / "geo_coordinates.nc"
+        geo_path             = base_dir / original_folder_name / "geo_coordinates.nc"
 
         if geo_path.exists():
-            output_path = output_dir / f"TSM_{original_folder_name}.tif"
-            print(f"📂 Processing: {original_folder_name}")
-            if create_geotiff_from_masked_swath(masked_file, geo_path, output_path):
-                processed_count += 1
-            else:
-                skipped_count += 1
+            granules.append((original_folder_name, masked_file, geo_path))
         else:
             print(f"⏩ Skipping: {original_folder_name} (missing geo_coordinates.nc)")
             skipped_count += 1
 
+    # Next granules are read and resampled in the background while the
+    # current one's GeoTIFFs are written behind (see PIPELINED GRANULE I/O)
+    def prepare(granule):
+        name, masked_file, geo_path = granule
+        print(f"📂 Processing: {name}")
+        return grid_masked_file(masked_file, geo_path, cache_dir=cache_dir,
+                                gridding=gridding, gap_fill=gap_fill)
+
+    writes = []
+    with write_behind(prefetch) as submit:
+        for (name, _, _), gridded, error, log in prefetch_map(prepare, granules, prefetch):
+            print(log, end="")
+            if error is not None:
+                print(f"  ✗ Error processing {name}: {error}")
+                skipped_count += 1
+                continue
+            if not gridded:
+                skipped_count += 1
+                continue
+
+            for product_name, da in gridded.items():
+                output_path = output_dir / product_output_name(product_name, name)
+                writes.append((output_path, submit(save_dataarray, da, output_path,
+                                                   output_profile=output_profile,
+                                                   output_encoding=output_encoding)))
+
+    # Report only GeoTIFFs whose write completed
+    for output_path, future in writes:
+        if future.exception() is not None:
+            print(f"  ✗ Write failed for {output_path.name}: {future.exception()}")
+            skipped_count += 1
+            continue
+        processed_count += 1
+        print(f"   Saved GeoTIFF: {output_path.name}")
+
     print(f"\n{'='*60}")
     print(f"STEP 4 COMPLETE: Created {processed_count} GeoTIFFs, skipped {skipped_count}")
     print(f"{'='*60}\n")
@@ -576,8 +2020,13 @@ def run_step4(base_dir, masked_dir):
 # STEP 5: CLIP TO REGION OF INTEREST
 # ==============================================================================
 
-def clip_geotiff_with_shapefile(geotiff_path, shapefile_path, output_path):
+def clip_geotiff_with_shapefile(geotiff_path, shapefile_path, output_path,
+                                output_profile=DEFAULT_OUTPUT_PROFILE):
     """Clips a GeoTIFF to a shapefile boundary using rioxarray."""
+    import geopandas as gpd
+    import rioxarray
+    import rasterio
+
     try:
         roi    = gpd.read_file(shapefile_path)
         raster = rioxarray.open_rasterio(geotiff_path, masked=True)
@@ -586,7 +2035,21 @@ def clip_geotiff_with_shapefile(geotiff_path, shapefile_path, output_path):
             roi = roi.to_crs(raster.rio.crs)
 
         clipped = raster.rio.clip(roi.geometry.values, roi.crs, drop=True, invert=False)
-        clipped.rio.to_raster(output_path, compress='lzw')
+
+        with rasterio.open(geotiff_path) as src:
+            tags   = src.tags(1)
+            nodata = src.nodata if src.nodata is not None else NODATA_VALUE
+        data = clipped.values[0]
+
+        # Keep the encoding of the input (see OUTPUT ENCODING)
+        scale_offset = None
+        if tags.get('OUTPUT_ENCODING') == 'log10_uint16':
+            data = np.where(np.isnan(data), LOG10_UINT16_NODATA, data).astype(np.uint16)
+            scale_offset = (LOG10_UINT16_SCALE, LOG10_UINT16_OFFSET)
+        else:
+            data = np.where(np.isnan(data), nodata, data).astype(np.float32)
+        write_raster(output_path, data, clipped.rio.transform(), clipped.rio.crs, nodata,
+                     output_profile=output_profile, tags=tags, scale_offset=scale_offset)
         print(f"  ✓ Clipped: {output_path.name}")
         return True
     except Exception as e:
@@ -594,7 +2057,7 @@ def clip_geotiff_with_shapefile(geotiff_path, shapefile_path, output_path):
         return False
 
 
-def run_step5(base_dir, output_dir, roi_shape):
+def run_step5(base_dir, output_dir, roi_shape, output_profile=DEFAULT_OUTPUT_PROFILE):
     clipped_dir = base_dir / "geotiff_clipped"
     clipped_dir.mkdir(exist_ok=True)
 
@@ -618,12 +2081,14 @@ def run_step5(base_dir, output_dir, roi_shape):
         clipped_path = clipped_dir / geotiff_file.name
         print(f"[{total_clips}] {geotiff_file.name}")
 
-        if clipped_path.exists():
+        # Re-clip when Step 4 rewrote the source (e.g. after a masking change)
+        if clipped_path.exists() and clipped_path.stat().st_mtime >= geotiff_file.stat().st_mtime:
             print(f"  ⊙ Already exists — skipping")
             successful_clips += 1
             continue
 
-        if clip_geotiff_with_shapefile(geotiff_file, roi_shape, clipped_path):
+        if clip_geotiff_with_shapefile(geotiff_file, roi_shape, clipped_path,
+                                       output_profile=output_profile):
             successful_clips += 1
 
     print(f"\n{'='*60}")
@@ -637,46 +2102,106 @@ def run_step5(base_dir, output_dir, roi_shape):
 # STEP 6: CREATE DAILY MOSAIC RASTERS
 # ==============================================================================
 
-def merge_and_average(files, nodata=NODATA_VALUE):
+def merge_sum_count(files, nodata=NODATA_VALUE):
     """
-    Merges multiple same-day rasters and averages overlapping pixels.
-    Nodata sentinel is excluded from averaging via NaN promotion.
+    Merges multiple same-day rasters onto their union grid and returns
+    (sum, count, transform, meta): the per-pixel sum and number of valid
+    passes. Nodata sentinel is excluded via NaN promotion.
     """
+    import rasterio
+    from rasterio.merge import merge
+
     srcs = [rasterio.open(f) for f in files]
     merged_array, merged_transform = merge(srcs, method='first')
 
-    stack = []
-    for src in srcs:
-        data = src.read(1).astype(np.float32)
-        data = np.where(data == nodata, np.nan, data)
-
-        reprojected = np.full(merged_array[0].shape, np.nan, dtype=np.float32)
-        reproject(
-            source=data,
-            destination=reprojected,
-            src_transform=src.transform,
-            src_crs=src.crs,
-            dst_transform=merged_transform,
-            dst_crs=src.crs,
-            resampling=Resampling.nearest,
-            src_nodata=np.nan,
-            dst_nodata=np.nan
-        )
-        stack.append(reprojected)
+    # Physical values whatever the storage encoding (see OUTPUT ENCODING)
+    sources = [(read_physical_band(src, nodata), src.transform) for src in srcs]
 
-    stack    = np.stack(stack, axis=0)
-    averaged = np.nanmean(stack, axis=0)
-
-    averaged_out = np.where(np.isnan(averaged), nodata, averaged).astype(np.float32)
+    total, count = sum_count_onto_grid(sources, merged_transform, merged_array[0].shape, srcs[0].crs)
 
     meta = srcs[0].meta.copy()
     for src in srcs:
         src.close()
 
+    return total, count, merged_transform, meta
+
+
+def merge_and_average(files, nodata=NODATA_VALUE):
+    """
+    Merges multiple same-day rasters and averages overlapping pixels.
+    Nodata sentinel is excluded from averaging via NaN promotion.
+    """
+    total, count, merged_transform, meta = merge_sum_count(files, nodata=nodata)
+    averaged_out = np.where(count > 0, total / np.maximum(count, 1), nodata).astype(np.float32)
     return averaged_out, merged_transform, meta
 
 
-def run_step6(clipped_dir, flag_list, masking_strategy):
+def average_onto_grid(sources, dst_transform, dst_shape, crs):
+    """
+    Nearest-neighbour reprojects each (array, transform) source (NaN = no
+    data) onto one destination grid and averages overlapping pixels.
+    """
+    total, count = sum_count_onto_grid(sources, dst_transform, dst_shape, crs)
+    return np.where(count > 0, total / np.maximum(count, 1), np.nan).astype(np.float32)
+
+
+def sum_count_onto_grid(sources, dst_transform, dst_shape, crs):
+    """
+    Nearest-neighbour reprojects each (array, transform) source (NaN = no
+    data) onto one destination grid and accumulates the per-pixel sum and
+    count of valid values, one source at a time.
+    """
+    from rasterio.warp import reproject, Resampling
+
+    total = np.zeros(dst_shape, dtype=np.float64)
+    count = np.zeros(dst_shape, dtype=np.int32)
+    for data, src_transform in sources:
+        if data.shape == tuple(dst_shape) and src_transform == dst_transform:
+            reprojected = data   # already on the destination grid
+        else:
+            reprojected = np.full(dst_shape, np.nan, dtype=np.float32)
+            reproject(
+                source=data,
+                destination=reprojected,
+                src_transform=src_transform,
+                src_crs=crs,
+                dst_transform=dst_transform,
+                dst_crs=crs,
+                resampling=Resampling.nearest,
+                src_nodata=np.nan,
+                dst_nodata=np.nan
+            )
+        valid = np.isfinite(reprojected)
+        total[valid] += reprojected[valid]
+        count += valid
+    return total, count
+
+
+def aggregate_blocks(total, count, factor):
+    """
+    Block-aggregates fine sum/count grids by an integer factor (edges padded
+    with empty cells). Returns the coarse (sum, count); their ratio is the
+    mean of all valid fine observations in each block, so pixels seen by
+    more passes weigh proportionally more.
+    """
+    rows, cols = total.shape
+    pad_rows, pad_cols = -rows % factor, -cols % factor
+    total = np.pad(total, ((0, pad_rows), (0, pad_cols)))
+    count = np.pad(count, ((0, pad_rows), (0, pad_cols)))
+    shape = (total.shape[0] // factor, factor, total.shape[1] // factor, factor)
+    return total.reshape(shape).sum(axis=(1, 3)), count.reshape(shape).sum(axis=(1, 3))
+
+
+def run_step6(clipped_dir, flag_list, masking_strategy, catalog_path=None,
+              output_profile=DEFAULT_OUTPUT_PROFILE, pyramid_factors=(), dates=None):
+    """
+    Builds one daily mosaic per product and acquisition date from the
+    clipped GeoTIFFs. With dates (YYYYMMDD strings), only the mosaics of
+    those dates are rebuilt.
+    """
+    import rasterio
+    from rasterio.transform import Affine
+
     input_folder  = str(clipped_dir)
     output_folder = os.path.join(input_folder, "daily_mosaics")
     os.makedirs(output_folder, exist_ok=True)
@@ -685,40 +2210,69 @@ def run_step6(clipped_dir, flag_list, masking_strategy):
     print("STEP 6: CREATING DAILY MOSAIC RASTERS")
     print("="*60)
     print(f"Input directory:  {input_folder}")
-    print(f"Output directory: {output_folder}\n")
+    print(f"Output directory: {output_folder}")
+    if pyramid_factors:
+        print(f"Pyramid levels:   {', '.join(f'x{f}' for f in pyramid_factors)} (in x<factor>/ subfolders)")
+    print()
+
+    for factor in pyramid_factors:
+        os.makedirs(os.path.join(output_folder, f"x{factor}"), exist_ok=True)
 
     all_files = glob.glob(os.path.join(input_folder, "*.tif"))
 
+    # Group by real acquisition date from the catalog, falling back to the
+    # first 8-digit run in the filename for granules not in the catalog
+    catalog_dates = {}
+    if catalog_path is not None and Path(catalog_path).exists():
+        catalog_dates = get_acquisition_dates(catalog_path)
+
+    # Files are grouped per product (filename prefix, e.g. TSM / PAR / Oa08)
     date_pattern  = re.compile(r"(\d{8})")
     files_by_date = {}
     for f in all_files:
-        match = date_pattern.search(os.path.basename(f))
-        if match:
-            files_by_date.setdefault(match.group(1), []).append(f)
+        prefix, granule = split_output_name(f)
+        date = catalog_dates.get(granule)
+        if date is None:
+            match = date_pattern.search(granule)
+            date  = match.group(1) if match else None
+        if date and (dates is None or date in dates):
+            files_by_date.setdefault((prefix, date), []).append(f)
 
-    print(f"Found {len(all_files)} files covering {len(files_by_date)} unique dates\n")
+    n_dates = len({date for _, date in files_by_date})
+    print(f"Found {len(all_files)} files covering {n_dates} unique dates\n")
 
     mosaic_count = 0
-    for date, files in sorted(files_by_date.items()):
-        print(f" Processing {date} ({len(files)} file(s))...")
-
-        merged_array, merged_transform, meta = merge_and_average(files)
-
-        meta.update({
-            "height":    merged_array.shape[0],
-            "width":     merged_array.shape[1],
-            "transform": merged_transform,
-            "dtype":     'float32',
-            "count":     1,
-            "nodata":    NODATA_VALUE
-        })
-
-        out_path = os.path.join(output_folder, f"TSM_daily_{date}.tif")
-        with rasterio.open(out_path, "w", **meta) as dst:
-            dst.write(merged_array, 1)
+    for (prefix, date), files in sorted(files_by_date.items()):
+        print(f" Processing {prefix} {date} ({len(files)} file(s))...")
+
+        total, count, merged_transform, meta = merge_sum_count(files)
+        with rasterio.open(files[0]) as src:
+            tags = src.tags(1)
+        tags['N_PASSES'] = str(len(files))
+
+        # Averaged in physical units, stored in the encoding of the inputs
+        encoding = tags.get('OUTPUT_ENCODING', 'float32')
+        merged   = np.where(count > 0, total / np.maximum(count, 1), np.nan)
+        merged_array, nodata, tags, scale_offset = encoded_raster(merged, encoding, tags)
+        out_path = os.path.join(output_folder, f"{prefix}_daily_{date}.tif")
+        write_raster(out_path, merged_array, merged_transform, meta['crs'], nodata,
+                     output_profile=output_profile, tags=tags, scale_offset=scale_offset)
 
         mosaic_count += 1
-        print(f"   Saved: TSM_daily_{date}.tif")
+        print(f"   Saved: {prefix}_daily_{date}.tif")
+
+        # Coarser levels from the same sum/count grids, no re-reading
+        for factor in pyramid_factors:
+            coarse_total, coarse_count = aggregate_blocks(total, count, factor)
+            coarse = np.where(coarse_count > 0, coarse_total / np.maximum(coarse_count, 1), np.nan)
+            coarse, nodata, coarse_tags, scale_offset = encoded_raster(
+                coarse, encoding, {**tags, 'AGGREGATION_FACTOR': str(factor)})
+            coarse_path = os.path.join(output_folder, f"x{factor}", f"{prefix}_daily_{date}.tif")
+            write_raster(coarse_path, coarse, merged_transform * Affine.scale(factor), meta['crs'],
+                         nodata, output_profile=output_profile, tags=coarse_tags,
+                         scale_offset=scale_offset)
+        if pyramid_factors:
+            print(f"   Saved pyramid levels: {', '.join(f'x{f}' for f in pyramid_factors)}")
 
     print(f"\n{'='*60}")
     print(f"STEP 6 COMPLETE: Created {mosaic_count} daily mosaics")
@@ -734,6 +2288,1481 @@ def run_step6(clipped_dir, flag_list, masking_strategy):
     print("="*60)
 
 
+# ==============================================================================
+# PER-GRANULE PIPELINE (Steps 3–5 for one product folder)
+# ==============================================================================
+
+def process_product_folder(subfolder, base_dir, flag_list, roi_shape, products=DEFAULT_PRODUCTS,
+                           roi_bounds=None, cache_dir=None, output_profile=DEFAULT_OUTPUT_PROFILE,
+                           gridding=DEFAULT_GRIDDING, gap_fill=0, output_encoding='float32'):
+    """
+    Runs Steps 3–5 for a single product folder, writing into the usual
+    tsm_masked/, geotiff/ and geotiff_clipped/ directories under base_dir.
+
+    Returns (status, clipped): status is 'ok' (clipped lists the clipped
+    GeoTIFFs), 'no_overlap' (nothing to write), 'missing' (required netCDFs
+    absent) or 'error' (a step failed); clipped is empty unless 'ok'. Only
+    'ok' and 'no_overlap' granules are safe to reclaim.
+    """
+    subfolder   = Path(subfolder)
+    masked_dir  = base_dir / "tsm_masked"
+    output_dir  = base_dir / "geotiff"
+    clipped_dir = base_dir / "geotiff_clipped"
+    for directory in (masked_dir, output_dir, clipped_dir):
+        directory.mkdir(exist_ok=True)
+
+    status, masked_path, stats = mask_granule(subfolder, masked_dir, flag_list, products=products,
+                                              roi_bounds=roi_bounds, cache_dir=cache_dir,
+                                              output_encoding=output_encoding)
+    if status != 'ok':
+        return status, []
+
+    try:
+        geotiffs = create_geotiff_from_masked_swath(masked_path, subfolder / "geo_coordinates.nc",
+                                                    output_dir, cache_dir=cache_dir,
+                                                    output_profile=output_profile,
+                                                    gridding=gridding, gap_fill=gap_fill,
+                                                    output_encoding=output_encoding)
+    except Exception as e:
+        print(f"  ✗ Error creating GeoTIFF: {e}")
+        traceback.print_exc(file=sys.stdout)
+        return 'error', []
+
+    clipped = []
+    for geotiff_file in geotiffs:
+        clipped_path = clipped_dir / geotiff_file.name
+        if not clip_geotiff_with_shapefile(geotiff_file, roi_shape, clipped_path,
+                                           output_profile=output_profile):
+            return 'error', []
+        clipped.append(clipped_path)
+    return 'ok', clipped
+
+
+# ==============================================================================
+# IN-MEMORY LIBRARY API
+# ==============================================================================
+#
+# Importable counterparts of Steps 3–6 that work on xarray objects and only
+# touch disk when an output_path is given:
+#
+#     import meris_process_local as mp
+#     grid   = mp.grid_from_bounds(mp.get_roi_bounds("roi.shp"), 0.0027)
+#     passes = [mp.process_granule(d, 'recommended', grid) for d in product_dirs]
+#     daily  = mp.mosaic(passes, output_path="TSM_daily.tif")
+#
+# Passing the same grid to every process_granule() call puts all passes on
+# one raster, so mosaic() reduces to a per-pixel mean.
+# ==============================================================================
+
+def grid_from_bounds(bounds, res_deg=0.0027):
+    """Target grid dict covering (lon_min, lat_min, lon_max, lat_max) at res_deg."""
+    lon_min, lat_min, lon_max, lat_max = (float(v) for v in bounds)
+    cols = max(int(np.ceil((lon_max - lon_min) / res_deg)), 1)
+    rows = max(int(np.ceil((lat_max - lat_min) / res_deg)), 1)
+    return {'lon_min': lon_min, 'lat_min': lat_min,
+            'lon_max': lon_min + cols * res_deg, 'lat_max': lat_min + rows * res_deg,
+            'cols': cols, 'rows': rows}
+
+
+def process_granule(product_dir, flags='recommended', grid=None, product='TSM_NN',
+                    roi_bounds=None, res_deg=0.0027, cache_dir=None, output_path=None,
+                    output_profile=DEFAULT_OUTPUT_PROFILE, gridding=DEFAULT_GRIDDING, gap_fill=0,
+                    output_encoding='float32'):
+    """
+    Steps 3–4 for one product folder, in memory: masks `product` with
+    `flags` (a masking strategy name or a list of flag names) and resamples
+    it onto `grid` (a dict from grid_from_bounds(), or None for the swath's
+    own bounding grid at res_deg).
+
+    Only the swath window overlapping roi_bounds (or the grid, if given) is
+    read. Returns a DataArray (NaN = no data), or None when the granule does
+    not overlap or has no valid pixels. Writes a GeoTIFF only if output_path
+    is given.
+    """
+    product_dir = Path(product_dir)
+    flag_list   = get_flag_list(flags) if isinstance(flags, str) else list(flags)
+
+    if roi_bounds is None and grid is not None:
+        roi_bounds = (grid['lon_min'], grid['lat_min'], grid['lon_max'], grid['lat_max'])
+    window = None
+    if roi_bounds is not None:
+        window = find_roi_window(product_dir, roi_bounds)
+        if window is None:
+            return None
+
+    masked_ds, _ = mask_products({product: product_dir / PRODUCTS[product]['file']},
+                                 product_dir / "common_flags.nc", product_dir / "wqsf.nc",
+                                 flag_list, window=window, cache_dir=cache_dir)
+    gridded = grid_masked_products(masked_ds, product_dir / "geo_coordinates.nc",
+                                   res_deg=res_deg, cache_dir=cache_dir, grid=grid,
+                                   gridding=gridding, gap_fill=gap_fill)
+    masked_ds.close()
+
+    da = gridded.get(product)
+    if da is None:
+        return None
+    da.attrs['granule'] = product_dir.name
+    if output_path is not None:
+        save_dataarray(da, output_path, output_profile=output_profile, output_encoding=output_encoding)
+    return da
+
+
+def mosaic(arrays, output_path=None, output_profile=DEFAULT_OUTPUT_PROFILE, output_encoding='float32'):
+    """
+    In-memory Step 6: averages DataArrays from process_granule() (None
+    entries are ignored) onto the union of their grids, at the resolution
+    of the first. Returns the mosaic DataArray with an n_passes attribute,
+    or None if there is nothing to merge. Writes a GeoTIFF only if
+    output_path is given.
+    """
+    arrays = [da for da in arrays if da is not None]
+    if not arrays:
+        return None
+
+    pixel_size_x, pixel_size_y = (float(v) for v in arrays[0].attrs['res'])
+    sources, lefts, tops, rights, bottoms = [], [], [], [], []
+    for da in arrays:
+        transform = dataarray_transform(da)
+        rows, cols = da.shape
+        sources.append((da.values.astype(np.float32), transform))
+        lefts.append(transform.c)
+        tops.append(transform.f)
+        rights.append(transform.c + cols * transform.a)
+        bottoms.append(transform.f + rows * transform.e)
+
+    cols = max(int(round((max(rights) - min(lefts)) / pixel_size_x)), 1)
+    rows = max(int(round((max(tops) - min(bottoms)) / pixel_size_y)), 1)
+    grid = {'lon_min': min(lefts), 'lat_max': max(tops),
+            'lon_max': min(lefts) + cols * pixel_size_x, 'lat_min': max(tops) - rows * pixel_size_y,
+            'cols': cols, 'rows': rows}
+
+    result = grid_dataarray(np.empty((rows, cols), dtype=np.float32), grid)
+    crs    = arrays[0].attrs.get('crs', 'EPSG:4326')
+    result.values[:] = average_onto_grid(sources, dataarray_transform(result), (rows, cols), crs)
+
+    attrs = {key: value for key, value in arrays[0].attrs.items() if key not in ('granule', 'res')}
+    result.attrs.update(attrs, n_passes=len(arrays))
+    result = result.rename(arrays[0].name)
+    if output_path is not None:
+        save_dataarray(result, output_path, output_profile=output_profile,
+                       output_encoding=output_encoding)
+    return result
+
+
+# ==============================================================================
+# ROLLING MODE: BOUNDED-DISK PROCESSING
+# ==============================================================================
+#
+# Instead of extracting every archive up front (Step 1) and keeping all
+# intermediates until Step 6, rolling mode takes one granule at a time:
+#   extract (only FILES_TO_KEEP members) -> Steps 3–5 -> reclaim
+# where "reclaim" deletes (or moves to --archive-dir) the raw product
+# folder, its masked netCDF, its unclipped GeoTIFFs and its cache entries
+# as soon as its clipped outputs have been written. An archive is only
+# extracted while the workflow data under base_dir (everything except
+# not-yet-extracted archives) plus the archive's extracted size stays
+# within --disk-budget-gb and the filesystem has room for it; otherwise
+# the run waits for space (e.g. freed by a parallel job) up to a timeout.
+# Step 6 runs once at the end over all clipped outputs.
+# ==============================================================================
+
+DISK_POLL_INTERVAL_S = 60
+
+
+def directory_size(path, exclude_suffixes=()):
+    """Total size in bytes of the files below path (skipping the given suffixes)."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            if name.lower().endswith(exclude_suffixes):
+                continue
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def archive_extracted_size(zip_path):
+    """Uncompressed size of the FILES_TO_KEEP members of a product archive."""
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        return sum(info.file_size for info in zip_ref.infolist()
+                   if Path(info.filename).name in FILES_TO_KEEP)
+
+
+def wait_for_disk_space(base_dir, needed_bytes, disk_budget_bytes=None, timeout_s=3600):
+    """
+    Blocks until needed_bytes fit both the disk budget and the free space of
+    the filesystem holding base_dir. Returns False if the timeout expires.
+    """
+    deadline = time.time() + timeout_s
+    while True:
+        used = directory_size(base_dir, exclude_suffixes=(".zip",))
+        free = shutil.disk_usage(base_dir).free
+        within_budget = disk_budget_bytes is None or used + needed_bytes <= disk_budget_bytes
+        if within_budget and needed_bytes <= free:
+            return True
+        if time.time() >= deadline:
+            print(f"   ✗ Not enough space: need {needed_bytes / 1e9:.2f} GB, "
+                  f"using {used / 1e9:.2f} GB, {free / 1e9:.2f} GB free")
+            return False
+        print(f"   … waiting for disk space (need {needed_bytes / 1e9:.2f} GB, "
+              f"using {used / 1e9:.2f} GB)")
+        time.sleep(DISK_POLL_INTERVAL_S)
+
+
+def extract_product_archive(zip_path, base_dir, safe_folder_suffix):
+    """
+    Extracts only the FILES_TO_KEEP members of one product archive (so Step 2
+    is implicit) and deletes the archive. Returns the product folder path,
+    or None if the archive is invalid or contains no product folder.
+    """
+    try:
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            members = [info for info in zip_ref.infolist()
+                       if not info.is_dir() and Path(info.filename).name in FILES_TO_KEEP]
+            folders = {Path(info.filename).parts[0] for info in members
+                       if Path(info.filename).parts[0].endswith(safe_folder_suffix)}
+            if len(folders) != 1:
+                print(f"  ✗ {zip_path.name}: expected one *{safe_folder_suffix} folder, found {len(folders)}")
+                return None
+            zip_ref.extractall(base_dir, members=members)
+        os.remove(zip_path)
+        print(f"  Unzipped and deleted: {zip_path.name}")
+        return base_dir / folders.pop()
+    except zipfile.BadZipFile:
+        print(f"  Skipping invalid zip file: {zip_path.name}")
+        return None
+
+
+def reclaim_granule(subfolder, base_dir, cache_dir=None, archive_dir=None):
+    """
+    Removes a finished granule's raw folder and intermediates. The raw folder
+    is moved to archive_dir instead of deleted when one is given.
+    Returns the number of bytes freed under base_dir.
+    """
+    subfolder = Path(subfolder)
+    granule   = subfolder.name
+    freed     = 0
+
+    intermediates = [base_dir / "tsm_masked" / f"{granule}_tsm_masked.nc"]
+    intermediates += list((base_dir / "geotiff").glob(f"*_{granule}.tif"))
+    if cache_dir is not None:
+        intermediates += list(Path(cache_dir).glob(f"{granule}_*.npz"))
+    for path in intermediates:
+        if path.exists():
+            freed += path.stat().st_size
+            path.unlink()
+
+    if subfolder.exists():
+        freed += directory_size(subfolder)
+        if archive_dir is not None:
+            Path(archive_dir).mkdir(parents=True, exist_ok=True)
+            shutil.move(str(subfolder), str(Path(archive_dir) / granule))
+        else:
+            shutil.rmtree(subfolder)
+    return freed
+
+
+def date_in_range(name, start_date=None, end_date=None):
+    """Checks the first 8-digit date in a file/folder name against [start_date, end_date]."""
+    match = re.search(r"(\d{8})", name)
+    if match is None:
+        return True
+    date = match.group(1)
+    return (start_date is None or date >= start_date) and (end_date is None or date <= end_date)
+
+
+def run_rolling(base_dir, safe_folder_suffix, masking_strategy, roi_shape,
+                products=DEFAULT_PRODUCTS, roi_bounds=None, catalog_path=None, cache_dir=None,
+                output_profile=DEFAULT_OUTPUT_PROFILE, start_date=None, end_date=None,
+                disk_budget_bytes=None, archive_dir=None, wait_timeout_s=3600,
+                gridding=DEFAULT_GRIDDING, gap_fill=0, pyramid_factors=(), output_encoding='float32'):
+    print("\n" + "="*60)
+    print("ROLLING MODE: STEPS 1–5 PER GRANULE WITHIN A DISK BUDGET")
+    print("="*60)
+
+    if not os.path.exists(roi_shape):
+        raise FileNotFoundError(f"Shapefile not found at {roi_shape} — rolling mode needs it "
+                                f"to commit clipped outputs before reclaiming raw data")
+
+    flag_list = get_flag_list(masking_strategy)
+    budget    = f"{disk_budget_bytes / 1e9:.1f} GB" if disk_budget_bytes else "free space only"
+    print(f"Masking strategy: {masking_strategy}")
+    print(f"Disk budget:      {budget}")
+    print(f"Raw data:         {'moved to ' + str(archive_dir) if archive_dir else 'deleted'} after each granule\n")
+
+    # Already-extracted folders occupy space, so they go first
+    folders  = sorted(p for p in base_dir.iterdir()
+                      if p.is_dir() and p.name.endswith(safe_folder_suffix))
+    archives = sorted(p for p in base_dir.iterdir()
+                      if p.is_file() and p.name.lower().endswith(".zip"))
+
+    n_done = n_failed = 0
+    freed  = 0
+    for item in folders + archives:
+        if not date_in_range(item.name, start_date, end_date):
+            continue
+
+        if item.is_file():
+            print(f"\n📦 {item.name}")
+            if not wait_for_disk_space(base_dir, archive_extracted_size(item),
+                                       disk_budget_bytes, wait_timeout_s):
+                print("   Stopping rolling run — disk budget exhausted")
+                break
+            subfolder = extract_product_archive(item, base_dir, safe_folder_suffix)
+            if subfolder is None:
+                continue
+        else:
+            subfolder = item
+            print(f"\n📂 {subfolder.name}")
+
+        status, clipped = None, []
+        if catalog_path is not None:
+            update_granule_catalog(catalog_path, base_dir, safe_folder_suffix, folders=[subfolder])
+            if not query_granule_catalog(catalog_path, start_date=start_date, end_date=end_date,
+                                         granule=subfolder.name):
+                print(f"   ⏩ Outside date range — keeping {subfolder.name}")
+                continue
+            if not query_granule_catalog(catalog_path, roi_bounds=roi_bounds, granule=subfolder.name):
+                status = 'no_overlap'
+        if status is None:
+            status, clipped = process_product_folder(subfolder, base_dir, flag_list, roi_shape,
+                                                     products=products, roi_bounds=roi_bounds,
+                                                     cache_dir=cache_dir, output_profile=output_profile,
+                                                     gridding=gridding, gap_fill=gap_fill,
+                                                     output_encoding=output_encoding)
+        # Raw data is only reclaimed once its outputs are committed (or it has none)
+        if status not in ('ok', 'no_overlap'):
+            n_failed += 1
+            print(f"   ✗ Failed ({status}) — keeping {subfolder.name} and its intermediates for inspection")
+            continue
+
+        freed  += reclaim_granule(subfolder, base_dir, cache_dir=cache_dir, archive_dir=archive_dir)
+        n_done += 1
+        print(f"   ✓ Committed {len(clipped)} clipped file(s), reclaimed raw data and intermediates")
+
+    print(f"\n{'='*60}")
+    print(f"ROLLING STEPS 1–5 COMPLETE: {n_done} granules done, {n_failed} failed, "
+          f"{freed / 1e9:.2f} GB reclaimed")
+    print(f"{'='*60}\n")
+
+    run_step6(base_dir / "geotiff_clipped", flag_list, masking_strategy,
+              catalog_path=catalog_path, output_profile=output_profile,
+              pyramid_factors=pyramid_factors)
+
+
+# ==============================================================================
+# DAEMON MODE: WATCH-FOLDER INCREMENTAL PROCESSING
+# ==============================================================================
+#
+# A long-running loop for low-latency updates while downloads arrive:
+#   - watches --watch-dir (default: the base directory) and its immediate
+#     subfolders, e.g. the downloader's batch folders, for .zip/.ZIP
+#     archives; folders starting with '_' or '.' (such as the download
+#     store) and product folders are ignored
+#   - uses inotify when the optional inotify_simple package is installed,
+#     otherwise polls the folders every --poll-interval seconds; either way
+#     only directory listings are read, never the archive contents
+#   - an archive is ready once its size and mtime have been stable for
+#     DAEMON_SETTLE_S and it reads as a complete zip file
+#   - each ready archive goes through Steps 1–5 as in rolling mode (the
+#     archive is deleted once extracted) and is added to the catalog
+#   - once the ready archives are done, Step 6 rebuilds only the daily
+#     mosaics (and pyramid levels) of the dates they touched
+# Stop with Ctrl-C / SIGINT. Failed granules are remembered by granule ID
+# (the archive name without .zip, i.e. the product folder name), so a failed
+# archive left on disk, or delivered again, is not retried until the daemon
+# is restarted; dates whose mosaic refresh failed are reported for a
+# later --steps 6 run.
+# ==============================================================================
+
+DAEMON_POLL_INTERVAL_S = 30
+DAEMON_SETTLE_S        = 10
+INOTIFY_AVAILABLE      = importlib.util.find_spec("inotify_simple") is not None
+
+
+def watched_directories(watch_dir, safe_folder_suffix):
+    """watch_dir and its subfolders that may receive archives."""
+    watch_dir = Path(watch_dir)
+    return [watch_dir] + sorted(
+        p for p in watch_dir.iterdir()
+        if p.is_dir() and not p.name.startswith(('_', '.')) and not p.name.endswith(safe_folder_suffix)
+    )
+
+
+def find_archives(directories):
+    """.zip/.ZIP files directly inside the given directories."""
+    archives = []
+    for directory in directories:
+        try:
+            with os.scandir(directory) as entries:
+                archives += [Path(entry.path) for entry in entries
+                             if entry.is_file() and entry.name.lower().endswith(".zip")]
+        except FileNotFoundError:
+            continue
+    return sorted(archives)
+
+
+def settled_archives(archives, seen, settle_s=DAEMON_SETTLE_S):
+    """
+    Archives whose (size, mtime) has not changed for settle_s seconds and
+    that read as complete zip files. seen maps path -> ((size, mtime),
+    first seen) and is updated in place.
+    """
+    now, ready = time.time(), []
+    for path in archives:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            seen.pop(path, None)
+            continue
+        signature = (stat.st_size, stat.st_mtime)
+        previous  = seen.get(path)
+        if previous is None or previous[0] != signature:
+            seen[path] = (signature, now)
+        elif now - previous[1] >= settle_s and zipfile.is_zipfile(path):
+            ready.append(path)
+    return ready
+
+
+def granule_date(subfolder, catalog_path=None):
+    """Acquisition date of a product folder from the catalog, else from its name."""
+    if catalog_path is not None:
+        rows = query_granule_catalog(catalog_path, granule=Path(subfolder).name)
+        if rows and rows[0]['acquisition_date']:
+            return rows[0]['acquisition_date']
+    match = re.search(r"(\d{8})", Path(subfolder).name)
+    return match.group(1) if match else None
+
+
+def run_daemon(base_dir, safe_folder_suffix, masking_strategy, roi_shape, watch_dir=None,
+               products=DEFAULT_PRODUCTS, roi_bounds=None, catalog_path=None, cache_dir=None,
+               output_profile=DEFAULT_OUTPUT_PROFILE, start_date=None, end_date=None,
+               gridding=DEFAULT_GRIDDING, gap_fill=0, pyramid_factors=(), output_encoding='float32',
+               poll_interval_s=DAEMON_POLL_INTERVAL_S):
+    """Processes archives as they land in watch_dir (see DAEMON MODE) until interrupted."""
+    watch_dir = Path(watch_dir) if watch_dir else Path(base_dir)
+    flag_list = get_flag_list(masking_strategy)
+
+    print("\n" + "="*60)
+    print("DAEMON MODE: PROCESSING NEW ARCHIVES AS THEY ARRIVE")
+    print("="*60)
+    if not os.path.exists(roi_shape):
+        raise FileNotFoundError(f"Shapefile not found at {roi_shape} — daemon mode needs it for Step 5")
+
+    inotify, watches = None, {}
+    if INOTIFY_AVAILABLE:
+        from inotify_simple import INotify, flags as inotify_flags
+
+        inotify    = INotify()
+        watch_mask = (inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO |
+                      inotify_flags.CREATE | inotify_flags.DELETE_SELF)
+    print(f"Watching:     {watch_dir} ({'inotify' if inotify else f'polling every {poll_interval_s} s'})")
+    print(f"Output:       {base_dir / 'geotiff_clipped' / 'daily_mosaics'}")
+    print("Stop with Ctrl-C\n")
+
+    seen, failed, failed_dates = {}, set(), set()   # failed: granule IDs
+    n_done = n_refreshed = 0
+    try:
+        while True:
+            directories = watched_directories(watch_dir, safe_folder_suffix)
+            if inotify is not None:
+                for directory in directories:
+                    if directory not in watches:
+                        watches[directory] = inotify.add_watch(directory, watch_mask)
+
+            # Out-of-range archives are never tracked, so they are not re-checked each cycle
+            archives = [path for path in find_archives(directories)
+                        if granule_id(path.name) not in failed
+                        and date_in_range(path.name, start_date, end_date)]
+            ready    = settled_archives(archives, seen)
+
+            dates = set()
+            for archive in ready:
+                print(f"\n📦 {archive.name} ({datetime.now():%Y-%m-%d %H:%M:%S})")
+                seen.pop(archive, None)
+                try:
+                    subfolder = extract_product_archive(archive, base_dir, safe_folder_suffix)
+                    if subfolder is None:
+                        failed.add(granule_id(archive.name))
+                        continue
+
+                    selected = True
+                    if catalog_path is not None:
+                        update_granule_catalog(catalog_path, base_dir, safe_folder_suffix, folders=[subfolder])
+                        selected = bool(query_granule_catalog(catalog_path, roi_bounds=roi_bounds,
+                                                              start_date=start_date, end_date=end_date,
+                                                              granule=subfolder.name))
+                    if not selected:
+                        print("   ⏩ Outside ROI or date range — skipping")
+                        continue
+
+                    status, clipped = process_product_folder(subfolder, base_dir, flag_list, roi_shape,
+                                                             products=products, roi_bounds=roi_bounds,
+                                                             cache_dir=cache_dir, output_profile=output_profile,
+                                                             gridding=gridding, gap_fill=gap_fill,
+                                                             output_encoding=output_encoding)
+                    if status not in ('ok', 'no_overlap'):
+                        failed.add(subfolder.name)
+                        print(f"   ✗ Failed ({status}) — keeping {subfolder.name} and its intermediates for inspection")
+                        continue
+                except Exception as e:
+                    failed.add(granule_id(archive.name))
+                    print(f"   ✗ Failed: {e}")
+                    continue
+                n_done += 1
+                if clipped:
+                    dates.add(granule_date(subfolder, catalog_path))
+                print(f"   ✓ {len(clipped)} clipped file(s)")
+
+            dates.discard(None)
+            if dates:
+                try:
+                    run_step6(base_dir / "geotiff_clipped", flag_list, masking_strategy,
+                              catalog_path=catalog_path, output_profile=output_profile,
+                              pyramid_factors=pyramid_factors, dates=dates)
+                    n_refreshed += len(dates)
+                    failed_dates -= dates
+                except Exception as e:
+                    failed_dates |= dates
+                    print(f"   ✗ Step 6 refresh failed for {', '.join(sorted(dates))}: {e}")
+
+            # Unsettled archives are re-checked after the settle time
+            timeout_s = DAEMON_SETTLE_S if seen else poll_interval_s
+            if inotify is not None:
+                for event in inotify.read(timeout=int(timeout_s * 1000)):
+                    if event.mask & inotify_flags.IGNORED:
+                        watches = {d: wd for d, wd in watches.items() if wd != event.wd}
+            else:
+                time.sleep(timeout_s)
+    except KeyboardInterrupt:
+        print("\nDaemon interrupted")
+
+    print(f"\n{'='*60}")
+    print(f"DAEMON STOPPED: {n_done} granule(s) processed, {len(failed)} failed, "
+          f"{n_refreshed} daily mosaic date(s) refreshed")
+    if failed_dates:
+        print(f"Mosaic refresh failed for {', '.join(sorted(failed_dates))} — rerun with --steps 6")
+    print(f"{'='*60}\n")
+
+
+# ==============================================================================
+# DISTRIBUTED MODE: SHARED-FILESYSTEM WORK QUEUE
+# ==============================================================================
+#
+# Several worker processes, on one or many nodes sharing the data directory
+# (e.g. /nobackup), pull granules from a lock-free queue of small task files:
+#
+#   <queue-dir>/pending/<item>                 waiting (file holds the item path)
+#   <queue-dir>/claimed/<item>@<host>-<pid>    being processed by that worker
+#   <queue-dir>/done/<item>.json               catalog record + clipped outputs
+#   <queue-dir>/failed/<item>                  traceback / reason
+#
+# Tasks are named by granule ID (X.SEN3 for both X.SEN3.ZIP and the extracted
+# X.SEN3 folder), so a granule is queued once. A claim is an atomic
+# os.rename() from pending/ to claimed/, so exactly one worker wins each task.
+# Workers write a heartbeat timestamp into their claim file every
+# HEARTBEAT_INTERVAL_S; any worker renames claims whose heartbeat is older
+# than STALE_CLAIM_S back to pending/, so tasks held by dead nodes are picked
+# up again. Heartbeats come from the workers' own clocks, not from file mtimes
+# set by the file server, so they only need the nodes' clocks to agree.
+# Workers never write the SQLite catalog (SQLite locking is unreliable on
+# network filesystems); the reducer ingests the done/*.json records into
+# the catalog and then runs Step 6.
+#
+# Local test with four workers on one directory:
+#   python meris_process_local.py --mode enqueue --base-directory DATA
+#   for i in 1 2 3 4; do python meris_process_local.py --mode worker --base-directory DATA & done; wait
+#   python meris_process_local.py --mode reduce --base-directory DATA
+# ==============================================================================
+
+DEFAULT_QUEUE_DIR_NAME = "work_queue"
+QUEUE_STATES           = ("pending", "claimed", "done", "failed")
+HEARTBEAT_INTERVAL_S   = 60
+STALE_CLAIM_S          = 15 * 60
+QUEUE_POLL_INTERVAL_S  = 30
+
+
+def init_queue(queue_dir):
+    for state in QUEUE_STATES:
+        (Path(queue_dir) / state).mkdir(parents=True, exist_ok=True)
+
+
+def granule_id(name):
+    """Granule ID of a product archive or folder name: X.SEN3 for X.SEN3.ZIP and X.SEN3."""
+    return name[:-len(".zip")] if name.lower().endswith(".zip") else name
+
+
+def queue_item_name(path):
+    """Task name of a queue file in any state (strips the claim owner / .json suffix)."""
+    name = Path(path).name
+    if Path(path).parent.name == "claimed":
+        name = name.rsplit("@", 1)[0]
+    elif Path(path).parent.name == "done" and name.endswith(".json"):
+        name = name[:-len(".json")]
+    return name
+
+
+def read_claim(claim_path):
+    """Returns (item path, heartbeat timestamp or None) stored in a claim file."""
+    lines = Path(claim_path).read_text().splitlines()
+    try:
+        heartbeat = float(lines[1])
+    except (IndexError, ValueError):
+        heartbeat = None
+    return (lines[0].strip() if lines else ""), heartbeat
+
+
+def write_heartbeat(claim_path, item_path):
+    """Rewrites the claim file in place with the current time; raises FileNotFoundError once it is gone."""
+    with open(claim_path, 'r+') as f:
+        f.write(f"{item_path}\n{time.time():.0f}\n")
+        f.truncate()
+
+
+def enqueue_granules(queue_dir, base_dir, safe_folder_suffix, start_date=None, end_date=None):
+    """
+    Adds one pending task per granule in base_dir (product archive or
+    extracted product folder, the folder winning when both exist) that is
+    not already in the queue (in any state). Returns the number of tasks added.
+    """
+    init_queue(queue_dir)
+    known = {granule_id(queue_item_name(path)) for state in QUEUE_STATES
+             for path in (Path(queue_dir) / state).iterdir()}
+
+    items = {}
+    for item in sorted(Path(base_dir).iterdir()):
+        is_archive = item.is_file() and item.name.lower().endswith(".zip")
+        is_folder  = item.is_dir() and item.name.endswith(safe_folder_suffix)
+        if (is_archive or is_folder) and (is_folder or granule_id(item.name) not in items):
+            items[granule_id(item.name)] = item
+
+    n_added = 0
+    for name, item in sorted(items.items()):
+        if name in known or not date_in_range(name, start_date, end_date):
+            continue
+        tmp_path = Path(queue_dir) / f".{name}.tmp"
+        tmp_path.write_text(str(item.resolve()))
+        os.rename(tmp_path, Path(queue_dir) / "pending" / name)
+        n_added += 1
+    return n_added
+
+
+def claim_next_task(queue_dir, worker_id):
+    """
+    Atomically claims one pending task; returns its claim path or None if
+    none is left. The heartbeat is written before the rename, so the claim
+    is never visible in claimed/ without a fresh one (a reclaimed task still
+    carries the stale heartbeat of its dead worker).
+    """
+    for pending in sorted((Path(queue_dir) / "pending").iterdir()):
+        claim_path = Path(queue_dir) / "claimed" / f"{pending.name}@{worker_id}"
+        try:
+            item_path = read_claim(pending)[0]
+            if not item_path:
+                continue
+            write_heartbeat(pending, item_path)
+            os.rename(pending, claim_path)
+        except OSError:
+            continue   # another worker won this one
+        return claim_path
+    return None
+
+
+def reclaim_stale_claims(queue_dir, stale_after_s=STALE_CLAIM_S):
+    """
+    Moves claims whose heartbeat stopped back to pending/. Claims without a
+    heartbeat line (written by an older version, which touched the file
+    instead) fall back to the file mtime. Returns how many were reclaimed.
+    """
+    n_reclaimed = 0
+    now = time.time()
+    for claim_path in (Path(queue_dir) / "claimed").iterdir():
+        try:
+            heartbeat = read_claim(claim_path)[1]
+            if heartbeat is None:
+                heartbeat = claim_path.stat().st_mtime
+            if now - heartbeat < stale_after_s:
+                continue
+            os.rename(claim_path, Path(queue_dir) / "pending" / queue_item_name(claim_path))
+            n_reclaimed += 1
+            print(f"  ↺ Reclaimed stale task: {claim_path.name}")
+        except FileNotFoundError:
+            continue   # finished or reclaimed by someone else meanwhile
+    return n_reclaimed
+
+
+def start_heartbeat(claim_path, interval_s=HEARTBEAT_INTERVAL_S):
+    """Refreshes claim_path's heartbeat every interval_s in a daemon thread; set the returned Event to stop."""
+    stop      = threading.Event()
+    item_path = read_claim(claim_path)[0]
+
+    def beat():
+        while not stop.wait(interval_s):
+            try:
+                write_heartbeat(claim_path, item_path)
+            except FileNotFoundError:
+                return
+
+    threading.Thread(target=beat, daemon=True).start()
+    return stop
+
+
+def process_queue_task(item_path, base_dir, safe_folder_suffix, flag_list, roi_shape,
+                       products=DEFAULT_PRODUCTS, roi_bounds=None, cache_dir=None,
+                       output_profile=DEFAULT_OUTPUT_PROFILE, disk_budget_bytes=None,
+                       archive_dir=None, wait_timeout_s=3600, gridding=DEFAULT_GRIDDING, gap_fill=0,
+                       output_encoding='float32'):
+    """
+    Steps 1–5 for one queued archive or product folder. Returns the done
+    record (catalog record + clipped outputs), or raises on failure. With a
+    disk budget the granule is processed in rolling fashion (see run_rolling()).
+    """
+    item_path = Path(item_path)
+    if not item_path.exists() and (base_dir / item_path.stem).is_dir():
+        # Reclaimed task whose archive a dead worker had already extracted
+        item_path = base_dir / item_path.stem
+    if item_path.is_file():
+        if disk_budget_bytes is not None and not wait_for_disk_space(
+                base_dir, archive_extracted_size(item_path), disk_budget_bytes, wait_timeout_s):
+            raise RuntimeError("disk budget exhausted")
+        subfolder = extract_product_archive(item_path, base_dir, safe_folder_suffix)
+        if subfolder is None:
+            raise RuntimeError(f"could not extract {item_path.name}")
+    else:
+        subfolder = item_path
+
+    record = describe_granule(subfolder)
+    status, clipped = process_product_folder(subfolder, base_dir, flag_list, roi_shape,
+                                             products=products, roi_bounds=roi_bounds,
+                                             cache_dir=cache_dir, output_profile=output_profile,
+                                             gridding=gridding, gap_fill=gap_fill,
+                                             output_encoding=output_encoding)
+    if status not in ('ok', 'no_overlap'):
+        raise RuntimeError(f"Steps 3–5 failed: {status} (see log above)")
+    if disk_budget_bytes is not None:
+        reclaim_granule(subfolder, base_dir, cache_dir=cache_dir, archive_dir=archive_dir)
+
+    return {'catalog': record, 'clipped': [str(path) for path in clipped]}
+
+
+def run_worker(queue_dir, base_dir, safe_folder_suffix, masking_strategy, roi_shape, **task_kwargs):
+    """
+    Claims and processes queued granules until the queue is drained (no
+    pending and no claimed tasks left), reclaiming stale claims on the way.
+    """
+    init_queue(queue_dir)
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    flag_list = get_flag_list(masking_strategy)
+
+    print("\n" + "="*60)
+    print(f"WORKER {worker_id}: PROCESSING QUEUED GRANULES (STEPS 1–5)")
+    print("="*60)
+    print(f"Queue: {queue_dir}\n")
+
+    n_done = n_failed = 0
+    while True:
+        reclaim_stale_claims(queue_dir)
+        claim_path = claim_next_task(queue_dir, worker_id)
+        if claim_path is None:
+            if not any((Path(queue_dir) / "claimed").iterdir()):
+                break
+            # Other workers still busy: wait in case their claims go stale
+            time.sleep(QUEUE_POLL_INTERVAL_S)
+            continue
+
+        name = queue_item_name(claim_path)
+        print(f"\n▶ Claimed: {name}")
+        heartbeat = start_heartbeat(claim_path)
+        try:
+            result = process_queue_task(read_claim(claim_path)[0], base_dir, safe_folder_suffix,
+                                        flag_list, roi_shape, **task_kwargs)
+            result['worker'] = worker_id
+            done_tmp = Path(queue_dir) / "done" / f".{name}.json.tmp"
+            done_tmp.write_text(json.dumps(result, indent=1))
+            os.rename(done_tmp, Path(queue_dir) / "done" / f"{name}.json")
+            claim_path.unlink(missing_ok=True)
+            n_done += 1
+            print(f"   ✓ Done: {name}")
+        except Exception as e:
+            (Path(queue_dir) / "failed" / name).write_text(f"{worker_id}: {e}\n{traceback.format_exc()}")
+            claim_path.unlink(missing_ok=True)
+            n_failed += 1
+            print(f"   ✗ Failed: {name} ({e})")
+        finally:
+            heartbeat.set()
+
+    print(f"\n{'='*60}")
+    print(f"WORKER {worker_id} COMPLETE: {n_done} done, {n_failed} failed")
+    print(f"{'='*60}\n")
+
+
+def run_reduce(queue_dir, base_dir, masking_strategy, catalog_path=None,
+               output_profile=DEFAULT_OUTPUT_PROFILE, pyramid_factors=()):
+    """Ingests worker catalog records and builds the Step 6 daily mosaics."""
+    print("\n" + "="*60)
+    print("REDUCER: INGESTING WORKER RESULTS AND BUILDING MOSAICS")
+    print("="*60)
+
+    init_queue(queue_dir)
+    n_open = sum(1 for state in ("pending", "claimed")
+                 for _ in (Path(queue_dir) / state).iterdir())
+    if n_open:
+        print(f"WARNING: {n_open} task(s) still pending/claimed — mosaics will be incomplete")
+    n_failed = sum(1 for _ in (Path(queue_dir) / "failed").iterdir())
+    if n_failed:
+        print(f"WARNING: {n_failed} task(s) failed — see {Path(queue_dir) / 'failed'}")
+
+    if catalog_path is not None:
+        conn = open_catalog(catalog_path)
+        n_records = 0
+        for done_path in (Path(queue_dir) / "done").glob("*.json"):
+            record = json.loads(done_path.read_text()).get('catalog')
+            if record:
+                conn.execute(
+                    f"INSERT OR REPLACE INTO granules ({', '.join(CATALOG_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(CATALOG_COLUMNS))})",
+                    [record.get(name) for name in CATALOG_COLUMNS]
+                )
+                n_records += 1
+        conn.commit()
+        conn.close()
+        print(f"Catalog: ingested {n_records} worker record(s) into {catalog_path}\n")
+
+    run_step6(base_dir / "geotiff_clipped", get_flag_list(masking_strategy), masking_strategy,
+              catalog_path=catalog_path, output_profile=output_profile,
+              pyramid_factors=pyramid_factors)
+
+
+# ==============================================================================
+# JOINT DAILY MODE: ONE RESAMPLING PER DAY
+# ==============================================================================
+#
+# Batch mode resamples each pass onto its own grid (Step 4), clips it
+# (Step 5), then reprojects it again onto the union grid to average it
+# (Step 6). --mode daily instead groups granules by acquisition date and
+# resamples every pass of a day straight onto one ROI grid, accumulating a
+# per-cell sum and count:
+#   binning : all swath pixels of the day are binned together, so the mean
+#             is over every pixel centre falling in a cell, whatever its pass
+#   kdtree  : each pass is sampled once (nearest neighbour) onto the shared
+#             grid and the samples are averaged
+# The mean is masked to the ROI polygons and written with its count, with no
+# per-pass files in between:
+#   <base-directory>/daily_joint/<prefix>_daily_<date>.tif
+#   <base-directory>/daily_joint/count/<prefix>_daily_<date>.tif
+# plus coarser x<factor>/ levels with --pyramid-factors, as in Step 6.
+# ==============================================================================
+
+DEFAULT_DAILY_JOINT_DIR_NAME = "daily_joint"
+
+
+def read_roi_geometry(shapefile_path):
+    """Union of the ROI polygons as one shapely geometry in EPSG:4326."""
+    import geopandas as gpd
+
+    roi = gpd.read_file(shapefile_path)
+    if roi.crs is not None and roi.crs.to_epsg() != 4326:
+        roi = roi.to_crs(epsg=4326)
+    return roi.geometry.union_all() if hasattr(roi.geometry, 'union_all') else roi.geometry.unary_union
+
+
+def roi_outside_mask(geometry, grid):
+    """Boolean grid, True for cells whose centre lies outside the ROI geometry."""
+    from rasterio.features import geometry_mask
+
+    template = grid_dataarray(np.empty((grid['rows'], grid['cols']), dtype=np.float32), grid)
+    return geometry_mask([geometry], out_shape=template.shape, transform=dataarray_transform(template))
+
+
+def granules_by_date(bounds, base_dir, safe_folder_suffix, catalog_path=None,
+                     start_date=None, end_date=None):
+    """
+    {acquisition date: [product folders]} of the granules that may overlap
+    bounds: from the catalog when available (footprint and date filtered),
+    else every product folder in the date range, dated from its name.
+    """
+    date_pattern = re.compile(r"(\d{8})")
+    if catalog_path is not None and Path(catalog_path).exists():
+        rows = query_granule_catalog(catalog_path, roi_bounds=bounds,
+                                     start_date=start_date, end_date=end_date)
+        candidates = [(Path(row['product_dir']), row['acquisition_date']) for row in rows]
+    else:
+        candidates = [(folder, None) for folder in sorted(Path(base_dir).glob(f"*{safe_folder_suffix}"))
+                      if folder.is_dir() and date_in_range(folder.name, start_date, end_date)]
+
+    granules = {}
+    for folder, date in candidates:
+        if date is None:
+            match = date_pattern.search(folder.name)
+            date  = match.group(1) if match else None
+        if date and folder.is_dir():
+            granules.setdefault(date, []).append(folder)
+    return granules
+
+
+def accumulate_day(subfolders, grid, flag_list, products=DEFAULT_PRODUCTS, cache_dir=None,
+                   gridding=DEFAULT_GRIDDING, gap_fill=0):
+    """
+    Masks every pass of one day (only the swath window over the grid) and
+    resamples it onto the shared grid. Returns {product: [sum, count,
+    n_passes, attrs]}. Binned cells are weighted by their pixel count, so
+    sum / count is the mean of all the day's pixels in each cell; KD-tree
+    samples and gap-filled cells count once per pass.
+    """
+    shape  = (grid['rows'], grid['cols'])
+    bounds = (grid['lon_min'], grid['lat_min'], grid['lon_max'], grid['lat_max'])
+    sums   = {}
+    for subfolder in subfolders:
+        subfolder = Path(subfolder)
+        status, masked_ds, _ = prepare_masked_granule(subfolder, flag_list, products=products,
+                                                      roi_bounds=bounds, cache_dir=cache_dir)
+        if status != 'ok':
+            continue
+        try:
+            gridded = grid_masked_products(masked_ds, subfolder / "geo_coordinates.nc",
+                                           cache_dir=cache_dir, grid=grid,
+                                           gridding=gridding, gap_fill=gap_fill)
+        except Exception as e:
+            print(f"  ✗ Error gridding {subfolder.name}: {e}")
+            continue
+        finally:
+            masked_ds.close()
+
+        for product_name, da in gridded.items():
+            valid  = np.isfinite(da.values)
+            weight = valid.astype(np.int32)
+            if 'n_obs' in da.coords:
+                weight = np.where(valid, np.maximum(da['n_obs'].values, 1), 0).astype(np.int32)
+            entry = sums.setdefault(product_name, [np.zeros(shape), np.zeros(shape, dtype=np.int32),
+                                                   0, dict(da.attrs)])
+            entry[0] += np.where(valid, da.values.astype(np.float64) * weight, 0.0)
+            entry[1] += weight
+            entry[2] += 1
+    return sums
+
+
+def run_daily_joint(base_dir, safe_folder_suffix, masking_strategy, roi_shape, products=DEFAULT_PRODUCTS,
+                    catalog_path=None, cache_dir=None, output_profile=DEFAULT_OUTPUT_PROFILE,
+                    start_date=None, end_date=None, gridding=DEFAULT_GRIDDING, gap_fill=0,
+                    output_encoding='float32', pyramid_factors=(), res_deg=0.0027):
+    """Steps 3–6 as one resampling of all passes per day (see JOINT DAILY MODE)."""
+    from rasterio.transform import Affine
+
+    flag_list  = get_flag_list(masking_strategy)
+    output_dir = Path(base_dir) / DEFAULT_DAILY_JOINT_DIR_NAME
+    count_dir  = output_dir / "count"
+    for directory in [output_dir, count_dir] + [output_dir / f"x{f}" for f in pyramid_factors]:
+        directory.mkdir(parents=True, exist_ok=True)
+
+    geometry = read_roi_geometry(roi_shape)
+    grid     = grid_from_bounds(geometry.bounds, res_deg)
+    outside  = roi_outside_mask(geometry, grid)
+    dates    = granules_by_date(geometry.bounds, base_dir, safe_folder_suffix, catalog_path,
+                                start_date, end_date)
+
+    print("\n" + "="*60)
+    print("JOINT DAILY MODE: ONE RESAMPLING OF ALL PASSES PER DAY (STEPS 3–6)")
+    print("="*60)
+    print(f"ROI grid:   {grid['cols']} × {grid['rows']} cells at {res_deg}° ({gridding})")
+    print(f"Found {sum(len(folders) for folders in dates.values())} granule(s) on {len(dates)} date(s)")
+    print(f"Output:     {output_dir}\n")
+
+    mosaic_count = 0
+    for date, subfolders in sorted(dates.items()):
+        print(f"📅 {date} ({len(subfolders)} granule(s))")
+        sums = accumulate_day(subfolders, grid, flag_list, products=products, cache_dir=cache_dir,
+                              gridding=gridding, gap_fill=gap_fill)
+        for product_name, (total, count, n_passes, attrs) in sums.items():
+            total[outside] = 0.0
+            count[outside] = 0
+            if not count.any():
+                print(f"   No valid {product_name} pixels inside the ROI")
+                continue
+
+            name = f"{PRODUCTS[product_name]['prefix']}_daily_{date}.tif"
+            mean = np.where(count > 0, total / np.maximum(count, 1), np.nan).astype(np.float32)
+            da   = grid_dataarray(mean, grid, {**attrs, 'n_passes': n_passes}).rename(product_name)
+            save_dataarray(da, output_dir / name, output_profile=output_profile,
+                           output_encoding=output_encoding)
+            write_raster(count_dir / name, np.minimum(count, np.iinfo(np.uint16).max).astype(np.uint16),
+                         dataarray_transform(da), 'EPSG:4326', None, output_profile=output_profile,
+                         tags={'PRODUCT': product_name, 'UNITS': 'count', 'N_PASSES': str(n_passes),
+                               'GRIDDING': gridding})
+            mosaic_count += 1
+            print(f"   Saved: {name} ({n_passes} pass(es), {int(np.count_nonzero(count)):,} cells)")
+
+            for factor in pyramid_factors:
+                coarse_total, coarse_count = aggregate_blocks(total, count, factor)
+                coarse = np.where(coarse_count > 0, coarse_total / np.maximum(coarse_count, 1), np.nan)
+                encoding = output_encoding if uses_log10_encoding(product_name, output_encoding) else 'float32'
+                coarse, nodata, tags, scale_offset = encoded_raster(
+                    coarse, encoding, {**raster_tags(da), 'AGGREGATION_FACTOR': str(factor)})
+                write_raster(output_dir / f"x{factor}" / name, coarse,
+                             dataarray_transform(da) * Affine.scale(factor), 'EPSG:4326', nodata,
+                             output_profile=output_profile, tags=tags, scale_offset=scale_offset)
+
+    print(f"\n{'='*60}")
+    print(f"JOINT DAILY MODE COMPLETE: Created {mosaic_count} daily mosaics")
+    print(f"Masking strategy: {masking_strategy}")
+    print(f"Flags applied:    {', '.join(flag_list)}")
+    print(f"Location:         {output_dir}")
+    print(f"{'='*60}\n")
+
+
+# ==============================================================================
+# TILED MODE: FIXED-SIZE ROI TILES
+# ==============================================================================
+#
+# For large or multi-region ROIs (a whole coastline, several disjoint
+# polygons), Steps 3–6 run per tile instead of per swath bounding box:
+#   - the ROI polygons are covered by a fixed lattice of --tile-size-deg
+#     tiles aligned to multiples of the tile size (stable tile ids and pixel
+#     grids across runs and ROIs); tiles not touching a polygon are dropped
+#   - for each tile, every granule whose footprint meets it (catalog query)
+#     is masked and gridded straight onto the tile grid, one day at a time
+#     (see JOINT DAILY MODE); the daily means are masked to the ROI
+#     polygons (Step 5) and written as
+#       <base-directory>/tiled_mosaics/<tile>/<prefix>_daily_<date>.tif
+#   - tiles are independent tasks run in --workers processes (see
+#     MEMORY-AWARE SCHEDULING)
+#   - one GDAL VRT per product and date indexes all of its tiles:
+#       <base-directory>/tiled_mosaics/<prefix>_daily_<date>.vrt
+# Memory per task depends on the tile size (and the swath window
+# intersecting the tile), not on the ROI size.
+# ==============================================================================
+
+DEFAULT_TILE_SIZE_DEG  = 1.0
+DEFAULT_TILES_DIR_NAME = "tiled_mosaics"
+
+VRT_DATA_TYPES = {'float32': 'Float32', 'uint16': 'UInt16'}
+
+
+def tile_name(lon_min, lat_min):
+    """Tile id from its lower-left corner in hundredths of a degree, e.g. N3300W11900."""
+    return (f"{'N' if lat_min >= 0 else 'S'}{abs(round(lat_min * 100)):04d}"
+            f"{'E' if lon_min >= 0 else 'W'}{abs(round(lon_min * 100)):05d}")
+
+
+def roi_tiles(shapefile_path, tile_size_deg=DEFAULT_TILE_SIZE_DEG, res_deg=0.0027):
+    """
+    Lattice tiles touching the ROI polygons, as dicts {'id', 'bounds',
+    'grid', 'roi'}: 'grid' is the tile's target grid dict (pixel size
+    tile_size_deg / round(tile_size_deg / res_deg), so tiles abut exactly)
+    and 'roi' the part of the ROI geometry inside the tile.
+    """
+    from shapely.geometry import box
+
+    geometry = read_roi_geometry(shapefile_path)
+    lon_min, lat_min, lon_max, lat_max = geometry.bounds
+    size  = max(int(round(tile_size_deg / res_deg)), 1)
+    tiles = []
+    for row in range(int(np.floor(lat_min / tile_size_deg)), int(np.ceil(lat_max / tile_size_deg))):
+        for col in range(int(np.floor(lon_min / tile_size_deg)), int(np.ceil(lon_max / tile_size_deg))):
+            bounds = (col * tile_size_deg, row * tile_size_deg,
+                      (col + 1) * tile_size_deg, (row + 1) * tile_size_deg)
+            part = geometry.intersection(box(*bounds))
+            if part.is_empty:
+                continue
+            grid = {'lon_min': bounds[0], 'lat_min': bounds[1], 'lon_max': bounds[2],
+                    'lat_max': bounds[3], 'cols': size, 'rows': size}
+            tiles.append({'id': tile_name(bounds[0], bounds[1]), 'bounds': bounds,
+                          'grid': grid, 'roi': part})
+    return tiles
+
+
+def process_tile(tile, dates, flag_list, products=DEFAULT_PRODUCTS, output_dir=None,
+                 cache_dir=None, output_profile=DEFAULT_OUTPUT_PROFILE, gridding=DEFAULT_GRIDDING,
+                 gap_fill=0, output_encoding='float32'):
+    """
+    Steps 3–6 for one tile: resamples each day's passes ({date: [product
+    folders]}) onto the tile grid (see accumulate_day()), masks the daily
+    means to the tile's ROI polygons and writes one GeoTIFF per product and
+    day into output_dir/<tile id>/. Runs in a worker process; returns
+    (written paths, captured log).
+    """
+    grid     = tile['grid']
+    tile_dir = Path(output_dir) / tile['id']
+    outside  = roi_outside_mask(tile['roi'], grid)
+    if cache_dir is not None:
+        cache_dir = Path(cache_dir) / tile['id']   # window/grid-keyed entries differ per tile
+
+    written = []
+    log     = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        for date, subfolders in sorted(dates.items()):
+            sums = accumulate_day(subfolders, grid, flag_list, products=products, cache_dir=cache_dir,
+                                  gridding=gridding, gap_fill=gap_fill)
+            for product_name, (total, count, n_passes, attrs) in sums.items():
+                count[outside] = 0
+                if not count.any():
+                    continue
+
+                tile_dir.mkdir(parents=True, exist_ok=True)
+                out_path = tile_dir / f"{PRODUCTS[product_name]['prefix']}_daily_{date}.tif"
+                mean = np.where(count > 0, total / np.maximum(count, 1), np.nan).astype(np.float32)
+                da   = grid_dataarray(mean, grid, {**attrs, 'n_passes': n_passes}).rename(product_name)
+                save_dataarray(da, out_path, output_profile=output_profile,
+                               output_encoding=output_encoding)
+                written.append(out_path)
+                print(f"   Saved: {tile['id']}/{out_path.name} ({n_passes} pass(es))")
+
+    return written, log.getvalue()
+
+
+def write_vrt(vrt_path, raster_paths):
+    """
+    Writes a GDAL VRT mosaicking same-resolution, non-overlapping GeoTIFFs
+    (e.g. the tiles of one daily mosaic), with source paths relative to the VRT.
+    """
+    import rasterio
+    from xml.sax.saxutils import escape, quoteattr
+
+    vrt_path = Path(vrt_path)
+    sources  = []
+    for path in sorted(raster_paths):
+        with rasterio.open(path) as src:
+            sources.append({'path': Path(path), 'transform': src.transform, 'width': src.width,
+                            'height': src.height, 'dtype': src.dtypes[0], 'nodata': src.nodata,
+                            'crs': src.crs.to_wkt(), 'scale': src.scales[0], 'offset': src.offsets[0],
+                            'tags': src.tags(1)})
+
+    first = sources[0]
+    res_x, res_y = first['transform'].a, -first['transform'].e
+    left   = min(s['transform'].c for s in sources)
+    top    = max(s['transform'].f for s in sources)
+    right  = max(s['transform'].c + s['width'] * res_x for s in sources)
+    bottom = min(s['transform'].f - s['height'] * res_y for s in sources)
+    width  = int(round((right - left) / res_x))
+    height = int(round((top - bottom) / res_y))
+
+    tags = {key: value for key, value in first['tags'].items() if key != 'N_PASSES'}
+    lines = [f'<VRTDataset rasterXSize="{width}" rasterYSize="{height}">',
+             f'  <SRS>{escape(first["crs"])}</SRS>',
+             f'  <GeoTransform>{left!r}, {res_x!r}, 0.0, {top!r}, 0.0, {-res_y!r}</GeoTransform>',
+             f'  <VRTRasterBand dataType="{VRT_DATA_TYPES[first["dtype"]]}" band="1">']
+    if first['nodata'] is not None:
+        lines.append(f'    <NoDataValue>{first["nodata"]!r}</NoDataValue>')
+    if first['scale'] != 1.0 or first['offset'] != 0.0:
+        lines += [f'    <Offset>{first["offset"]!r}</Offset>', f'    <Scale>{first["scale"]!r}</Scale>']
+    if tags:
+        lines.append('    <Metadata>')
+        lines += [f'      <MDI key={quoteattr(key)}>{escape(value)}</MDI>' for key, value in tags.items()]
+        lines.append('    </Metadata>')
+    for s in sources:
+        x_off = int(round((s['transform'].c - left) / res_x))
+        y_off = int(round((top - s['transform'].f) / res_y))
+        rel   = os.path.relpath(s['path'], vrt_path.parent)
+        lines += ['    <SimpleSource>',
+                  f'      <SourceFilename relativeToVRT="1">{escape(rel)}</SourceFilename>',
+                  '      <SourceBand>1</SourceBand>',
+                  f'      <SrcRect xOff="0" yOff="0" xSize="{s["width"]}" ySize="{s["height"]}"/>',
+                  f'      <DstRect xOff="{x_off}" yOff="{y_off}" xSize="{s["width"]}" ySize="{s["height"]}"/>',
+                  '    </SimpleSource>']
+    lines += ['  </VRTRasterBand>', '</VRTDataset>']
+    vrt_path.write_text("\n".join(lines) + "\n")
+    return vrt_path
+
+
+def run_tiled(base_dir, safe_folder_suffix, masking_strategy, roi_shape, products=DEFAULT_PRODUCTS,
+              catalog_path=None, cache_dir=None, output_profile=DEFAULT_OUTPUT_PROFILE,
+              start_date=None, end_date=None, gridding=DEFAULT_GRIDDING, gap_fill=0,
+              output_encoding='float32', tile_size_deg=DEFAULT_TILE_SIZE_DEG, workers=1,
+              ram_budget_bytes=None, res_deg=0.0027):
+    """
+    Steps 3–6 per ROI tile (see TILED MODE), then one VRT per product and
+    date. With workers > 1, tiles run in memory-scheduled worker processes
+    (see MEMORY-AWARE SCHEDULING).
+    """
+    flag_list  = get_flag_list(masking_strategy)
+    output_dir = Path(base_dir) / DEFAULT_TILES_DIR_NAME
+    output_dir.mkdir(exist_ok=True)
+
+    print("\n" + "="*60)
+    print("TILED MODE: STEPS 3–6 PER ROI TILE")
+    print("="*60)
+
+    tiles = roi_tiles(roi_shape, tile_size_deg, res_deg)
+    tasks = [(tile, granules_by_date(tile['bounds'], base_dir, safe_folder_suffix, catalog_path,
+                                     start_date, end_date))
+             for tile in tiles]
+    tasks = [(tile, dates) for tile, dates in tasks if dates]
+    print(f"Tile size:  {tile_size_deg}° ({tiles[0]['grid']['cols'] if tiles else 0} px) | "
+          f"{len(tiles)} tile(s) touch the ROI, {len(tasks)} with granules")
+    print(f"Workers:    {workers}"
+          + (f" | RAM budget: {ram_budget_bytes / 1e9:.1f} GB" if ram_budget_bytes else ""))
+    print(f"Output:     {output_dir}\n")
+
+    task_kwargs = dict(products=products, output_dir=output_dir, cache_dir=cache_dir,
+                       output_profile=output_profile, gridding=gridding, gap_fill=gap_fill,
+                       output_encoding=output_encoding)
+    written = []
+
+    def report(tile, n_granules, result):
+        paths, log = result
+        print(f"▶ Tile {tile['id']} ({n_granules} granule(s))")
+        print(log, end="")
+        print(f"   ✓ {len(paths)} daily tile(s)")
+        written.extend(paths)
+
+    if workers > 1:
+        # Per-tile estimate: its largest swath (granules run one at a time) plus the tile grid
+        by_id     = {tile['id']: (tile, sum(map(len, dates.values()))) for tile, dates in tasks}
+        scheduled = [(tile['id'],
+                      estimate_task_memory(max(swath_pixels(folder) for folders in dates.values()
+                                               for folder in folders),
+                                           grid['rows'] * grid['cols'], len(products), gridding),
+                      (tile, dates, flag_list), task_kwargs)
+                     for tile, dates in tasks for grid in [tile['grid']]]
+        for name, result, error, log, peak, estimate in run_scheduled(process_tile, scheduled, workers,
+                                                                      ram_budget_bytes):
+            tile, n_granules = by_id[name]
+            if error or result is None:
+                print(log, end="")
+                print(f"▶ Tile {name}: ✗ Failed ({error})")
+                continue
+            report(tile, n_granules, result)
+            print(f"   Memory: peak {peak / 1e9:.2f} GB, estimated {estimate / 1e9:.2f} GB")
+    else:
+        for tile, dates in tasks:
+            try:
+                report(tile, sum(map(len, dates.values())),
+                       process_tile(tile, dates, flag_list, **task_kwargs))
+            except Exception as e:
+                print(f"▶ Tile {tile['id']}: ✗ Failed ({e})")
+
+    # Virtual mosaic index: one VRT per product and date over all its tiles
+    by_name = {}
+    for path in written:
+        by_name.setdefault(path.name, []).append(path)
+    for name, paths in sorted(by_name.items()):
+        write_vrt(output_dir / f"{Path(name).stem}.vrt", paths)
+
+    print(f"\n{'='*60}")
+    print(f"TILED MODE COMPLETE: {len(written)} daily tile(s), {len(by_name)} VRT mosaic(s)")
+    print(f"Masking strategy: {masking_strategy}")
+    print(f"Flags applied:    {', '.join(flag_list)}")
+    print(f"Location:         {output_dir}")
+    print(f"{'='*60}\n")
+
+
+# ==============================================================================
+# MEMORY-AWARE SCHEDULING (--workers with --ram-budget-gb)
+# ==============================================================================
+#
+# Granule sizes vary widely (partial vs full swaths), so a fixed worker count
+# either leaves a node idle or runs it out of memory in the neighbour search
+# or the mosaicking. Parallel tasks (batch Steps 3–5 per granule, or tiled
+# mode tiles) are instead admitted while the sum of their estimated peak
+# memory stays under --ram-budget-gb:
+#   - estimate = base + correction × (swath pixels × per-pixel
+#     cost of the gridding backend + target grid cells × per-cell cost per
+#     product); swath sizes come from netCDF dimension metadata only and
+#     grid sizes from the catalog footprint (or the tile), no data is read
+#   - every task runs in a fresh worker process (max_tasks_per_child=1), so
+#     its peak RSS (ru_maxrss) is its own; the ratio of observed to estimated
+#     variable memory (peak - base), clamped to [MIN_MEMORY_CORRECTION,
+#     MAX_MEMORY_CORRECTION], updates the correction factor for later
+#     admissions, and the base (TASK_BASE_BYTES at first) drops to the
+#     smallest observed peak if tasks use less than it (Python >= 3.11 only;
+#     older versions reuse workers and do not learn)
+#   - if a worker dies (e.g. OOM-killed), the tasks that were in flight are
+#     re-run one at a time, so only the task that really dies is failed
+#   - pending tasks are admitted first-fit in order; a task larger than the
+#     whole budget still runs, alone
+# Without --ram-budget-gb, at most --workers tasks run at a time.
+# ==============================================================================
+
+TASK_BASE_BYTES       = 400e6   # interpreter + numpy/xarray/pyresample/rasterio imports
+SWATH_BYTES_PER_PIXEL = {'kdtree': 96, 'binning': 40}   # flags, lat/lon, decode temporaries, neighbour search
+GRID_BYTES_PER_CELL   = 24      # per product: resampled float32, indices, sum/count
+MEMORY_LEARNING_RATE  = 0.5     # weight of each new observation in the correction factor
+MIN_MEMORY_CORRECTION = 0.5     # a small granule must not shrink estimates enough to over-admit
+MAX_MEMORY_CORRECTION = 4.0
+
+
+def swath_pixels(product_dir):
+    """Swath size (rows × columns) from geo_coordinates.nc dimension metadata, without reading data."""
+    import xarray as xr
+
+    geo_path = Path(product_dir) / "geo_coordinates.nc"
+    if not geo_path.exists():
+        return 0
+    with xr.open_dataset(geo_path, decode_cf=False) as geo_ds:
+        return int(np.prod([geo_ds.sizes[dim] for dim in geo_ds['latitude'].dims]))
+
+
+def estimate_task_memory(n_pixels, n_cells, n_products=1, gridding=DEFAULT_GRIDDING):
+    """Variable part (bytes, before correction) of a task's estimated peak memory."""
+    return (n_pixels * (SWATH_BYTES_PER_PIXEL[gridding] + 8 * n_products)
+            + n_cells * GRID_BYTES_PER_CELL * n_products)
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process (ru_maxrss is KB on Linux, bytes on macOS)."""
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _measured_task(func, args, kwargs):
+    """Worker-process wrapper: returns (result, error, log, peak RSS) of func(*args, **kwargs)."""
+    warnings.filterwarnings('ignore')
+    log = io.StringIO()
+    result, error = None, None
+    with contextlib.redirect_stdout(log):
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            traceback.print_exc(file=sys.stdout)
+    return result, error, log.getvalue(), peak_rss_bytes()
+
+
+def run_scheduled(func, tasks, workers, ram_budget_bytes=None):
+    """
+    Runs func(*args, **kwargs) for tasks [(name, variable_bytes, args,
+    kwargs)] in up to `workers` processes within ram_budget_bytes (see
+    MEMORY-AWARE SCHEDULING). Yields (name, result, error, log, peak RSS,
+    estimate) as tasks finish.
+
+    If a worker process dies (e.g. killed by the OOM killer), the pool is
+    rebuilt and every task that was in flight is re-queued to run alone;
+    a task that dies while running alone is reported as failed.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    from concurrent.futures.process import BrokenProcessPool
+
+    # Without max_tasks_per_child (Python < 3.11) workers are reused and
+    # ru_maxrss keeps earlier tasks' high-water mark, so nothing is learned
+    learn       = sys.version_info >= (3, 11)
+    pool_kwargs = {'max_tasks_per_child': 1} if learn else {}
+
+    def new_executor():
+        return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                   **pool_kwargs)
+
+    correction = 1.0
+    base       = TASK_BASE_BYTES
+    pending    = list(tasks)
+    running    = {}
+    isolated   = set()   # names of tasks in flight when a worker died
+    executor   = new_executor()
+    try:
+        while pending or running:
+            in_use = sum(estimate for _, estimate in running.values())
+            for task in list(pending):
+                if len(running) >= workers or any(t[0] in isolated for t, _ in running.values()):
+                    break
+                if running and task[0] in isolated:
+                    continue
+                estimate = base + correction * task[1]
+                if running and ram_budget_bytes and in_use + estimate > ram_budget_bytes:
+                    continue
+                pending.remove(task)
+                running[executor.submit(_measured_task, func, task[2], task[3])] = (task, estimate)
+                in_use += estimate
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            if any(isinstance(f.exception(), BrokenProcessPool) for f in done):
+                done = [f for f in running if f.done()]   # keep results that finished before the break
+            broken = False
+            for future in done:
+                task, estimate = running.pop(future)
+                name, variable_bytes = task[0], task[1]
+                try:
+                    result, error, log, peak = future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    running[future] = (task, estimate)
+                    continue
+                except Exception as e:
+                    result, error, log, peak = None, f"{type(e).__name__}: {e}", "", 0
+                isolated.discard(name)
+                if learn and peak and variable_bytes > 0:
+                    base       = min(base, peak)
+                    ratio      = min(max((peak - base) / variable_bytes, MIN_MEMORY_CORRECTION),
+                                     MAX_MEMORY_CORRECTION)
+                    correction = (1 - MEMORY_LEARNING_RATE) * correction + MEMORY_LEARNING_RATE * ratio
+                yield name, result, error, log, peak, estimate
+
+            if broken:
+                # A dead worker breaks the whole pool: every in-flight task is lost
+                lost = list(running.values())
+                running.clear()
+                executor.shutdown(wait=True, cancel_futures=True)
+                executor = new_executor()
+                if len(lost) == 1:
+                    (name, *_), estimate = lost[0]
+                    isolated.discard(name)
+                    yield (name, None, "worker process died (out of memory or killed)", "", 0, estimate)
+                else:
+                    print(f"   ⚠ A worker process died — re-running {len(lost)} task(s) one at a time")
+                    for task, _ in lost:
+                        isolated.add(task[0])
+                    pending[:0] = [task for task, _ in lost]
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def run_parallel_granules(base_dir, safe_folder_suffix, masking_strategy, roi_shape,
+                          products=DEFAULT_PRODUCTS, roi_bounds=None, catalog_path=None, cache_dir=None,
+                          output_profile=DEFAULT_OUTPUT_PROFILE, start_date=None, end_date=None,
+                          gridding=DEFAULT_GRIDDING, gap_fill=0, output_encoding='float32',
+                          workers=2, ram_budget_bytes=None, res_deg=0.0027):
+    """Steps 3–5 per granule (process_product_folder()) in memory-scheduled worker processes."""
+    flag_list = get_flag_list(masking_strategy)
+    budget    = f"{ram_budget_bytes / 1e9:.1f} GB" if ram_budget_bytes else "none"
+
+    print("\n" + "="*60)
+    print("STEPS 3–5: PARALLEL PER-GRANULE PROCESSING")
+    print("="*60)
+    print(f"Workers: {workers} | RAM budget: {budget} | gridding: {gridding}\n")
+
+    rows = {}
+    if catalog_path is not None and Path(catalog_path).exists():
+        rows = {row['granule']: row for row in query_granule_catalog(
+            catalog_path, roi_bounds=roi_bounds, start_date=start_date, end_date=end_date)}
+
+    tasks = []
+    for subfolder in sorted(base_dir.iterdir()):
+        if not (subfolder.is_dir() and subfolder.name.endswith(safe_folder_suffix)):
+            continue
+        if catalog_path is not None and Path(catalog_path).exists() and subfolder.name not in rows:
+            continue
+        n_pixels = swath_pixels(subfolder)
+        n_cells  = n_pixels   # the swath's own grid is about as large as the swath
+        row      = rows.get(subfolder.name)
+        if row and row['lon_min'] is not None:
+            n_cells = ((row['lon_max'] - row['lon_min']) / res_deg) * ((row['lat_max'] - row['lat_min']) / res_deg)
+        tasks.append((subfolder.name, estimate_task_memory(n_pixels, n_cells, len(products), gridding),
+                      (subfolder, base_dir, flag_list, roi_shape),
+                      dict(products=products, roi_bounds=roi_bounds, cache_dir=cache_dir,
+                           output_profile=output_profile, gridding=gridding, gap_fill=gap_fill,
+                           output_encoding=output_encoding)))
+
+    n_done = n_failed = 0
+    for name, result, error, log, peak, estimate in run_scheduled(process_product_folder, tasks,
+                                                                  workers, ram_budget_bytes):
+        print(log, end="")
+        status, clipped = result if result is not None else ('error', [])
+        if error or status not in ('ok', 'no_overlap'):
+            n_failed += 1
+            print(f"   ✗ Failed: {name} ({error or status})")
+        else:
+            n_done += 1
+            print(f"   ✓ {name}: {len(clipped)} clipped file(s)")
+        print(f"   Memory: peak {peak / 1e9:.2f} GB, estimated {estimate / 1e9:.2f} GB")
+
+    print(f"\n{'='*60}")
+    print(f"STEPS 3–5 COMPLETE: {n_done} granules done, {n_failed} failed")
+    print(f"{'='*60}\n")
+    return flag_list
+
+
 # ==============================================================================
 # ENTRY POINT
 # ==============================================================================
@@ -751,25 +3780,261 @@ def parse_args():
                          help="Which quality flag set to apply.")
     parser.add_argument("--safe-folder-suffix", default=DEFAULT_SAFE_FOLDER_SUFFIX,
                          help="Suffix identifying MERIS product folders (e.g. .SEN3 or .SAFE).")
+    parser.add_argument("--products", nargs="+", default=DEFAULT_PRODUCTS, choices=list(PRODUCTS),
+                         metavar="PRODUCT",
+                         help=f"Product variables to process in one pass per granule (default: TSM_NN). "
+                              f"Choices: {', '.join(PRODUCTS)}.")
+    parser.add_argument("--output-profile", default=DEFAULT_OUTPUT_PROFILE, choices=list(OUTPUT_PROFILES),
+                         help="GeoTIFF layout for Steps 4–6: COG (default), tiled+compressed GTiff, or plain GTiff.")
+    parser.add_argument("--steps", default="1-6",
+                         help="Batch mode: workflow steps to run, e.g. '4-6', '6' or '1,3-5' "
+                              "(default: 1-6). Skipped steps' outputs are read from their usual directories.")
     parser.add_argument("--skip-unzip", action="store_true",
                          help="Skip Step 1 (unzip) — use if data is already extracted.")
-    return parser.parse_args()
+    parser.add_argument("--mode", default="batch",
+                         choices=["batch", "rolling", "daily", "tiled", "daemon", "enqueue", "worker", "reduce"],
+                         help="batch: run each step over all granules (default); "
+                              "rolling: run Steps 1–5 granule by granule within --disk-budget-gb, "
+                              "reclaiming raw data as each granule finishes; "
+                              "daily: Steps 1–2 as in batch, then Steps 3–6 as one resampling of all "
+                              "passes of each day onto the ROI grid (mean + count); "
+                              "tiled: Steps 1–2 as in batch, then Steps 3–6 per fixed-size ROI tile "
+                              "(see --tile-size-deg) with a VRT index per daily mosaic; "
+                              "daemon: watch --watch-dir and process each new archive as it lands, "
+                              "refreshing only the affected daily mosaics; "
+                              "enqueue / worker / reduce: distributed processing through a "
+                              "shared-filesystem work queue (see --queue-dir).")
+    parser.add_argument("--watch-dir", default=None,
+                         help="Daemon mode: folder receiving new archives, also scanned one subfolder level "
+                              "deep (default: --base-directory).")
+    parser.add_argument("--poll-interval", type=float, default=DAEMON_POLL_INTERVAL_S,
+                         help=f"Daemon mode: seconds between scans when inotify_simple is not installed "
+                              f"(or between idle checks when it is) (default: {DAEMON_POLL_INTERVAL_S}).")
+    parser.add_argument("--tile-size-deg", type=float, default=DEFAULT_TILE_SIZE_DEG,
+                         help=f"Tiled mode: tile edge in degrees; memory per task scales with it "
+                              f"(default: {DEFAULT_TILE_SIZE_DEG}).")
+    parser.add_argument("--workers", type=int, default=1,
+                         help="Batch mode (when running Steps 3–5) and tiled mode: granules / tiles processed "
+                              "in parallel worker processes (default: 1). Batch Steps 3–5 then run per granule, "
+                              "without --prefetch or --qa-table.")
+    parser.add_argument("--ram-budget-gb", type=float, default=None,
+                         help="With --workers: only start tasks while their estimated peak memory, corrected "
+                              "from observed peak RSS, fits in this many GB (default: no budget).")
+    parser.add_argument("--queue-dir", default=None,
+                         help=f"Work queue directory for enqueue/worker/reduce modes "
+                              f"(default: <base-directory>/{DEFAULT_QUEUE_DIR_NAME}).")
+    parser.add_argument("--disk-budget-gb", type=float, default=None,
+                         help="Rolling/worker mode: maximum GB of workflow data under --base-directory "
+                              "(pending archives excluded). In worker mode, setting it also reclaims "
+                              "each granule's raw data once done.")
+    parser.add_argument("--archive-dir", default=None,
+                         help="Rolling mode: move finished raw product folders here instead of deleting them.")
+    parser.add_argument("--disk-wait-timeout", type=float, default=60,
+                         help="Rolling mode: minutes to wait for disk space before stopping (default: 60).")
+    parser.add_argument("--catalog", default=None,
+                         help=f"Path of the SQLite granule footprint catalog (default: <base-directory>/{DEFAULT_CATALOG_NAME}).")
+    parser.add_argument("--no-catalog", action="store_true",
+                         help="Do not build or use the granule footprint catalog.")
+    parser.add_argument("--start-date", default=None,
+                         help="Only process granules acquired on/after this date (YYYYMMDD or YYYY-MM-DD; needs the catalog).")
+    parser.add_argument("--end-date", default=None,
+                         help="Only process granules acquired on/before this date (YYYYMMDD or YYYY-MM-DD; needs the catalog).")
+    parser.add_argument("--cache-dir", default=None,
+                         help=f"Decode-once granule cache directory (default: <base-directory>/{DEFAULT_CACHE_DIR_NAME}).")
+    parser.add_argument("--no-cache", action="store_true",
+                         help="Do not read or write the decode-once granule cache.")
+    parser.add_argument("--no-roi-window", action="store_true",
+                         help="Read full swaths in Steps 3/4 instead of only the window intersecting the ROI bounding box.")
+    parser.add_argument("--gridding", choices=GRIDDING_BACKENDS, default=DEFAULT_GRIDDING,
+                         help=f"Step 4 swath-to-grid backend: 'kdtree' nearest neighbour (reference) or 'binning' "
+                              f"per-cell mean of pixel centres, much faster (default: {DEFAULT_GRIDDING}).")
+    parser.add_argument("--gap-fill", type=int, default=0,
+                         help="Step 4: fill empty grid cells from their 3×3 neighbours, this many passes "
+                              "(default: 0; 1 closes the single-cell holes binning leaves at native resolution).")
+    parser.add_argument("--output-encoding", choices=OUTPUT_ENCODINGS, default='float32',
+                         help="Storage of log10 products (e.g. TSM_NN) in Steps 3–6: float32 physical units, or "
+                              "log10_uint16 (log10 packed as uint16 with scale/offset, half the size; values "
+                              "outside 0.001–3576 are written as no data). "
+                              "Steps 5–6 keep the encoding of their inputs (default: float32).")
+    parser.add_argument("--pyramid-factors", nargs="+", type=int, default=[],
+                         help="Step 6: also write coarser daily mosaics aggregated by these integer factors "
+                              "(e.g. 2 4 16) into daily_mosaics/x<factor>/, from the same sum/count grids.")
+    parser.add_argument("--qa-table", nargs="?", const="", default=None,
+                         help=f"Step 3: write per-granule QA statistics (flag fractions, valid pixels, product "
+                              f"percentiles, valid fraction of the ROI window) to this Parquet table "
+                              f"(default path: <base-directory>/{DEFAULT_QA_TABLE_NAME}). Off unless given.")
+    parser.add_argument("--prefetch", type=int, default=DEFAULT_PREFETCH_DEPTH,
+                         help=f"Steps 3/4: granules prepared ahead in background threads and outputs written behind "
+                              f"(default: {DEFAULT_PREFETCH_DEPTH}; 0 = strictly sequential).")
+    args = parser.parse_args()
+    try:
+        args.steps = parse_steps(args.steps)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
+
+
+def parse_steps(spec):
+    """Parses a --steps spec such as '4-6' or '1,3-5' into a set of step numbers (1–6)."""
+    error = ValueError(f"invalid --steps '{spec}': use step numbers 1–6, e.g. '4-6' or '1,3-5'")
+    steps = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        try:
+            first, last = int(first), int(last or first)
+        except ValueError:
+            raise error from None
+        if last < first:
+            raise error
+        steps.update(range(first, last + 1))
+    if not steps or not steps <= set(range(1, 7)):
+        raise error
+    return steps
 
 
 def main():
     args = parse_args()
     base_dir = Path(args.base_directory)
-
-    if not args.skip_unzip:
+    steps    = set(args.steps)
+    if args.skip_unzip:
+        steps.discard(1)
+
+    # Library dependencies emit many harmless warnings (e.g. all-NaN slices)
+    warnings.filterwarnings('ignore')
+
+    start_date = args.start_date.replace('-', '') if args.start_date else None
+    end_date   = args.end_date.replace('-', '') if args.end_date else None
+
+    # The ROI bounds need geopandas, so they are only read when a step uses them
+    roi_bounds = None
+    needs_roi  = args.mode in ("rolling", "daemon", "worker") or (args.mode == "batch" and 3 in steps)
+    if needs_roi and not args.no_roi_window and os.path.exists(args.roi_shape):
+        roi_bounds = get_roi_bounds(args.roi_shape)
+
+    catalog_path = None
+    if not args.no_catalog:
+        catalog_path = Path(args.catalog) if args.catalog else base_dir / DEFAULT_CATALOG_NAME
+
+    ram_budget_bytes = args.ram_budget_gb * 1e9 if args.ram_budget_gb else None
+
+    cache_dir = None
+    if not args.no_cache:
+        cache_dir = Path(args.cache_dir) if args.cache_dir else base_dir / DEFAULT_CACHE_DIR_NAME
+
+    if args.mode == "rolling":
+        run_rolling(base_dir, args.safe_folder_suffix, args.masking_strategy, args.roi_shape,
+                    products=args.products, roi_bounds=roi_bounds, catalog_path=catalog_path,
+                    cache_dir=cache_dir, output_profile=args.output_profile,
+                    start_date=start_date, end_date=end_date,
+                    disk_budget_bytes=args.disk_budget_gb * 1e9 if args.disk_budget_gb else None,
+                    archive_dir=args.archive_dir, wait_timeout_s=args.disk_wait_timeout * 60,
+                    gridding=args.gridding, gap_fill=args.gap_fill,
+                    pyramid_factors=args.pyramid_factors, output_encoding=args.output_encoding)
+        return
+
+    if args.mode == "daemon":
+        run_daemon(base_dir, args.safe_folder_suffix, args.masking_strategy, args.roi_shape,
+                   watch_dir=args.watch_dir, products=args.products, roi_bounds=roi_bounds,
+                   catalog_path=catalog_path, cache_dir=cache_dir, output_profile=args.output_profile,
+                   start_date=start_date, end_date=end_date, gridding=args.gridding,
+                   gap_fill=args.gap_fill, pyramid_factors=args.pyramid_factors,
+                   output_encoding=args.output_encoding, poll_interval_s=args.poll_interval)
+        return
+
+    queue_dir = Path(args.queue_dir) if args.queue_dir else base_dir / DEFAULT_QUEUE_DIR_NAME
+
+    if args.mode == "enqueue":
+        n_added = enqueue_granules(queue_dir, base_dir, args.safe_folder_suffix,
+                                   start_date=start_date, end_date=end_date)
+        print(f"Enqueued {n_added} granule(s) in {queue_dir}")
+        return
+
+    if args.mode == "worker":
+        run_worker(queue_dir, base_dir, args.safe_folder_suffix, args.masking_strategy,
+                   args.roi_shape, products=args.products, roi_bounds=roi_bounds,
+                   cache_dir=cache_dir, output_profile=args.output_profile,
+                   disk_budget_bytes=args.disk_budget_gb * 1e9 if args.disk_budget_gb else None,
+                   archive_dir=args.archive_dir, wait_timeout_s=args.disk_wait_timeout * 60,
+                   gridding=args.gridding, gap_fill=args.gap_fill,
+                   output_encoding=args.output_encoding)
+        return
+
+    if args.mode == "reduce":
+        run_reduce(queue_dir, base_dir, args.masking_strategy, catalog_path=catalog_path,
+                   output_profile=args.output_profile, pyramid_factors=args.pyramid_factors)
+        return
+
+    print(f"Steps to run: {', '.join(str(step) for step in sorted(steps))}")
+
+    if 1 in steps:
         run_step1(args.base_directory)
     else:
-        print("\nSTEP 1 SKIPPED (--skip-unzip)\n")
-
-    run_step2(args.base_directory, args.safe_folder_suffix)
-    masked_dir, flag_list = run_step3(base_dir, args.safe_folder_suffix, args.masking_strategy)
-    output_dir = run_step4(base_dir, masked_dir)
-    clipped_dir = run_step5(base_dir, output_dir, args.roi_shape)
-    run_step6(clipped_dir, flag_list, args.masking_strategy)
+        print("\nSTEP 1 SKIPPED\n")
+
+    if 2 in steps:
+        run_step2(args.base_directory, args.safe_folder_suffix)
+
+    if catalog_path is not None and steps & {2, 3}:
+        run_catalog_update(base_dir, args.safe_folder_suffix, catalog_path)
+
+    if args.mode == "daily":
+        run_daily_joint(base_dir, args.safe_folder_suffix, args.masking_strategy, args.roi_shape,
+                        products=args.products, catalog_path=catalog_path, cache_dir=cache_dir,
+                        output_profile=args.output_profile, start_date=start_date, end_date=end_date,
+                        gridding=args.gridding, gap_fill=args.gap_fill,
+                        output_encoding=args.output_encoding, pyramid_factors=args.pyramid_factors)
+        return
+
+    if args.mode == "tiled":
+        run_tiled(base_dir, args.safe_folder_suffix, args.masking_strategy, args.roi_shape,
+                  products=args.products, catalog_path=catalog_path, cache_dir=cache_dir,
+                  output_profile=args.output_profile, start_date=start_date, end_date=end_date,
+                  gridding=args.gridding, gap_fill=args.gap_fill,
+                  output_encoding=args.output_encoding, tile_size_deg=args.tile_size_deg,
+                  workers=args.workers, ram_budget_bytes=ram_budget_bytes)
+        return
+
+    masked_dir  = base_dir / "tsm_masked"
+    output_dir  = base_dir / "geotiff"
+    clipped_dir = base_dir / "geotiff_clipped"
+    flag_list   = get_flag_list(args.masking_strategy)
+
+    qa_table = None
+    if args.qa_table is not None:
+        qa_table = Path(args.qa_table) if args.qa_table else base_dir / DEFAULT_QA_TABLE_NAME
+
+    if args.workers > 1 and {3, 4, 5} <= steps:
+        # Steps 3–5 per granule in memory-scheduled worker processes
+        flag_list = run_parallel_granules(base_dir, args.safe_folder_suffix, args.masking_strategy,
+                                          args.roi_shape, products=args.products, roi_bounds=roi_bounds,
+                                          catalog_path=catalog_path, cache_dir=cache_dir,
+                                          output_profile=args.output_profile, start_date=start_date,
+                                          end_date=end_date, gridding=args.gridding,
+                                          gap_fill=args.gap_fill, output_encoding=args.output_encoding,
+                                          workers=args.workers, ram_budget_bytes=ram_budget_bytes)
+        steps -= {3, 4, 5}
+
+    if 3 in steps:
+        masked_dir, flag_list = run_step3(base_dir, args.safe_folder_suffix, args.masking_strategy,
+                                          roi_bounds=roi_bounds, catalog_path=catalog_path,
+                                          cache_dir=cache_dir, products=args.products,
+                                          start_date=start_date, end_date=end_date,
+                                          prefetch=args.prefetch, qa_table=qa_table,
+                                          output_encoding=args.output_encoding)
+    if 4 in steps:
+        output_dir = run_step4(base_dir, masked_dir, cache_dir=cache_dir,
+                               output_profile=args.output_profile, prefetch=args.prefetch,
+                               gridding=args.gridding, gap_fill=args.gap_fill,
+                               output_encoding=args.output_encoding)
+    if 5 in steps:
+        clipped_dir = run_step5(base_dir, output_dir, args.roi_shape,
+                                output_profile=args.output_profile)
+    if 6 in steps:
+        run_step6(clipped_dir, flag_list, args.masking_strategy, catalog_path=catalog_path,
+                  output_profile=args.output_profile, pyramid_factors=args.pyramid_factors)
 
 
 if __name__ == "__main__":
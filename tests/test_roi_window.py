@@ -0,0 +1,71 @@
+"""ROI selection at the trailing edges of a swath (find_roi_window, granule catalog)."""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+import xarray as xr
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import meris_process_local as mp  # noqa: E402
+
+ROWS, COLS = 200, 50   # not multiples of COARSE_GEO_STEP
+
+
+def make_swath(product_dir, with_tie_points):
+    """Regular swath: latitude 30 + 0.01*row, longitude -120 + 0.01*col."""
+    product_dir.mkdir()
+    r, c = np.meshgrid(np.arange(ROWS), np.arange(COLS), indexing='ij')
+    lat, lon = 30.0 + r * 0.01, -120.0 + c * 0.01
+    xr.Dataset({'latitude': (('rows', 'columns'), lat),
+                'longitude': (('rows', 'columns'), lon)}).to_netcdf(product_dir / "geo_coordinates.nc")
+    if with_tie_points:
+        step = mp.COARSE_GEO_STEP
+        xr.Dataset({'latitude': (('tie_rows', 'tie_columns'), lat[::step, ::step]),
+                    'longitude': (('tie_rows', 'tie_columns'), lon[::step, ::step])},
+                   attrs={'al_subsampling_factor': step, 'ac_subsampling_factor': step}
+                   ).to_netcdf(product_dir / "tie_geo_coordinates.nc")
+    return product_dir
+
+
+def roi_of(rows, cols):
+    """ROI bbox exactly covering the given full-resolution rows / columns."""
+    return (-120.0 + cols[0] * 0.01, 30.0 + rows[0] * 0.01,
+            -120.0 + cols[-1] * 0.01, 30.0 + rows[-1] * 0.01)
+
+
+@pytest.mark.parametrize("with_tie_points", [False, True])
+@pytest.mark.parametrize("margin_deg", [0.0, mp.ROI_WINDOW_MARGIN_DEG])
+def test_roi_on_trailing_rows_and_columns(tmp_path, with_tie_points, margin_deg):
+    product_dir = make_swath(tmp_path / "G.SEN3", with_tie_points)
+    roi_rows, roi_cols = range(193, 200), range(45, 50)
+
+    window = mp.find_roi_window(product_dir, roi_of(roi_rows, roi_cols), margin_deg=margin_deg)
+
+    assert window is not None
+    row_slice, col_slice = window
+    assert row_slice.start <= roi_rows[0] and row_slice.stop == ROWS
+    assert col_slice.start <= roi_cols[0] and col_slice.stop == COLS
+
+
+def test_coarse_geolocation_includes_last_row_and_column(tmp_path):
+    product_dir = make_swath(tmp_path / "G.SEN3", with_tie_points=False)
+    lat, lon, rows, cols, full_shape = mp.read_coarse_geolocation(product_dir)
+    assert (rows[-1], cols[-1]) == (ROWS - 1, COLS - 1)
+    assert lat[-1, -1] == pytest.approx(30.0 + (ROWS - 1) * 0.01)
+    assert lon[-1, -1] == pytest.approx(-120.0 + (COLS - 1) * 0.01)
+
+
+def test_catalog_selects_granule_touching_roi_at_trailing_edge(tmp_path):
+    product_dir = make_swath(tmp_path / "G.SEN3", with_tie_points=True)
+    catalog_path = tmp_path / mp.DEFAULT_CATALOG_NAME
+    mp.update_granule_catalog(catalog_path, tmp_path, ".SEN3")
+
+    record = mp.query_granule_catalog(catalog_path, granule=product_dir.name)[0]
+    assert record['lat_max'] == pytest.approx(30.0 + (ROWS - 1) * 0.01)
+    assert record['lon_max'] == pytest.approx(-120.0 + (COLS - 1) * 0.01)
+
+    # ROI just past the swath's last row: only the padded query can reach it
+    roi = roi_of(range(ROWS + 2, ROWS + 6), range(45, 50))
+    assert mp.query_granule_catalog(catalog_path, roi_bounds=roi)
+    assert not mp.query_granule_catalog(catalog_path, roi_bounds=roi, margin_deg=0)